@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from network.client import Client as NetworkClient
+from network.client import Reply
 from network.fake.security import Encryption
 from network.base.loggable import DevNull, StdErr
 from network.base.exceptions import GenericError
@@ -8,16 +9,19 @@ from network.base.exceptions import GenericError
 from client import editor
 
 from protocol import client, server
-from util import misc
-from threading import Thread, Lock
+from util import misc, timer
+from threading import Thread, Lock, RLock
 from util.repl import the_worst_repl_you_will_ever_see
 import util.musicFuns
 import util.musicWrapper
 import util.composteProject
+import util.scoreFormat
 import json
 import music21
 import traceback
 import uuid
+import random
+import time
 import subprocess
 import shlex
 from PyQt5 import QtWidgets, QtCore, QtGui
@@ -32,7 +36,8 @@ class ComposteClient(QtCore.QObject):
     _chatToGUI = QtCore.pyqtSignal(str, name='_chatToGUI')
 
     def __init__(self, interactive_remote, broadcast_remote,
-                 logger, encryption_scheme, *args, **kwargs):
+                 logger, encryption_scheme, *args, heartbeat = 60,
+                 renew_every = 60 * 60, **kwargs):
         """
         RPC host for connecting to Composte Servers. Connects to a server
         listening at interactive_remote and broadcasting on on
@@ -41,6 +46,8 @@ class ComposteClient(QtCore.QObject):
         encryption_scheme.encrypt() and decrypted with
         encryption_scheme.decrypt().
         Broadcasts are handled with broadcast_handler
+        Subscriptions are kept alive with a heartbeat every heartbeat seconds,
+        and logins by renewing their token every renew_every seconds
         """
         super(ComposteClient, self).__init__(*args, **kwargs)
 
@@ -55,6 +62,30 @@ class ComposteClient(QtCore.QObject):
 
         self.__project = None
         self.__editor = None
+        # Handed to us on login, and sent along with requests made on behalf
+        # of the user we logged in as. What we logged in with is kept, so that
+        # we can log in again if the server stops accepting the token
+        self.__token = None
+        self.__credentials = None
+        self.__login_lock = Lock()
+
+        # Cookies of our subscriptions, which the server ends unless we keep
+        # sending heartbeats for them. Should it end one anyway, we subscribe
+        # again, so the cookie we handed out maps to
+        # [cookie the server knows it by now, username, project ID]
+        self.__cookies = {}
+        self.__cookie_lock = Lock()
+        self.__stopped = False
+        self.__heartbeat = timer.every(heartbeat, 1, self.__beat,
+                lambda: not self.__stopped)
+        self.__renewal = timer.every(renew_every, 1, self.__renew,
+                lambda: not self.__stopped)
+
+        # Updates applied locally that the server has yet to broadcast back,
+        # in the order they were applied. Guards the project as well, since
+        # broadcasts and replies arrive on threads of their own
+        self.__pending = []
+        self.__speculation_lock = RLock()
 
         self.__tts = False
 
@@ -115,11 +146,12 @@ class ComposteClient(QtCore.QObject):
 
         rpc_funs = {
             "update": self.__do_update,
+            "update_batch": self.__do_update_batch,
+            "patch": self.__apply_patch,
         }
 
         rpc = client.deserialize(rpc)
-        if self.__project is None or \
-           str(self.__project.projectID) != rpc["args"][0]:
+        if not self.__working_on(rpc["args"][0]):
             return
         f = rpc["fName"]
         if rpc["args"][1] == "chat":
@@ -138,14 +170,51 @@ class ComposteClient(QtCore.QObject):
                                 shell=True)
             return
 
-        do_rpc = rpc_funs.get(f, fail)
-        try:
-            (status, other) = do_rpc(*rpc['args'])
-            if status == 'ok':
-                startOffset, endOffset = other
-                self.__updateGui(startOffset, endOffset)
-        except Exception as e:
-            print(e)
+        # Broadcasts of updates carry the revision they bring the project to.
+        # Anything we already have is a duplicate, and anything past the next
+        # revision means that we missed something in between
+        revision = rpc.get("revision")
+        with self.__speculation_lock:
+            # We may have loaded another project since we last looked
+            if not self.__working_on(rpc["args"][0]):
+                return
+            own = self.__speculation(rpc.get("tag"))
+            if revision is not None:
+                if revision <= self.__project.revision:
+                    # If this is one of ours, we applied it again on top of
+                    # a resync that already included it
+                    if own is not None:
+                        self.__rebase(drop = [own])
+                    return
+                missed = revision > self.__project.revision + 1
+                if not missed and self.__pending and own is self.__pending[0]:
+                    # Ours, and nothing came in ahead of it: we already have
+                    # exactly what the server has
+                    self.__pending.pop(0)
+                    self.__project.revision = revision
+                    return
+
+            if revision is None or not missed:
+                do_rpc = rpc_funs.get(f, fail)
+                try:
+                    self.__rebase(lambda: do_rpc(*rpc['args']),
+                            [own] if own is not None else [])
+                    if revision is not None:
+                        self.__project.revision = revision
+                except Exception as e:
+                    print(e)
+                return
+
+        # Not under the lock, so that replies to speculative updates can
+        # still be settled while we wait
+        self.resync()
+
+    def __working_on(self, pid):
+        """
+        Whether pid is the project we have loaded
+        """
+        project = self.__project
+        return project is not None and str(project.projectID) == pid
 
     def __do_update(self, *args):
         project = lambda x : self.__project
@@ -158,6 +227,136 @@ class ComposteClient(QtCore.QObject):
             print(traceback.format_exc())
             return ('fail', 'error')
 
+    def __do_update_batch(self, pid, updates):
+        """
+        Apply a batch of updates broadcast by the server, in order. Returns
+        the range of offsets spanning everything the updates that succeeded
+        changed, or fails if none did
+        """
+        ranges = []
+        for (fname, args, partIndex, offset) in json.loads(updates):
+            (status, other) = self.__do_update(pid, fname, args, partIndex,
+                    offset)
+            if status == 'ok':
+                ranges.append(other)
+
+        if len(ranges) == 0:
+            return ('fail', 'error')
+        return ('ok', [min(r[0] for r in ranges), max(r[1] for r in ranges)])
+
+    def __apply_patch(self, pid, patch):
+        """
+        Bring the affected ranges of the project in line with the server's
+        copy, as described by ComposteServer.patch
+        """
+        return self.__patch(json.loads(patch))
+
+    def __patch(self, patch):
+        """
+        Replace the ranges of the project that a patch describes
+        """
+        ranges = []
+        for (index, start, end, records) in patch:
+            part = self.__project.parts[index]
+            util.scoreFormat.replaceRange(part, start, end, records)
+            ranges.append((start, end))
+
+        return ('ok', [min(r[0] for r in ranges), max(r[1] for r in ranges)])
+
+    def __speculation(self, tag):
+        """
+        Find the pending speculative update with the given tag, if any
+        """
+        if tag is None:
+            return None
+        for speculation in self.__pending:
+            if speculation.tag == tag:
+                return speculation
+        return None
+
+    def __speculate(self, speculation):
+        """
+        Apply a speculative update to the local copy of the project, and
+        remember how to undo it. The project is left as it was if the update
+        fails
+        """
+        (fname, args, partIndex, offset) = speculation.update
+        parts = self.__project.parts
+        if partIndex is None or partIndex == "None":
+            indices = range(len(parts))
+        else:
+            indices = [int(partIndex)]
+
+        # Only what the update could touch needs saving, rather than the
+        # whole part, since this is done again for every pending update
+        # whenever the server broadcasts one
+        undo = []
+        for i in indices:
+            (start, end) = util.musicWrapper.updateWindow(parts[i], fname,
+                    args)
+            undo.append([i, start, end,
+                         util.scoreFormat.encodeRange(parts[i], start, end)])
+
+        (status, other) = self.__do_update(str(self.__project.projectID),
+                fname, args, partIndex, offset)
+        if status != 'ok':
+            self.__patch(undo)
+            return (status, other)
+
+        speculation.undo = undo
+        speculation.changed = [float(other[0]), float(other[1])]
+        return (status, speculation.changed)
+
+    def __rebase(self, apply = lambda: ('ok', None), drop = []):
+        """
+        Take back the pending speculative updates, apply an update from the
+        server underneath them and apply them again, except for those in
+        drop, which the server either rejected or already applied. Pending
+        updates that no longer apply are dropped too; if the server accepts
+        them after all, they will be broadcast back like anybody else's
+        """
+        ranges = []
+        for speculation in reversed(self.__pending):
+            self.__patch(speculation.undo)
+            ranges.append(speculation.changed)
+        self.__pending = [ speculation for speculation in self.__pending
+                           if speculation not in drop ]
+
+        (status, other) = apply()
+        if status == 'ok' and other is not None:
+            ranges.append(other)
+
+        pending = []
+        for speculation in self.__pending:
+            (status, other) = self.__speculate(speculation)
+            if status == 'ok':
+                pending.append(speculation)
+                ranges.append(other)
+        self.__pending = pending
+
+        if len(ranges) > 0:
+            self.__updateGui(min(float(r[0]) for r in ranges),
+                             max(float(r[1]) for r in ranges))
+
+    def __settle(self, speculation, reply):
+        """
+        Act on the server's reply to a speculative update. Acceptance changes
+        nothing, since it is the broadcast of the update that confirms where
+        the server put it. Rejection takes the update back
+        """
+        try:
+            (status, other) = reply.result()
+        except Exception as e:
+            (status, other) = ("fail", str(e))
+
+        with self.__speculation_lock:
+            if speculation not in self.__pending:
+                return
+            if status == 'ok':
+                speculation.acknowledged = True
+            else:
+                self.__rebase(drop = [speculation])
+
     def __version_handshake(self):
         """
         Perform a version handshake with the remote Composte server
@@ -178,14 +377,8 @@ class ComposteClient(QtCore.QObject):
         Attempt to register a new user
         """
         msg = client.serialize("register", uname, pword, email)
-        reply = self.__client.send(msg)
-        if DEBUG: print(reply)
-        return server.deserialize(reply)
+        return self.__send_patiently(msg)
 
-    # We probably need cookies for login too, otherwise people can request
-    # project listings (and thus projects) and subscribe to projects they
-    # shouldn't be able to. This isn't an issue for the minimum deliverable
-    # for the course, but it is an issue in the long run
     def login(self, uname, pword):
         """
         login username password
@@ -193,10 +386,115 @@ class ComposteClient(QtCore.QObject):
         Attempt to login as a user
         """
         msg = client.serialize("login", uname, pword)
-        reply = self.__client.send(msg)
-        # status, reason = reply
-        if DEBUG: print(reply)
-        return server.deserialize(reply)
+        (status, other) = self.__send_patiently(msg)
+        if status == "ok":
+            # The token isn't any of the caller's business
+            with self.__login_lock:
+                self.__token = other.pop()
+                self.__credentials = (uname, pword)
+        return (status, other)
+
+    def __relogin(self, stale):
+        """
+        Log in again as we last did, now that the server refuses the token
+        stale. Returns whether we have a token other than stale to try
+        """
+        with self.__login_lock:
+            if self.__token != stale:
+                return True
+            if self.__credentials is None:
+                return False
+            msg = client.serialize("login", *self.__credentials)
+            (status, other) = self.__send_patiently(msg)
+            if status != "ok":
+                return False
+            self.__token = other.pop()
+            return True
+
+    def __renew(self):
+        """
+        Trade our token for one that expires later, well before it expires,
+        or log in again if the server no longer accepts it
+        """
+        token = self.__token
+        if token is None:
+            return
+
+        msg = client.serialize("renew", token)
+        (status, other) = server.deserialize(self.__client.send(msg))
+        with self.__login_lock:
+            if status == "ok":
+                if self.__token == token:
+                    self.__token = other[0]
+                return
+        self.__relogin(token)
+
+    def __send_authorized(self, request):
+        """
+        Send the message that request(**self.__session()) makes, without
+        waiting for the reply. If the server no longer accepts our token, log
+        in again and send it once more with the new one. Returns a
+        network.client.Reply that resolves to the reply
+        """
+        token = self.__token
+        retried = Reply()
+
+        def resend():
+            try:
+                if self.__relogin(token):
+                    msg = request(**self.__session())
+                    reply = self.__client.send(msg)
+                    reply = self.__deserialize(reply)
+                else:
+                    reply = ("fail", ["Not logged in"])
+                retried.set_result(reply)
+            except Exception as e:
+                retried.set_exception(e)
+
+        def settle(reply):
+            try:
+                reply = reply.result()
+            except Exception as e:
+                retried.set_exception(e)
+                return
+            if reply[0] == "fail" and reply[1] == ["Not logged in"]:
+                # Logging in waits on a reply, which is received by the very
+                # thread this runs on
+                Thread(target = resend).start()
+            else:
+                retried.set_result(reply)
+
+        msg = request(**self.__session())
+        self.__client.send_async(msg, self.__deserialize) \
+                .add_done_callback(settle)
+        return retried
+
+    def __send_patiently(self, msg, attempts = 6, backoff = 0.1):
+        """
+        Send a request that the server may turn away while it is busy hashing
+        other people's passwords, trying again after a while, up to attempts
+        times. The wait doubles each time, starting at backoff seconds, and
+        is randomized so that turned away clients don't all come back at once
+        """
+        for attempt in range(attempts):
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1) *
+                        random.uniform(0.5, 1.5))
+            reply = self.__client.send(msg)
+            if DEBUG: print(reply)
+            reply = server.deserialize(reply)
+            if reply[0] != "fail" or reply[1] != ["Server busy, try again"]:
+                break
+        return reply
+
+    def __session(self):
+        """
+        Retrieve the fields that identify requests as made by the user we
+        logged in as
+        """
+        if self.__token is None:
+            return {}
+        return { "token": self.__token }
 
     def create_project(self, uname, pname, metadata):
         """
@@ -225,10 +523,9 @@ class ComposteClient(QtCore.QObject):
 
         Allow another person to contribute to your project
         """
-        msg = client.serialize("share", pid, new_contributor)
-        reply = self.__client.send(msg)
-        if DEBUG: print(reply)
-        return server.deserialize(reply)
+        return self.__send_authorized(lambda **session:
+                client.serialize("share", pid, new_contributor, **session)) \
+                .result()
 
     def retrieve_project_listings_for(self, uname):
         """
@@ -236,9 +533,8 @@ class ComposteClient(QtCore.QObject):
 
         Get a list of all projects this user is a collaborator on
         """
-        msg = client.serialize("list_projects", uname)
-        reply = self.__client.send(msg)
-        return server.deserialize(reply)
+        return self.__send_authorized(lambda **session:
+                client.serialize("list_projects", uname, **session)).result()
 
     def get_project(self, pid):
         """
@@ -246,40 +542,151 @@ class ComposteClient(QtCore.QObject):
 
         Given a uuid, get the project to work on
         """
-        msg = client.serialize("get_project", pid)
-        reply = server.deserialize(self.__client.send(msg))
-        if DEBUG: print(reply)
-        status, ret = reply
+        msg = client.serialize("get_project_frames", pid)
+        frames = self.__client.send(msg, multipart = True)
+        (status, ret, payloads) = server.deserialize_frames(frames)
+        if DEBUG: print((status, ret))
         if status == 'ok':
-            print(type(ret))
-            realProj = json.loads(ret[0])
-            self.__project = util.composteProject.deserializeProject(realProj)
-        return reply
+            self.__listen_to(pid)
+            with self.__speculation_lock:
+                self.__project = self.__load_project(ret, payloads)
+                self.__pending = []
+        return (status, ret)
+
+    def resync(self):
+        """
+        resync
+
+        Catch up on the updates to the current project that we missed,
+        fetching the whole project again only if the server no longer has them
+        """
+        if self.__project is None:
+            return ("fail", "No project to resync")
+
+        pid = str(self.__project.projectID)
+        msg = client.serialize("get_project_since", pid,
+                self.__project.revision)
+        frames = self.__client.send(msg, multipart = True)
+        (status, ret, payloads) = server.deserialize_frames(frames)
+        if DEBUG: print((status, ret))
+        if status != 'ok':
+            return (status, ret)
+
+        with self.__speculation_lock:
+            # The updates the server has accepted are in what we fetched
+            acknowledged = [ speculation for speculation in self.__pending
+                             if speculation.acknowledged ]
+            self.__rebase(lambda: self.__catch_up(pid, ret, payloads),
+                    acknowledged)
+        return ("ok", [self.__project.revision])
+
+    def __catch_up(self, pid, ret, payloads):
+        """
+        Bring the project up to date with what get_project_since replied
+        """
+        if ret[0] == "snapshot":
+            self.__project = self.__load_project(ret[1:], payloads)
+            end = max([ part.highestTime for part in self.__project.parts ])
+            return ("ok", [0.0, float(end)])
+
+        ranges = []
+        for record in json.loads(ret[1]):
+            (revision, fname, args, partIndex, offset) = record
+            (status, other) = self.__do_update(pid, fname, args, partIndex,
+                    offset)
+            self.__project.revision = revision
+            if status == 'ok':
+                ranges.append(other)
+
+        if len(ranges) == 0:
+            return ("ok", None)
+        return ("ok", [min(r[0] for r in ranges), max(r[1] for r in ranges)])
+
+    def __load_project(self, header, payloads):
+        """
+        Build a project out of the frames that the server transmits it as
+        """
+        (metadata, id_, revision) = header
+        parts = [ util.scoreFormat.decodePart(payload)
+                  for payload in payloads ]
+        project = util.composteProject.ComposteProject(json.loads(metadata),
+                parts, uuid.UUID(id_))
+        project.revision = int(revision)
+        return project
+
+    def __listen_to(self, pid):
+        """
+        Only hear broadcasts about the project we are working on. The server
+        publishes updates under their project ID, so everything else is
+        filtered out before it ever reaches us.
+        """
+        if self.__project is not None:
+            self.__client.unsubscribe(str(self.__project.projectID))
+        self.__client.subscribe(pid)
 
-    # Realistically, we send a login cookie and the server determines the user
-    # from that, but we don't have that yet
     def subscribe(self, uname, pid):
         """
         subscribe username project-id
 
         Subscribe to updates to a project
         """
-        msg = client.serialize("subscribe", uname, pid)
-        reply = self.__client.send(msg)
-        # print(reply)
-        j = json.loads(reply)
-        if DEBUG: print(j[1][0])
-        return server.deserialize(reply)
+        (status, other) = self.__subscribe(uname, pid)
+        if status == "ok":
+            with self.__cookie_lock:
+                self.__cookies[other[0]] = [other[0], uname, pid]
+        return (status, other)
+
+    def __subscribe(self, uname, pid):
+        """
+        Ask the server for a subscription, without keeping it alive
+        """
+        return self.__send_authorized(lambda **session:
+                client.serialize("subscribe", uname, pid, **session)).result()
 
     def unsubscribe(self, cookie):
         """
         Unsubscribe to updates to a project
         """
+        with self.__cookie_lock:
+            (cookie, _, _) = self.__cookies.pop(cookie, [cookie, None, None])
         msg = client.serialize("unsubscribe", cookie)
         reply = self.__client.send(msg)
         if DEBUG: print(reply)
         return server.deserialize(reply)
 
+    def __beat(self):
+        """
+        Tell the server that we are still here, so that it doesn't end our
+        subscriptions, and subscribe again where it did anyway
+        """
+        with self.__cookie_lock:
+            cookies = [ (ours, list(session))
+                        for (ours, session) in self.__cookies.items() ]
+
+        # All in flight at once, rather than a round trip each
+        replies = [ (ours, session, self.__client.send_async(
+                        client.serialize("heartbeat", session[0]),
+                        self.__deserialize))
+                    for (ours, session) in cookies ]
+
+        for (ours, (cookie, uname, pid), reply) in replies:
+            (status, other) = reply.result()
+            if status != "fail" or other != ["You are not subscribed"]:
+                continue
+
+            # The server ended the subscription, most likely because we went
+            # quiet for too long, so start another in its place
+            (status, other) = self.__subscribe(uname, pid)
+            if status != "ok":
+                continue
+            with self.__cookie_lock:
+                session = self.__cookies.get(ours)
+                if session is not None and session[0] == cookie:
+                    session[0] = other[0]
+                    continue
+            # Unsubscribed from while we were at it
+            self.__client.send(client.serialize("unsubscribe", other[0]))
+
     # There's nothing here yet b/c we don't know what anything look like
     def update(self, pid, fname, args, partIndex = None, offset = None):
         """
@@ -288,12 +695,88 @@ class ComposteClient(QtCore.QObject):
         Send a music related update for the remote backend to process. args is
         a tuple of arguments
         """
+        reply = self.update_async(pid, fname, args, partIndex, offset)
+        return reply.result()
+
+    def update_async(self, pid, fname, args, partIndex = None, offset = None):
+        """
+        Like update, but without waiting for the reply. Returns a
+        network.client.Reply that resolves to the reply
+        """
         args = json.dumps(args)
-        msg = client.serialize("update", pid, fname, args, partIndex, offset)
-        reply = self.__client.send(msg)
+        return self.__send_authorized(lambda **session:
+                client.serialize("update", pid, fname, args, partIndex,
+                    offset, **session))
+
+    def __deserialize(self, reply):
         if DEBUG: print(reply)
         return server.deserialize(reply)
 
+    def update_batch(self, pid, updates):
+        """
+        Send a list of music related updates for the remote backend to
+        process as a unit, in one round trip. updates is a list of
+        (update-type, args, partIndex, offset) tuples, as they would be passed
+        to update
+        """
+        return self.update_batch_async(pid, updates).result()
+
+    def update_batch_async(self, pid, updates):
+        """
+        Like update_batch, but without waiting for the reply. Returns a
+        network.client.Reply that resolves to the reply
+        """
+        updates = [ (fname, json.dumps(args), partIndex, offset)
+                    for (fname, args, partIndex, offset) in updates ]
+        updates = json.dumps(updates)
+        return self.__send_authorized(lambda **session:
+                client.serialize("update_batch", pid, updates, **session))
+
+    def pipelined(self):
+        """
+        Get a view of this client whose updates do not wait for replies
+        """
+        return Pipelined(self)
+
+    def speculate(self, pid, fname, args, partIndex = None, offset = None):
+        """
+        Apply a music related update to our copy of the project right away,
+        then send it for the remote backend to process, without waiting for
+        the reply. The update is pending until the server broadcasts it back.
+        If the server rejects it, it is taken back out, and if other updates
+        are broadcast ahead of it, it is applied again on top of them.
+        Returns the result of applying the update locally
+        """
+        if fname == "chat" or not self.__working_on(pid):
+            return self.update(pid, fname, args, partIndex, offset)
+
+        # Our own updates are broadcast back to us along with their tag
+        speculation = Speculation(uuid.uuid4().hex,
+                (fname, json.dumps(args), partIndex, offset))
+
+        with self.__speculation_lock:
+            (status, other) = self.__speculate(speculation)
+            if status != 'ok':
+                return (status, other)
+            self.__pending.append(speculation)
+
+            # Sent under the lock, so that the server receives our updates in
+            # the order we applied them
+            reply = self.__send_authorized(lambda **session:
+                    client.serialize("update", pid, *speculation.update,
+                        tag = speculation.tag, **session))
+
+        reply.add_done_callback(lambda r: self.__settle(speculation, r))
+        self.__updateGui(*other)
+        return (status, other)
+
+    def speculative(self):
+        """
+        Get a view of this client whose updates are applied locally before
+        the server has seen them. See ComposteClient.speculate
+        """
+        return Speculative(self)
+
     def chat(self, pid, from_, *message_parts):
         """
         chat project-id sender [message-parts]
@@ -487,8 +970,83 @@ class ComposteClient(QtCore.QObject):
         """
         Stop the client elegantly
         """
+        self.__stopped = True
+        self.__heartbeat.join()
+        self.__renewal.join()
         self.__client.stop()
 
+class Pipelined:
+    """
+    View of a ComposteClient whose music related updates return as soon as
+    they are sent. Each returns a network.client.Reply instead, which can be
+    waited on or awaited, so that any number of updates can be in flight at
+    once:
+
+        pipe = client.pipelined()
+        replies = [ pipe.insertNote(pid, offset, 0, "C4", 1.0)
+                    for offset in offsets ]
+        # or, from a coroutine: await pipe.insertNote(...)
+
+    The server may apply updates that are in flight at the same time in any
+    order. Wait for the replies to updates that depend on each other, or send
+    them together with update_batch.
+    """
+    def __init__(self, composte_client):
+        self.__client = composte_client
+
+    def update(self, pid, fname, args, partIndex = None, offset = None):
+        return self.__client.update_async(pid, fname, args, partIndex, offset)
+
+    def update_batch(self, pid, updates):
+        return self.__client.update_batch_async(pid, updates)
+
+    # The updates themselves are ComposteClient's, which are all written in
+    # terms of update
+    changeKeySignature = ComposteClient.changeKeySignature
+    insertNote = ComposteClient.insertNote
+    removeNote = ComposteClient.removeNote
+    insertMetronomeMark = ComposteClient.insertMetronomeMark
+    removeMetronomeMark = ComposteClient.removeMetronomeMark
+    transpose = ComposteClient.transpose
+    insertClef = ComposteClient.insertClef
+    removeClef = ComposteClient.removeClef
+    insertMeasures = ComposteClient.insertMeasures
+    addInstrument = ComposteClient.addInstrument
+    removeInstrument = ComposteClient.removeInstrument
+    addDynamic = ComposteClient.addDynamic
+    removeDynamic = ComposteClient.removeDynamic
+    addLyric = ComposteClient.addLyric
+    chat = ComposteClient.chat
+
+class Speculative(Pipelined):
+    """
+    View of a ComposteClient whose music related updates are applied to the
+    local copy of the project immediately, with ComposteClient.speculate.
+    Batches are merely pipelined
+    """
+    def __init__(self, composte_client):
+        super(Speculative, self).__init__(composte_client)
+        self.__client = composte_client
+
+    def update(self, pid, fname, args, partIndex = None, offset = None):
+        return self.__client.speculate(pid, fname, args, partIndex, offset)
+
+class Speculation:
+    """
+    An update applied to the local copy of a project ahead of the server
+    """
+    def __init__(self, tag, update):
+        self.tag = tag
+        # (fname, args, partIndex, offset), args serialized
+        self.update = update
+        # A patch that undoes the update, as ComposteServer.patch describes
+        self.undo = None
+        # The range of offsets the update reported changing, to redraw when
+        # it is taken back
+        self.changed = None
+        # Whether the server replied that it accepted the update
+        self.acknowledged = False
+
 if __name__ == "__main__":
     import sys
 
@@ -539,6 +1097,7 @@ if __name__ == "__main__":
             "list-projects": c.retrieve_project_listings_for,
             "create-project": c.create_project,
             "get-project": c.get_project,
+            "resync": c.resync,
             "subscribe": c.subscribe,
             "unsubscribe": c.unsubscribe,
             "share": c.share,
@@ -1,10 +1,5 @@
 #!/usr/bin/env python3
 
-# Things that should probably be a thing:
-# * Login cookies alongside project subscription cookies
-# * Separation of broadcasts per project (regardless of encryption)
-#       Would require moving from single broadcast to some other strategy
-
 from network.server import Server as NetworkServer
 from network.fake.security import Encryption
 from network.base.loggable import DevNull, StdErr, Combined
@@ -13,9 +8,12 @@ from network.conf import logging as networkLog
 
 from protocol import client, server
 from auth import auth
-from database import driver
+from auth.tokens import Tokens
+from db import driver, cache
 
 from util import musicWrapper, bookkeeping, composteProject, timer, misc
+from util import scoreFormat
+from util.journal import Journal, History
 
 from threading import Thread, Lock
 import uuid
@@ -28,22 +26,27 @@ import traceback
 class ComposteServer:
     __project_extension = ".heap"
     __metadata_extension = ".meta"
+    __journal_extension = ".log"
 
     # I'm so sorry
     __register_lock = Lock()
 
     def __init__(self, interactive_port, broadcast_port,
-            logger, encryption_scheme, data_root = "data/"):
+            logger, encryption_scheme, data_root = "data/", workers = 16,
+            patches = False, session_timeout = 600):
         """
         Start a Composte Server listening on interactive_port and broadcasting
         on broadcast_port. Logs are directed to logger, messages are
         transparently encrypted with encryption_scheme.encrypt() and
         encryption_scheme.decrypt(), and data is stored in the directory
-        data_root.
+        data_root. Requests are handled by workers threads concurrently.
+        If patches is set, clients are sent the elements that an update
+        changed rather than the update itself. Subscriptions of clients that
+        send no heartbeat for session_timeout seconds are ended.
         """
 
         self.__server = NetworkServer(interactive_port, broadcast_port,
-                logger, encryption_scheme)
+                logger, encryption_scheme, workers)
 
         self.__server.start_background(self.__handle, self.__preprocess,
                 self.__postprocess)
@@ -51,42 +54,85 @@ class ComposteServer:
         self.__users        = None
         self.__projects     = None
         self.__contributors = None
+        self.__db_lock      = Lock()
 
         self.version = misc.get_version()
         self.__server.info("Composte server version {}".format(self.version))
 
         self.__data_root = data_root
+        self.__patches = patches
         self.__project_root = os.path.join(self.__data_root, "users")
 
         self.__dlock = Lock()
         self.__done = False
 
+        # Work on a project happens under its lock in the pool
         self.__pool = bookkeeping.ProjectPool()
-        # A better solution would have a lock for every project, but in a
-        # classroom demo this won't be an issue
-        self.__flushing = Lock()
+
+        self.__flush_lock = Lock()
+        self.__flush_stats = {
+            "flushed": 0,
+            "skipped": 0,
+            "bytes": 0,
+        }
 
         def is_done(self):
             with self.__dlock:
                 return not self.__done
 
-        self.__timer = timer.every(300, 2,
-                lambda: self.__pool.map(self.flush_project),
+        self.__timer = timer.every(300, 2, self.flush_all,
                 lambda: is_done(self))
 
+        self.sessions = bookkeeping.SessionTable()
+        self.__session_timeout = session_timeout
+        self.__sweeper = timer.every(min(60, session_timeout), 2,
+                self.expire_sessions, lambda: is_done(self))
+
         try:
             os.makedirs(self.__project_root)
         except FileExistsError as e:
             pass
 
-        self.sessions = {}
+        # Logging in hands out a token, with which later requests prove who
+        # made them without the password
+        self.__tokens = Tokens()
 
     def flush_project(self, project, count):
         """
-        Flush project to backing storage
+        Flush project to backing storage, unless nothing changed since the
+        last time it was persisted
+        """
+        pid = str(project.projectID)
+        with self.__pool.lock(pid):
+            generation = self.__pool.dirty(pid)
+            if generation is None:
+                with self.__flush_lock:
+                    self.__flush_stats["skipped"] += 1
+                return
+
+            written = self.write_project(project)
+            self.__pool.persisted(pid, generation)
+
+        with self.__flush_lock:
+            self.__flush_stats["flushed"] += 1
+            self.__flush_stats["bytes"] += written
+
+    def flush_all(self):
+        """
+        Flush all pooled projects that changed to backing storage
+        """
+        self.__pool.map(self.flush_project)
+        stats = self.flush_stats()
+        self.__server.info("Flushed {} projects ({} bytes), skipped {}"
+                .format(stats["flushed"], stats["bytes"], stats["skipped"]))
+
+    def flush_stats(self):
+        """
+        Retrieve counters of projects flushed, projects skipped because they
+        were clean, and bytes written since the server started
         """
-        with self.__flushing:
-            self.write_project(project)
+        with self.__flush_lock:
+            return dict(self.__flush_stats)
 
     # Database interactions
 
@@ -94,7 +140,10 @@ class ComposteServer:
         """
         Register a new user. Username must be unique per user database.
         """
-        hash_ = auth.hash(pword)
+        try:
+            hash_ = auth.hash(pword)
+        except auth.Busy:
+            return ("fail", "Server busy, try again")
 
         with ComposteServer.__register_lock:
             hopefully_None = self.__users.get(uname)
@@ -119,20 +168,53 @@ class ComposteServer:
 
     def login(self, uname, pword):
         """
-        Log a user in
+        Log a user in, handing them a token to authenticate later requests
+        with. Only the password gets a user a new token; see renew
         """
         record = self.__users.get(uname)
         if record.hash is None:
             return ("fail", "failed to login")
 
-        success = auth.verify(pword, record.hash)
+        try:
+            success = auth.verify(pword, record.hash)
+        except auth.Busy:
+            return ("fail", "Server busy, try again")
+
         if success:
             uuids = self.__contributors.get_projects(uname)
             project_ids = [ str(uuid_) for uuid_ in uuids ]
-            return ("ok", json.dumps(project_ids))
+            return ("ok", json.dumps(project_ids), self.__tokens.issue(uname))
         else:
             return ("fail", "failed to login")
 
+    def renew(self, token):
+        """
+        Trade a token that has yet to expire for one that expires later,
+        without the password. Renewed tokens still expire a while after the
+        user last logged in with their password
+        """
+        renewed = self.__tokens.renew(token)
+        if renewed is None:
+            return ("fail", "Not logged in")
+        return ("ok", renewed)
+
+    def __authorize(self, token, username = None, pid = None):
+        """
+        Check that token was issued to username, or to a contributor to pid.
+        Returns None if so, and the reply to fail with if not
+        """
+        user = self.__tokens.verify(token)
+        if user is None:
+            return ("fail", "Not logged in")
+        if username is not None and user != username:
+            return ("fail", "Not logged in as {}".format(username))
+        if pid is not None:
+            contributors = self.__contributors.get(project_id = pid)
+            if user not in [ contributor.uname for contributor
+                             in contributors ]:
+                return ("fail", "You are not a contributor")
+        return None
+
     def create_project(self, uname, pname, metadata):
         """
         Create a new Composte project. Projects are given unique identifiers,
@@ -177,13 +259,63 @@ class ComposteServer:
         Retrieve the serialized form of a project for transmission. Currently
         only used during the initial handshake.
         """
-        proj = self.__pool.put(pid, lambda: self.get_project(pid)[1])
-        self.__pool.remove(pid)
+        with self.__pool.lock(pid):
+            proj = self.__pool.put(pid, lambda: self.get_project(pid)[1])
+            self.__pool.remove(pid)
 
-        if type(proj) == str:
-            return ("fail", "What even is that")
+            if type(proj) == str:
+                return ("fail", "What even is that")
 
-        return ("ok", json.dumps(proj.serialize()))
+            return ("ok", json.dumps(proj.serialize()))
+
+    def get_project_frames(self, pid):
+        """
+        Retrieve a project for transmission as a multipart reply. The
+        metadata, project ID and revision travel in the header, and each part
+        travels in its own frame in the native score format, so nothing needs
+        to be escaped into JSON on the way.
+        """
+        with self.__pool.lock(pid):
+            proj = self.__pool.put(pid, lambda: self.get_project(pid)[1])
+            self.__pool.remove(pid)
+
+            if type(proj) == str:
+                return ("fail", "What even is that")
+
+            return ("ok", self.project_frames(proj))
+
+    def get_project_since(self, pid, revision):
+        """
+        Retrieve what a client holding a project at revision is missing. If
+        the updates since then are still retained, the header of the reply is
+        [ "delta", JSON list of update records ]. Otherwise the client gets
+        the whole project back, as with get_project_frames, but with a header
+        of [ "snapshot", *header ].
+        """
+        with self.__pool.lock(pid):
+            proj = self.__pool.put(pid, lambda: self.get_project(pid)[1])
+            self.__pool.remove(pid)
+
+            if type(proj) == str:
+                return ("fail", "What even is that")
+
+            records = proj.history.since(int(revision))
+            if records is not None:
+                return ("ok", server.Frames(["delta", json.dumps(records)], []))
+
+            frames = self.project_frames(proj)
+            frames.header.insert(0, "snapshot")
+            return ("ok", frames)
+
+    def project_frames(self, project):
+        """
+        Produce the frames that a project is transmitted as. The caller must
+        hold the lock of the project
+        """
+        header = [json.dumps(project.metadata), str(project.projectID),
+                project.revision]
+        payloads = [ scoreFormat.encodePart(part) for part in project.parts ]
+        return server.Frames(header, payloads)
 
     def get_project(self, pid):
         """
@@ -201,10 +333,14 @@ class ComposteServer:
 
         return ("ok", proj)
 
-    def list_projects_by_user(self, uname):
+    def list_projects_by_user(self, uname, token = None):
         """
         Retrieve a list of projects that a user is a collaborator on
         """
+        failure = self.__authorize(token, username = uname)
+        if failure is not None:
+            return failure
+
         listings = self.__contributors.get(username = uname)
         listings = [ str(project) for project in listings ]
         return ("ok", json.dumps(listings))
@@ -233,49 +369,78 @@ class ComposteServer:
 
     # Utility
 
+    def project_path(self, owner, pid):
+        """
+        Where the files backing a project live, minus their extensions
+        """
+        return os.path.join(self.__project_root, owner, str(pid))
+
+    def journal(self, project):
+        """
+        The journal of updates applied to a project since it was last written
+        """
+        base_path = self.project_path(project.metadata["owner"],
+                project.projectID)
+        return Journal(base_path + self.__journal_extension)
+
     def write_project(self, project):
         """
         I'm going to cheat for now and dump to the filesystem. Ideally we
         write to a database, but that requires more work. Either way, that can
-        be hidden in this function
+        be hidden in this function. Returns the number of bytes written.
+
+        This snapshots the project: the heap records the revision it
+        includes, and the journal is compacted past it.
         """
-        user = project.metadata["owner"]
-        id_ = str(project.projectID)
+        metadata = json.dumps(project.metadata)
+        heap = scoreFormat.writeHeap(project.revision, project.parts)
 
-        (metadata, parts, _) = project.serialize()
+        base_path = self.project_path(project.metadata["owner"],
+                project.projectID)
+        misc.write_atomically(base_path + self.__metadata_extension, metadata)
+        misc.write_atomically(base_path + self.__project_extension, heap)
 
-        base_path = os.path.join(self.__project_root, user)
-        base_path = os.path.join(base_path, id_)
-        with open(base_path + self.__metadata_extension, "w") as f:
-            f.write(metadata)
+        # If we die before this, replay skips what the heap already has
+        self.journal(project).truncate(project.revision)
 
-        with open(base_path + self.__project_extension, "w") as f:
-            f.write(parts)
+        return len(metadata.encode()) + len(heap)
 
     def read_project(self, pid):
         """
         We've cheated and the projects live on the filesystem. Ideally we want
         them in a database, but that's work. Either way, we hide the true
         locations of projects inside of this function.
+
+        Updates journaled since the last snapshot are replayed on top.
         """
 
         owner = self.__projects.get(pid).owner
+        base_path = self.project_path(owner, pid)
 
-        filename = pid + self.__metadata_extension
-        relpath = os.path.join(owner, filename)
-        fullpath = os.path.join(self.__project_root, relpath)
-        with open(fullpath, "r") as f:
+        with open(base_path + self.__metadata_extension, "r") as f:
             metadata = f.read()
 
-        filename = pid + self.__project_extension
-        relpath = os.path.join(owner, filename)
-        fullpath = os.path.join(self.__project_root, relpath)
-        with open(fullpath, "r") as f:
-            parts = f.read()
+        with open(base_path + self.__project_extension, "rb") as f:
+            heap = f.read()
+
+        (revision, parts) = scoreFormat.readHeap(heap)
+
+        project = composteProject.ComposteProject(json.loads(metadata),
+                parts, uuid.UUID(pid))
+        project.revision = revision
+        project.history = History(revision)
+
+        for record in self.journal(project).records(revision):
+            (revision, fname, args, partIndex, offset) = record
+            try:
+                musicWrapper.performMusicFun(pid, fname, args, partIndex,
+                        offset, fetchProject = lambda _: project)
+            except:
+                self.__server.error("Failed to replay {} onto {}: {}"
+                        .format(record, pid, traceback.format_exc()))
+            project.revision = revision
+            project.history.append(*record)
 
-        project = composteProject.deserializeProject(
-            (metadata, parts, pid)
-        )
         # Don't put it into the pool yet, because then we end up with a
         # use count that will never be 0 again
         return project
@@ -283,15 +448,11 @@ class ComposteServer:
     # Cookie: uuid
     def generate_cookie_for(self, user, project):
         """
-        We don't bother checking for UUID collisions, since they "don't"
-        happen
+        Start a session of user subscribed to project, and retrieve its cookie
         """
-        cookie = uuid.uuid4()
-        self.sessions[cookie] = (user, project)
-        return cookie
+        return self.sessions.open(user, project)
 
     # Session: {user, project_id}
-    # May need login cookies too
     def cookie_to_session(self, cookie):
         """
         Retrieve the session associated with a cookie
@@ -301,11 +462,7 @@ class ComposteServer:
         except ValueError as e:
             return ("fail", "That doesn't look like a cookie")
 
-        try:
-            session = self.sessions[cookie]
-        except KeyError as e:
-            return None
-        return session
+        return self.sessions.get(cookie)
 
     def remove_cookie(self, cookie):
         """
@@ -316,21 +473,52 @@ class ComposteServer:
         except ValueError as e:
             return ("fail", "That doesn't look like a cookie")
 
-        try:
-            del self.sessions[cookie]
-        except KeyError as e:
+        if self.sessions.close(cookie) is None:
             return ("fail", "Who are you")
 
         return ("ok", "")
 
-    def do_update(self, *args):
+    def heartbeat(self, cookie):
+        """
+        Keep the session associated with a cookie from expiring
+        """
+        try:
+            cookie = uuid.UUID(cookie)
+        except ValueError as e:
+            return ("fail", "That doesn't look like a cookie")
+
+        if not self.sessions.touch(cookie):
+            return ("fail", "You are not subscribed")
+
+        return ("ok", "")
+
+    def expire_sessions(self):
+        """
+        End the sessions of clients that have not sent a heartbeat in a
+        while, most likely because they went away without unsubscribing, and
+        unpin their projects
+        """
+        expired = self.sessions.expire(self.__session_timeout)
+        for (user, project_id) in expired:
+            self.__pool.remove(project_id,
+                    lambda x: self.flush_project(x, 0))
+
+        if len(expired) > 0:
+            self.__server.info("Expired {} idle sessions".format(len(expired)))
+
+    def do_update(self, *args, tag = None, token = None):
         """
         Perform a music-related update, deferring to
-        musicWrapper.performMusicFperformMusicFun
+        musicWrapper.performMusicFperformMusicFun. The update is broadcast
+        along with tag, by which its sender can recognize it
         """
+        failure = self.__authorize(token, pid = args[0])
+        if failure is not None:
+            return failure
 
         # Use this function to get a project
-        pid_ = None
+        pid_ = args[0]
+        fetched = []
         def get_fun(pid):
             """
             Fetch a project from the cache
@@ -338,30 +526,164 @@ class ComposteServer:
             # The client musicfuns shouldn't have to worry about how the
             # server manages the lifetimes of project objects
             proj = self.__pool.put(pid, lambda: self.get_project(pid)[1])
-            # We need to steal the pid to release it later
-            pid_ = pid
+            fetched.append(proj)
             return proj
 
-        with self.__flushing:
+        # Updates to other projects proceed concurrently
+        with self.__pool.lock(pid_):
+            try:
+                return self.__apply_update(args, tag, get_fun, fetched)
+            finally:
+                # Every fetch took a reference to the project. Dropping the
+                # last one flushes it, which has to wait until the update is
+                # journaled and broadcast
+                for _ in fetched:
+                    self.__pool.remove(pid_,
+                            lambda x: self.flush_project(x, 0))
+
+    def __apply_update(self, args, tag, get_fun, fetched):
+        """
+        Apply an update to the project that get_fun fetches into fetched,
+        journal it and broadcast it. The caller must hold the lock of the
+        project
+        """
+        pid_ = args[0]
+        try:
+            # We still need to provide a way to get the project
+            reply = musicWrapper.performMusicFun(*args,
+                    fetchProject = get_fun)
+        except:
+            print(traceback.format_exc())
+            return ("fail", "Internal Server Error")
+
+        if reply[0] != "ok":
+            return reply
+
+        # Chat goes through here too, but doesn't change anything
+        revision = None
+        if args[1] != "chat":
+            (project,) = fetched
+            project.revision += 1
+            # The update is only durable once it is journaled, so this
+            # has to happen before the client hears back
+            self.journal(project).append(project.revision, *args[1:])
+            project.history.append(project.revision, *args[1:])
+            self.__pool.touch(pid_)
+            revision = project.revision
+
+        # Only subscribers to the project that changed hear about it.
+        # Broadcasting under the lock keeps broadcasts in revision order,
+        # which clients rely on to notice that they missed something
+        if self.__patches and revision is not None:
+            patch = self.patch(project, args[3], *reply[1])
+            message = client.serialize("patch", pid_, json.dumps(patch),
+                    revision = revision, tag = tag)
+        else:
+            message = client.serialize("update", *args,
+                    revision = revision, tag = tag)
+        self.__server.broadcast(message, pid_)
+        return reply
+
+    def do_update_batch(self, pid, updates, tag = None, token = None):
+        """
+        Perform a list of music-related updates to a project as a unit: the
+        updates are applied in order, and either all of them are applied or
+        none of them are. They share a single revision and are broadcast
+        together.
+        updates is a JSON list of [ fname, args, partIndex, offset ], each of
+        which is what do_update expects after the project ID. As with
+        do_update, the batch is broadcast along with tag
+        """
+        failure = self.__authorize(token, pid = pid)
+        if failure is not None:
+            return failure
+
+        updates = json.loads(updates)
+        if len(updates) == 0:
+            return ("fail", "No updates")
+        if any(update[0] == "chat" for update in updates):
+            return ("fail", "Chat cannot be batched")
+
+        with self.__pool.lock(pid):
+            project = self.__pool.put(pid, lambda: self.get_project(pid)[1])
             try:
-                # We still need to provide a way to get the project
-                reply = musicWrapper.performMusicFun(*args,
-                        fetchProject = get_fun)
+                if type(project) == str:
+                    return ("fail", "What even is that")
+                return self.__apply_batch(project, pid, updates, tag)
+            finally:
+                self.__pool.remove(pid, lambda x: self.flush_project(x, 0))
+
+    def __apply_batch(self, project, pid, updates, tag):
+        """
+        Apply a batch of updates to a project. The caller must hold the lock
+        of the project
+        """
+        # Enough to put things back the way they were if an update fails
+        saved = [ scoreFormat.encodePart(part) for part in project.parts ]
+
+        ranges = []
+        for (i, (fname, args, partIndex, offset)) in enumerate(updates):
+            try:
+                reply = musicWrapper.performMusicFun(pid, fname, args,
+                        partIndex, offset, fetchProject = lambda _: project)
             except:
                 print(traceback.format_exc())
-                return ("fail", "Internal Server Error")
-            return reply
+                reply = ("fail", "Internal Server Error")
+
+            if reply[0] != "ok":
+                project.parts[:] = [ scoreFormat.decodePart(blob)
+                                     for blob in saved ]
+                return ("fail", "Update {} failed: {}".format(i, reply[1]))
+            ranges.append(reply[1])
+
+        project.revision += 1
+        records = [ (project.revision, *update) for update in updates ]
+        self.journal(project).extend(records)
+        for record in records:
+            project.history.append(*record)
+        self.__pool.touch(pid)
+
+        if self.__patches:
+            patch = []
+            for ((_, _, partIndex, _), (start, end)) in zip(updates, ranges):
+                patch += self.patch(project, partIndex, start, end)
+            message = client.serialize("patch", pid, json.dumps(patch),
+                    revision = project.revision, tag = tag)
+        else:
+            message = client.serialize("update_batch", pid,
+                    json.dumps(updates), revision = project.revision,
+                    tag = tag)
+        self.__server.broadcast(message, pid)
 
-            # We can't decrement the refcount before now, because we could
-            # cause an early flush otherwise, and then serverside persistence
-            # is breaks.
-            self.__pool.remove(pid_, self.write_project)
+        return ("ok", [min(start for (start, _) in ranges),
+                       max(end for (_, end) in ranges)])
 
-    def subscribe(self, username, pid):
+    def patch(self, project, partIndex, start, end):
+        """
+        Describe the elements of a project between start and end after an
+        update to the part at partIndex, or to every part if there is none.
+        Clients replace what they have between start and end in each part
+        with what the patch lists:
+            [ [ partIndex, start, end, [ records ] ] ]
+        """
+        if partIndex is None or partIndex == "None":
+            indices = range(len(project.parts))
+        else:
+            indices = [int(partIndex)]
+
+        return [ [index, start, end,
+                  scoreFormat.encodeRange(project.parts[index], start, end)]
+                 for index in indices ]
+
+    def subscribe(self, username, pid, token = None):
         """
         Subscribe a client to updates for a project. Pins the project in the
         cache
         """
+        failure = self.__authorize(token, username = username)
+        if failure is not None:
+            return failure
+
         # Assert permission
         contributors = self.__contributors.get(project_id = pid)
         contributors = [ user.uname for user in contributors ]
@@ -383,14 +705,12 @@ class ComposteServer:
         if session is None:
             return ("fail", "You are not subscribed")
 
-        (user, project_id) = session
         (status, reason) = self.remove_cookie(cookie)
 
         if status == "ok":
-            project = self.__pool.put(project_id,
-                    lambda x: self.get_project(x)[1])
-            pid = project.projectID
-            self.__pool.remove(pid, lambda x: self.write_project(x))
+            (user, project_id) = session
+            self.__pool.remove(project_id,
+                    lambda x: self.flush_project(x, 0))
 
         return (status, reason)
 
@@ -401,19 +721,40 @@ class ComposteServer:
         """
         dbname = "data/composte.db"
 
-        if self.__users is None:
-            self.__users = driver.Auth(dbname)
+        # Workers race to get here first
+        with self.__db_lock:
+            # Metadata is read on most requests, but rarely written, and
+            # only through here
+            if self.__users is None:
+                self.__users = cache.Auth(driver.Auth(dbname))
 
-        if self.__projects is None:
-            self.__projects = driver.Projects(dbname)
+            if self.__projects is None:
+                self.__projects = cache.Projects(driver.Projects(dbname))
 
-        if self.__contributors is None:
-            self.__contributors = driver.Contributors(dbname)
+            if self.__contributors is None:
+                self.__contributors = \
+                        cache.Contributors(driver.Contributors(dbname))
 
-    def share(self, pid, new_contributor):
+    def db_cache_stats(self):
         """
-        Add a new user to the list of contributors to a project
+        Retrieve counters of cache hits, misses and evictions of database
+        lookups, per table
         """
+        self.get_db_connections()
+        return {
+            "auth": self.__users.stats(),
+            "projects": self.__projects.stats(),
+            "contributors": self.__contributors.stats(),
+        }
+
+    def share(self, pid, new_contributor, token = None):
+        """
+        Add a new user to the list of contributors to a project. Only
+        contributors may share a project
+        """
+        failure = self.__authorize(token, pid = pid)
+        if failure is not None:
+            return failure
 
         contributors = self.__contributors.get(project_id = pid)
         user = self.__users.get(new_contributor)
@@ -449,12 +790,17 @@ class ComposteServer:
         rpc_funs = {
             "register": self.register,
             "login": self.login,
+            "renew": self.renew,
             "create_project": self.create_project,
             "list_projects": self.list_projects_by_user,
             "get_project": self.get_project_over_the_wire,
+            "get_project_frames": self.get_project_frames,
+            "get_project_since": self.get_project_since,
             "subscribe": self.subscribe,
             "unsubscribe": self.unsubscribe,
+            "heartbeat": self.heartbeat,
             "update": self.do_update,
+            "update_batch": self.do_update_batch,
             "handshake": self.compare_versions,
             "share": self.share,
         }
@@ -464,21 +810,30 @@ class ComposteServer:
 
         do_rpc = rpc_funs.get(f, fail)
 
+        # Updates may be tagged by their sender, so that it can tell its own
+        # updates apart from everybody else's when they are broadcast, and
+        # requests made on behalf of a user may carry their login token
+        accepted = {
+            "list_projects": ("token",),
+            "subscribe": ("token",),
+            "share": ("token",),
+            "update": ("tag", "token"),
+            "update_batch": ("tag", "token"),
+        }
+        fields = { name: rpc[name] for name in accepted.get(f, ())
+                   if rpc.get(name) is not None }
+
         try:
-            # This is expected to be a tuple of things to send back
-            (status, other) = do_rpc(*rpc["args"])
+            # This is expected to be a tuple of things to send back, starting
+            # with the status
+            reply = do_rpc(*rpc["args"], **fields)
         except GenericError as e:
             return ("fail", "Internal server error")
         except:
             self.__server.error(traceback.format_exc())
             return ("fail", "Internal server error (Developer error)")
 
-        # Only broadcast successful updates
-        if f == "update" and status == "ok":
-            self.__server.broadcast(client.serialize(rpc["fName"],
-                *rpc["args"]))
-
-        return (status, other)
+        return reply
 
     def __preprocess(self, message):
         """
@@ -490,6 +845,11 @@ class ComposteServer:
         """
         Serialize replies to be sent over the wire
         """
+        if isinstance(reply[1], server.Frames):
+            frames = server.serialize_frames(*reply)
+            self.__server.debug(frames[0])
+            return frames
+
         reply_str = server.serialize(*reply)
         self.__server.debug(reply_str)
         return reply_str
@@ -503,9 +863,11 @@ class ComposteServer:
             self.__done = True
 
         self.__timer.join()
-        self.__pool.map(self.flush_project)
+        self.__sweeper.join()
+        self.flush_all()
 
         self.__server.stop()
+        auth.shutdown()
 
 def stop_server(sig, frame, server):
     """
@@ -525,9 +887,24 @@ if __name__ == "__main__":
             type = int)
     parser.add_argument("-b", "--broadcast-port", default = 5001,
             type = int)
+    # Workers waiting on password hashing can't handle updates meanwhile, so
+    # there should be more of them than can wait on it at once
+    parser.add_argument("-w", "--workers", default = 16,
+            type = int)
+    parser.add_argument("-p", "--patches", action = "store_true",
+            help = "Broadcast the changes that updates make")
+    parser.add_argument("--hash-rounds", default = None, type = int,
+            help = "pbkdf2 rounds for new password hashes")
+    parser.add_argument("--hash-workers", default = 2, type = int,
+            help = "Processes hashing passwords")
+    parser.add_argument("--hash-backlog", default = None, type = int,
+            help = "Passwords queued for hashing beyond one per process")
 
     args = parser.parse_args()
 
+    auth.configure(rounds = args.hash_rounds, workers = args.hash_workers,
+            backlog = args.hash_backlog)
+
     print("Composte server version {}".format(misc.get_version()))
 
     networkLog.setup()
@@ -536,7 +913,8 @@ if __name__ == "__main__":
     real_log = Combined((log, StdErr))
 
     s = ComposteServer("tcp://*:{}".format(args.interactive_port),
-            "tcp://*:{}".format(args.broadcast_port), real_log, Encryption())
+            "tcp://*:{}".format(args.broadcast_port), real_log, Encryption(),
+            workers = args.workers, patches = args.patches)
 
     signal.signal(signal.SIGINT , lambda sig, f: stop_server(sig, f, s))
     signal.signal(signal.SIGQUIT, lambda sig, f: stop_server(sig, f, s))
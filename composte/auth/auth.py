@@ -1,11 +1,87 @@
 
 from passlib.hash import pbkdf2_sha256
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock, BoundedSemaphore
+import multiprocessing
+
+# Hashing is slow on purpose, so it is done in a pool of processes where it
+# holds neither the GIL nor the server workers waiting on it busy. Requests
+# queue up for the pool, but only so many; beyond that, hash and verify fail
+# with Busy rather than tie up ever more server workers.
+
+class Busy(Exception): pass
+
+_lock = Lock()
+_rounds = pbkdf2_sha256.default_rounds
+_pool = None
+_slots = None
+_workers = 2
+# Requests that may wait on the pool beyond one per process, or None for a
+# few per process
+_backlog = None
+
+def configure(rounds = None, workers = None, backlog = None):
+    """
+    Set the number of pbkdf2 rounds new hashes are made with, the number of
+    processes hashing, and the number of requests that may queue up for them
+    beyond one per process. Unset settings are left alone. Records hashed
+    with other rounds still verify
+    """
+    global _rounds, _workers, _backlog
+    with _lock:
+        if rounds is not None:
+            _rounds = rounds
+        if workers is not None:
+            _workers = workers
+        if backlog is not None:
+            _backlog = backlog
+    shutdown()
+
+def shutdown():
+    """
+    Stop the hashing processes. They are started again on demand
+    """
+    global _pool, _slots
+    with _lock:
+        pool = _pool
+        _pool = None
+        _slots = None
+    if pool is not None:
+        pool.shutdown()
+
+def _run(fun, *args):
+    """
+    Run fun(*args) in the pool, starting it if need be
+    """
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            # Forking a process with threads and zmq sockets in it is asking
+            # for trouble
+            _pool = ProcessPoolExecutor(_workers,
+                    mp_context = multiprocessing.get_context("spawn"))
+            backlog = _backlog if _backlog is not None else 4 * _workers
+            _slots = BoundedSemaphore(_workers + backlog)
+        pool, slots = _pool, _slots
+
+    if not slots.acquire(blocking = False):
+        raise Busy("Too many passwords are queued for hashing already")
+    try:
+        return pool.submit(fun, *args).result()
+    finally:
+        slots.release()
+
+def _hash(hashable, rounds):
+    return pbkdf2_sha256.using(rounds = rounds).hash(hashable)
+
+def _verify(candidate, record):
+    return pbkdf2_sha256.verify(candidate, record)
 
 def hash(hashable):
     """
     Create a hash
     """
-    record = pbkdf2_sha256.hash(hashable)
+    record = _run(_hash, hashable, _rounds)
 
     return record
 
@@ -13,5 +89,4 @@ def verify(candidate, record):
     """
     Verify candidate against record
     """
-    return pbkdf2_sha256.verify(candidate, record)
-
+    return _run(_verify, candidate, record)
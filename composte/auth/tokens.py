@@ -0,0 +1,81 @@
+import hmac
+import hashlib
+import os
+import time
+
+class Tokens:
+    """
+    Issues and checks login tokens. A token names the user it was issued to,
+    when they logged in with their password, and when it expires, and is
+    signed, so that checking one needs neither the database nor a password
+    hash. Tokens are only good with the Tokens that issued them; a new secret
+    invalidates all outstanding tokens
+    """
+    def __init__(self, secret = None, lifetime = 12 * 60 * 60,
+            session_lifetime = 7 * 24 * 60 * 60, clock = time.time):
+        """
+        Sign tokens with secret, or a random one, and let them expire after
+        lifetime seconds. Tokens may be renewed, but none outlive the login
+        they descend from by more than session_lifetime seconds. clock
+        retrieves the current time in seconds since the epoch
+        """
+        if secret is None:
+            secret = os.urandom(32)
+        elif type(secret) == str:
+            secret = secret.encode()
+        self.__secret = secret
+        self.__lifetime = lifetime
+        self.__session_lifetime = session_lifetime
+        self.__clock = clock
+
+    def __sign(self, message):
+        return hmac.new(self.__secret, message.encode(),
+                hashlib.sha256).hexdigest()
+
+    def __parse(self, token):
+        """
+        Retrieve the (username, login time) of a valid token, or None
+        """
+        try:
+            (username, since, expiry, signature) = token.rsplit(":", 3)
+            (since, expiry) = (int(since), int(expiry))
+        except (AttributeError, ValueError):
+            return None
+
+        message = "{}:{}:{}".format(username, since, expiry)
+        if not hmac.compare_digest(self.__sign(message), signature):
+            return None
+        if expiry < self.__clock():
+            return None
+        return (username, since)
+
+    def issue(self, username, since = None):
+        """
+        Issue a token to username, who logged in at since, or just now
+        """
+        now = int(self.__clock())
+        if since is None:
+            since = now
+        expiry = min(now + self.__lifetime, since + self.__session_lifetime)
+        message = "{}:{}:{}".format(username, since, expiry)
+        return "{}:{}".format(message, self.__sign(message))
+
+    def verify(self, token):
+        """
+        Retrieve the user that token was issued to, or None if it is not a
+        valid token or has expired
+        """
+        parsed = self.__parse(token)
+        if parsed is None:
+            return None
+        return parsed[0]
+
+    def renew(self, token):
+        """
+        Issue a token that expires later in place of a valid one, or None if
+        it is not valid or has expired
+        """
+        parsed = self.__parse(token)
+        if parsed is None:
+            return None
+        return self.issue(*parsed)
@@ -54,18 +54,14 @@ class Editor(QtWidgets.QMainWindow):
         Update a section of the score on the UI from the copy held by the
         client.
 
-        :note: Updating sections is not currently supported; all updates redraw
-        the entire score.
-
         :param startOffset: First quarter-note offset to be updated.  If None,
             update from start of project.
-        :param startOffset: Quarter-note offset after the last one to be
-            updated.  If None, update through end of project.
+        :param endOffset: Last quarter-note offset to be updated.  If None,
+            update through end of project.
         """
-        ## FIXME: Updating of specific sections not working quite yet.
         try:
             self.__ui_scoreViewport.update(self.__client.project(),
-                                           None, None)
+                                           startOffset, endOffset)
         except ValueError as e:
             self.__debugConsoleWrite(str(e))
 
@@ -255,7 +251,8 @@ class Editor(QtWidgets.QMainWindow):
     def __handleInsertNote(self, partIdx: int,
                            pitch: music21.pitch.Pitch, ntype, offset: float):
         """
-        Tell the Composte client to insert a note into the current project.
+        Insert a note into the current project.  The note is drawn right away,
+        and taken back out again if the server turns it down.
 
         :param partIdx: Index of the part to be inserted into.
         :param pitch: Pitch of the note to be inserted, as a Music21 Pitch.
@@ -264,21 +261,24 @@ class Editor(QtWidgets.QMainWindow):
         :param offset: Offset (in quarterlengths) from the beginning of the
             piece at which the note should be inserted.
         """
-        self.__client.insertNote(self.__client.project().projectID,
-                                 offset, partIdx, str(pitch), ntype.length())
+        pid = str(self.__client.project().projectID)
+        self.__client.speculative().insertNote(pid, offset, partIdx,
+                                               str(pitch), ntype.length())
 
     def __handleDeleteNote(self, partIdx: int,
                            pitch: music21.pitch.Pitch, offset: float):
         """
-        Tell the Composte client to remove a note from the current project.
+        Remove a note from the current project.  As with insertion, this takes
+        effect locally without waiting for the server.
 
         :param partIdx: Index of the part to be removed from.
         :param pitch: Pitch of the note to be removed, as a Music21 Pitch.
         :param offset: Offset (in quarterlengths) from the beginning of the
             piece of the note to be removed.
         """
-        self.__client.removeNote(self.__client.project().projectID,
-                                 offset, partIdx, str(pitch))
+        pid = str(self.__client.project().projectID)
+        self.__client.speculative().removeNote(pid, offset, partIdx,
+                                               str(pitch))
 
     def __handleChatMessage(self, name, msg):
         """
@@ -0,0 +1,66 @@
+from PyQt5 import QtWidgets
+
+class UIItemPool:
+
+    """
+    Graphics items which are no longer displayed, kept so that they can be
+    reused instead of being destroyed and allocated all over again.  Items
+    borrowed from the pool must provide a reset method taking the same
+    arguments as their constructor.
+    """
+
+    def __init__(self, capacity = 4096):
+        """
+        :param capacity: Maximum number of free items kept of each class.
+            Items returned beyond that are left to be destroyed.
+        """
+        self.__capacity = capacity
+        self.__free = {}
+
+    def acquire(self, cls, *args):
+        """
+        Return an item of class cls, initialized with args.  A free item is
+        reused if there is one.  The item is not in any scene and has no parent.
+        """
+        free = self.__free.get(cls)
+        if free:
+            item = free.pop()
+            item.reset(*args)
+            return item
+        return cls(*args)
+
+    def release(self, item):
+        """
+        Take an item out of its scene and return it to the pool.
+        """
+        item.setParentItem(None)
+        if item.scene() is not None:
+            item.scene().removeItem(item)
+        free = self.__free.setdefault(type(item), [])
+        if len(free) < self.__capacity:
+            free.append(item)
+
+    def free(self, cls):
+        """
+        Return the number of free items of class cls.
+        """
+        return len(self.__free.get(cls, []))
+
+# END class UIItemPool
+
+
+class UILine(QtWidgets.QGraphicsLineItem):
+
+    """
+    A line drawn with a fixed pen, which can be borrowed from a UIItemPool.  The
+    line itself is set with setLine once borrowed.
+    """
+
+    def __init__(self, pen, *args, **kwargs):
+        super(UILine, self).__init__(*args, **kwargs)
+        self.reset(pen)
+
+    def reset(self, pen):
+        self.setPen(pen)
+
+# END class UILine
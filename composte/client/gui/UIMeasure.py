@@ -1,12 +1,14 @@
 
-from PyQt5 import QtWidgets, QtGui
+from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QGraphicsLineItem
 from client.gui import UISettings
 from client.gui.UINote import UINote
+from client.gui.UIItemPool import UIItemPool, UILine
 
 import music21
 
+from bisect import bisect_left, insort
+
 class UIMeasure(QtWidgets.QGraphicsItemGroup):
 
     __stafflineWidth = 1
@@ -18,6 +20,10 @@ class UIMeasure(QtWidgets.QGraphicsItemGroup):
                               __barlineWidth,
                               Qt.SolidLine, Qt.FlatCap)
 
+    # Staff lines, bar lines and notes are borrowed from here, and returned
+    # when a measure is cleared or dematerialized.
+    __pool = UIItemPool()
+
     def __init__(self, scene, width, clef, keysig, timesig,
                  newClef = False, newKeysig = False, newTimesig = False,
                  forceDrawClef = False, *args, **kwargs):
@@ -50,48 +56,128 @@ class UIMeasure(QtWidgets.QGraphicsItemGroup):
         self.__timesig = timesig
         self.__newTimesig = newTimesig
 
+        # The measure only holds graphics items while it is materialized, which
+        # it is unless whoever displays it dematerializes it, e.g. because it
+        # is far off screen.  The notes themselves are remembered regardless,
+        # as keys of self.__noteObjs; their graphics items are the values, or
+        # None while the measure is not materialized.
+        self.__materialized = False
         self.__baseObjs = []
         self.__noteObjs = {}
+        # Notes are found by where they are: (offset, pitch name) maps to
+        # their key in self.__noteObjs, and the same pairs are kept in order
+        # for finding the notes in a stretch of the measure.
+        self.__noteIndex = {}
+        self.__noteOrder = []
 
-        self.__initGraphics()
+        self.materialize()
 
     def __initGraphics(self):
         """
         Draw in staff and bar lines.
         """
         for i in range(0,5):
-            line = QGraphicsLineItem(0, 2 * i * UISettings.PITCH_LINE_SEP,
-                                     self.__width,
-                                     2 * i * UISettings.PITCH_LINE_SEP,
-                                     self)
-            line.setPen(self.__stafflinePen)
+            line = self.__pool.acquire(UILine, self.__stafflinePen)
+            line.setParentItem(self)
             self.__baseObjs.append(line)
+        for i in range(0,2):
+            barline = self.__pool.acquire(UILine, self.__barlinePen)
+            barline.setParentItem(self)
+            self.__baseObjs.append(barline)
+        self.__layout()
+
+    def __layout(self):
+        """
+        Move the staff lines, bar lines and notes into place for the current
+        width of the measure.
+        """
+        for i in range(0,5):
+            self.__baseObjs[i].setLine(0, 2 * i * UISettings.PITCH_LINE_SEP,
+                                       self.__width,
+                                       2 * i * UISettings.PITCH_LINE_SEP)
 
         barline_y1 = -self.__stafflineWidth/2
         barline_y2 = 4 * 2 * UISettings.PITCH_LINE_SEP + self.__stafflineWidth/2
+        self.__baseObjs[5].setLine(0, barline_y1, 0, barline_y2)
+        self.__baseObjs[6].setLine(self.__width, barline_y1,
+                                   self.__width, barline_y2)
+
+        for ((pitch, ntype, offset), note) in self.__noteObjs.items():
+            note.setPos(self.__notePosition(offset))
+
+    def __notePosition(self, offset):
+        """
+        Return the position of a note at the given offset within this measure.
+        """
+        notesWidth = (self.__width
+                        - UISettings.BARLINE_FRONT_PAD
+                        - UISettings.BARLINE_REAR_PAD )
+        note_x = (UISettings.BARLINE_FRONT_PAD
+                    + notesWidth * (offset / (self.length() - 1)))
+        note_y = 0
+        return QtCore.QPointF(note_x, note_y)
+
+    def __makeNote(self, pitch, ntype, offset):
+        """
+        Create the graphics item for a note in this measure.
+        """
+        note = self.__pool.acquire(ntype, pitch, self.__clef, self.__keysig)
+        note.setParentItem(self)
+        note.setPos(self.__notePosition(offset))
+        return note
+
+    def materialize(self):
+        """
+        Create the graphics items for this measure and its notes, if they do not
+        exist already.
+        """
+        if self.__materialized:
+            return
+        self.__materialized = True
+        for note in self.__noteObjs:
+            self.__noteObjs[note] = self.__makeNote(*note)
+        self.__initGraphics()
+
+    def dematerialize(self):
+        """
+        Give up the graphics items for this measure and its notes, remembering
+        only what they represent.
+        """
+        if not self.__materialized:
+            return
+        self.__materialized = False
+        for note in self.__noteObjs:
+            self.__pool.release(self.__noteObjs[note])
+            self.__noteObjs[note] = None
+        for item in self.__baseObjs:
+            self.__pool.release(item)
+        self.__baseObjs.clear()
 
-        barline = QGraphicsLineItem(0, barline_y1,
-                                    0, barline_y2,
-                                    parent=self)
-        barline.setPen(self.__barlinePen)
-        self.__baseObjs.append(barline)
-        barline = QGraphicsLineItem(self.__width, barline_y1,
-                                    self.__width, barline_y2,
-                                    parent = self)
-        barline.setPen(self.__barlinePen)
-        self.__baseObjs.append(barline)
+    def isMaterialized(self):
+        return self.__materialized
+
+    def boundingRect(self):
+        """
+        Return a QRectF giving the boundaries of the staff, whether or not it is
+        materialized, so that the layout of the score does not depend on what is
+        currently on screen.
+        """
+        return QtCore.QRectF(-self.__barlineWidth / 2,
+                             -self.__stafflineWidth / 2,
+                             self.__width + self.__barlineWidth,
+                             4 * 2 * UISettings.PITCH_LINE_SEP
+                                + self.__stafflineWidth)
 
     def clear(self):
         """
-        Clear all graphics objects, except for the staff and bar lines.
+        Clear all notes, leaving the staff and bar lines.
         """
         for item in self.__noteObjs.values():
-            self.__scene.removeItem(item)
+            if item is not None:
+                self.__pool.release(item)
         self.__noteObjs.clear()
-        for item in self.__baseObjs:
-            self.__scene.removeItem(item)
-        self.__baseObjs.clear()
-        self.__initGraphics()
+        self.__noteIndex.clear()
+        self.__noteOrder.clear()
 
     def __redraw(self):
         """
@@ -101,14 +187,8 @@ class UIMeasure(QtWidgets.QGraphicsItemGroup):
         :note: This does *not* update the existing notes from the underlying
         Music21 representation.
         """
-        ## TODO: This is a terrible way of doing this, we could reuse the old
-        ##   objects rather than destroying them and creating new ones.
-        notes = list(self.__noteObjs.keys())
-        self.clear()
-
-        self.__initGraphics()
-        for note in notes:
-            self.addNote(*note)
+        if self.__materialized:
+            self.__layout()
 
     def insertNote(self, pitch: music21.pitch.Pitch, ntype, offset: float):
         """
@@ -121,19 +201,18 @@ class UIMeasure(QtWidgets.QGraphicsItemGroup):
         :param offset: Quarter-note offset of the start of the note, from the
             beginning of this measure.
         """
-        note = ntype(pitch, self.__clef, self.__keysig)
-        if offset + note.length() > self.length():
+        if offset + ntype.length() > self.length():
             raise ValueError("Note extends past end of measure")
-        note.setParentItem(self)
-        self.__noteObjs[(pitch, ntype, offset)] = note
+        where = (offset, pitch.nameWithOctave)
+        if where in self.__noteIndex:
+            self.__removeNote(where)
 
-        notesWidth = (self.__width
-                        - UISettings.BARLINE_FRONT_PAD
-                        - UISettings.BARLINE_REAR_PAD )
-        note_x = (UISettings.BARLINE_FRONT_PAD
-                    + notesWidth * (offset / (self.length() - 1)))
-        note_y = 0
-        note.setPos(note_x, note_y)
+        note = None
+        if self.__materialized:
+            note = self.__makeNote(pitch, ntype, offset)
+        self.__noteObjs[(pitch, ntype, offset)] = note
+        self.__noteIndex[where] = (pitch, ntype, offset)
+        insort(self.__noteOrder, where)
 
 
     def deleteNote(self, pitch: music21.pitch.Pitch, offset: float):
@@ -148,12 +227,49 @@ class UIMeasure(QtWidgets.QGraphicsItemGroup):
         :returns: True when a note is successfully removed; False if the note to
                   be removed does not exist.
         """
-        for note in self.__noteObjs.keys():
-            if note[0] == pitch and note[2] == offset:
-                self.__scene.removeItem(self.__noteObjs[note])
-                del self.__noteObjs[note]
-                return True
-        return False
+        where = (offset, pitch.nameWithOctave)
+        if where not in self.__noteIndex:
+            return False
+        self.__removeNote(where)
+        return True
+
+    def __removeNote(self, where):
+        """
+        Remove the note at where, an (offset, pitch name) pair, which must be
+        in this measure.
+        """
+        note = self.__noteIndex.pop(where)
+        item = self.__noteObjs.pop(note)
+        if item is not None:
+            self.__pool.release(item)
+        del self.__noteOrder[bisect_left(self.__noteOrder, where)]
+
+    def note(self, pitch: music21.pitch.Pitch, offset: float):
+        """
+        Return the graphics item for a note in this measure, or None if there is
+        no such note or the measure is not materialized.
+
+        :param pitch: The pitch of the note, as a music21 Pitch.
+        :param offset: Quarter-note offset of the start of the note, from the
+            beginning of this measure.
+        """
+        note = self.__noteIndex.get((offset, pitch.nameWithOctave))
+        if note is None:
+            return None
+        return self.__noteObjs[note]
+
+    def notesBetween(self, start: float, end: float):
+        """
+        Return the notes starting at or after start and before end, as
+        (pitch, ntype, offset) tuples in order of offset.
+
+        :param start: Quarter-note offset from the beginning of this measure.
+        :param end: Quarter-note offset from the beginning of this measure.
+        """
+        first = bisect_left(self.__noteOrder, (start,))
+        last = bisect_left(self.__noteOrder, (end,), first)
+        return [self.__noteIndex[where]
+                for where in self.__noteOrder[first:last]]
 
     # Getters
     def clef(self):
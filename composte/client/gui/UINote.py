@@ -55,15 +55,29 @@ class UINote(QtWidgets.QGraphicsItem):
     # Overridden by subclasses
     _length = None
 
+    # Notes rendered once and then copied onto the screen, keyed by note class,
+    # accidental and scale.  The dot is implied by the class.
+    __glyphs = {}
+
 
     def __init__(self, pitch, clef, keysig, *args, **kwargs):
         super(UINote, self).__init__(*args, **kwargs)
+        self.reset(pitch, clef, keysig)
+
+    def reset(self, pitch, clef, keysig):
+        """
+        Make this note represent a different pitch, or the same pitch under a
+        different clef or key signature, so that it can be reused rather than
+        replaced.
+        """
+        self.prepareGeometryChange()
         self.__pitch = pitch
         self.__clef = clef
         self.__keysig = keysig
 
         self._yoffset = (8 * UISet.PITCH_LINE_SEP
                           - self.__clef.position(pitch) * UISet.PITCH_LINE_SEP)
+        self.update()
 
     @classmethod
     def length(cls):
@@ -83,6 +97,59 @@ class UINote(QtWidgets.QGraphicsItem):
                              9 * UISet.PITCH_LINE_SEP + 10)
 
 
+    @staticmethod
+    def clearGlyphCache():
+        """
+        Forget all rendered notes, e.g. because the zoom level changed and they
+        would have to be scaled to be drawn.
+        """
+        UINote.__glyphs.clear()
+
+    def paint(self, painter, option, widget):
+        """
+        Draw the note from the glyph cache, rendering it first if need be.
+        Everything drawn for a note is relative to its vertical offset, so a
+        glyph rendered for one pitch can be drawn for any other with the same
+        accidental.
+        """
+        scale = round(painter.worldTransform().m11(), 4)
+        accidental = self.__keysig.accidentalMarkOf(self.__pitch)
+        if accidental is not None:
+            accidental = accidental.name
+        key = (type(self), accidental, scale)
+
+        glyph = UINote.__glyphs.get(key)
+        if glyph is None:
+            glyph = self.__renderGlyph(scale, option, widget)
+            UINote.__glyphs[key] = glyph
+
+        painter.drawPixmap(self.boundingRect(), glyph,
+                           QtCore.QRectF(glyph.rect()))
+
+    def __renderGlyph(self, scale, option, widget):
+        """
+        Render this note into a transparent pixmap of its bounding rectangle,
+        at the given scale.
+        """
+        rect = self.boundingRect()
+        glyph = QtGui.QPixmap(int(rect.width() * scale + 1),
+                              int(rect.height() * scale + 1))
+        glyph.fill(Qt.transparent)
+        painter = QtGui.QPainter(glyph)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.scale(scale, scale)
+        painter.translate(-rect.x(), -rect.y())
+        self._paintGlyph(painter, option, widget)
+        painter.end()
+        return glyph
+
+    @virtualmethod
+    def _paintGlyph(self, painter, option, widget):
+        """
+        Draw the note, including any accidental and dot, at its vertical
+        offset.
+        """
+
     def _paintAccidental(self, painter, option, widget):
         """
         Draw in accidental marks, if appropriate.
@@ -182,7 +249,7 @@ class UINote_Whole(UINote):
     def __init__(self, *args, **kwargs):
         super(UINote_Whole, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
+    def _paintGlyph(self, painter, option, widget):
         y = self._yoffset
         painter.setBrush(self.__brush)
         painter.setPen(self.__pen)
@@ -206,7 +273,7 @@ class UINote_Half(UINote):
     def __init__(self, *args, **kwargs):
         super(UINote_Half, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
+    def _paintGlyph(self, painter, option, widget):
         y = self._yoffset
         painter.setBrush(self.__brush)
         painter.setPen(self.__pen)
@@ -228,8 +295,8 @@ class UINote_Half_Dotted(UINote_Half):
     def __init__(self, *args, **kwargs):
         super(UINote_Half_Dotted, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
-        super(UINote_Half_Dotted, self).paint(painter, option, widget)
+    def _paintGlyph(self, painter, option, widget):
+        super(UINote_Half_Dotted, self)._paintGlyph(painter, option, widget)
         self._paintDot(painter, option, widget)
 
 
@@ -245,7 +312,7 @@ class UINote_Quarter(UINote):
     def __init__(self, *args, **kwargs):
         super(UINote_Quarter, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
+    def _paintGlyph(self, painter, option, widget):
         y = self._yoffset
         painter.setBrush(self.__brush)
         painter.setPen(self.__pen)
@@ -268,8 +335,8 @@ class UINote_Quarter_Dotted(UINote_Quarter):
     def __init__(self, *args, **kwargs):
         super(UINote_Quarter_Dotted, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
-        super(UINote_Quarter_Dotted, self).paint(painter, option, widget)
+    def _paintGlyph(self, painter, option, widget):
+        super(UINote_Quarter_Dotted, self)._paintGlyph(painter, option, widget)
         self._paintDot(painter, option, widget)
 
 
@@ -286,7 +353,7 @@ class UINote_Eighth(UINote):
     def __init__(self, *args, **kwargs):
         super(UINote_Eighth, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
+    def _paintGlyph(self, painter, option, widget):
         y = self._yoffset
         painter.setBrush(self.__brush)
         painter.setPen(self.__pen)
@@ -312,8 +379,8 @@ class UINote_Eighth_Dotted(UINote_Eighth):
     def __init__(self, *args, **kwargs):
         super(UINote_Eighth_Dotted, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
-        super(UINote_Eighth_Dotted, self).paint(painter, option, widget)
+    def _paintGlyph(self, painter, option, widget):
+        super(UINote_Eighth_Dotted, self)._paintGlyph(painter, option, widget)
         self._paintDot(painter, option, widget)
 
 
@@ -330,7 +397,7 @@ class UINote_16th(UINote):
     def __init__(self, *args, **kwargs):
         super(UINote_16th, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
+    def _paintGlyph(self, painter, option, widget):
         y = self._yoffset
         painter.setBrush(self.__brush)
         painter.setPen(self.__pen)
@@ -361,6 +428,6 @@ class UINote_16th_Dotted(UINote_16th):
     def __init__(self, *args, **kwargs):
         super(UINote_16th_Dotted, self).__init__(*args, **kwargs)
 
-    def paint(self, painter, option, widget):
-        super(UINote_16th_Dotted, self).paint(painter, option, widget)
+    def _paintGlyph(self, painter, option, widget):
+        super(UINote_16th_Dotted, self)._paintGlyph(painter, option, widget)
         self._paintDot(painter, option, widget)
@@ -2,7 +2,9 @@ import music21
 
 import util.musicFuns as musicFuns
 
-from PyQt5 import QtWidgets, QtGui
+from bisect import bisect_right
+
+from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtCore import Qt
 
 import client.gui.UISettings as UISet
@@ -20,10 +22,17 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
     """
 
     def __init__(self, measuresPerLine = 4, mode = 'ptr', width = 600,
-                 zoom_min = -4, zoom_max = 4,
+                 zoom_min = -4, zoom_max = 4, margin = 1,
                  *args, **kwargs):
+        """
+        :param measuresPerLine: Number of measures on each line of the score.
+        :param width: Visual width of each line of the score.
+        :param margin: How far beyond the visible part of the score to keep
+            lines materialized, in multiples of the height of the viewport.
+        """
         super(UIScoreViewport, self).__init__(*args, **kwargs)
         self.__width = width
+        self.__margin = margin
         self.__measuresPerLine = measuresPerLine
         self.__zoom_min = zoom_min
         self.__zoom_max = zoom_max
@@ -34,7 +43,13 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         self.__selected = None
 
         self.__measures = []
+        # Staff groups, one per line of the score.  Only those on or near the
+        # screen are in the scene and hold graphics items; the rest are kept
+        # out of the scene until they are scrolled to.
         self.__lines = []
+        # Offset of the beginning of each measure, followed by the offset of
+        # the end of the last one.  Kept in step with self.__measures[0].
+        self.__measureOffsets = [0]
 
         self.__scoreScene = QtWidgets.QGraphicsScene(parent = self)
         self.__scoreScene.setBackgroundBrush(QtGui.QBrush(UISet.BG_COLOR))
@@ -47,22 +62,24 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         update through the end.  If both are None, update the entire score,
         including updating the number of parts.
 
-        :note: Updating sections is not currently supported; all updates redraw
-        the entire score.
+        Only the measures overlapping the region are cleared and redrawn; the
+        staff groups and everything outside the region are left as they are.
 
         :param project: ComposteProject to draw from.
         :param startOffset: First quarter-note offset to be updated.  If None,
             update from start of project.
-        :param startOffset: Quarter-note offset after the last one to be
-            updated.  If None, update through end of project.
+        :param endOffset: Last quarter-note offset to be updated.  If None,
+            update through end of project.
         """
-        if startOffset is None and endOffset is None:
+        if (startOffset is None and endOffset is None) \
+                or self.parts() != len(project.parts):
             self.clear()
             for part in project.parts:
                 cl = UIClef.fromMusic21(part.getClefs()[0])
                 ks = UIKeySignature.fromMusic21(part.getKeySignatures()[0])
                 ts = UITimeSignature.fromMusic21(part.getTimeSignatures()[0])
                 self.addPart(cl, keysig = ks, timesig = ts)
+            startOffset, endOffset = None, None
 
         if startOffset is None:
             st_idx, st_offset = 0, 0
@@ -73,22 +90,17 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
             _, en_off1 = self.__endOfDisplay()
             en_off2 = max(map(lambda strm : strm.highestTime,
                                     project.parts))
-            en_off = max(en_off1, en_off2) + 1
-            en_idx, en_offset = self.__measureIndexFromOffset(en_off,
-                                                              extend = True)
-            ## Pad out the end of the updated region to include the entire last
-            ## measure.
-            mea = self.__measures[0][en_idx]
-            en_offset += mea.length()
-            en_idx += 1
-        else:
-            en_idx, en_offset = self.__measureIndexFromOffset(endOffset,
-                                                              extend = True)
+            endOffset = max(en_off1, en_off2) + 1
+        en_idx, en_offset = self.__measureIndexFromOffset(endOffset,
+                                                          extend = True)
+        ## Pad out the end of the updated region to include the entire last
+        ## measure.
+        mea = self.__measures[0][en_idx]
+        en_offset += mea.length()
+        en_idx += 1
 
         # Erase the contents of the measures to be updated.
         for i in range(st_idx, en_idx):
-            while st_idx > len(self.__measures[0]):
-                self.addLine()
             for meas in self.__measures:
                 meas[i].clear()
 
@@ -110,25 +122,28 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                         mea.setClef(cl, newClef = True)
                     else:
                         lastCl = self.__measures[part][idx-1].clef()
-                        mea.setClef(cl, newClef = (cl == lastCl))
+                        mea.setClef(cl, newClef = (cl != lastCl))
                 elif isinstance(obj, music21.key.KeySignature):
                     ks = UIKeySignature.fromMusic21(obj)
                     if idx == 0:
                         mea.setKeysig(ks, newKeysig = True)
                     else:
                         lastKs = self.__measures[part][idx-1].keysig()
-                        mea.setKeysig(ks, newKeysig = (ks == lastKs))
+                        mea.setKeysig(ks, newKeysig = (ks != lastKs))
 
                 elif isinstance(obj, music21.meter.TimeSignature):
+                    ts = UITimeSignature.fromMusic21(obj)
                     if idx == 0:
                         mea.setTimesig(ts, newTimesig = True)
                     else:
                         lastTs = self.__measures[part][idx-1].timesig()
-                        mea.setTimesig(ts, newTimesig = (ts == lastTs))
+                        mea.setTimesig(ts, newTimesig = (ts != lastTs))
+                    self.__updateMeasureOffsets(idx)
                 elif isinstance(obj, music21.note.Note):
                     ntype = UINote.ntypeFromMusic21(obj)
                     self.insertNote(part, obj.pitch, ntype, offs)
 
+        self.__updateVisible()
 
     def __endOfDisplay(self):
         """
@@ -139,13 +154,21 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         """
         if len(self.__measures) == 0:
             return (None, None)
-        mea_offset = 0
-        mea_index = 0
-        for mea in self.__measures[0]:
-            mea_offset += self.__measures[0][mea_index].length()
-            mea_index += 1
-        return mea_index, mea_offset
+        return len(self.__measures[0]), self.__measureOffsets[-1]
 
+    def __updateMeasureOffsets(self, start = 0):
+        """
+        Recompute the offsets of the measures after the one at index start,
+        e.g. after measures are added or the length of a measure changes.
+
+        :param start: Index of the first measure whose length may have changed.
+        """
+        del self.__measureOffsets[start + 1:]
+        if len(self.__measures) == 0:
+            return
+        for mea in self.__measures[0][start:]:
+            self.__measureOffsets.append(self.__measureOffsets[-1]
+                                         + mea.length())
 
     def __measureIndexFromOffset(self, offset, extend = False):
         """
@@ -164,28 +187,73 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         """
         if len(self.__measures) == 0:
             return (None, None)
-        mea_offset = 0
-        mea_index = 0
-        while mea_offset <= offset:
-            if mea_index >= len(self.__measures[0]):
-                if extend:
-                    self.addLine()
-                else:
-                    return (None, None)
-            mea = self.__measures[0][mea_index]
-            mea_offset += mea.length()
-            mea_index += 1
-
-        mea_offset -= mea.length()
-        mea_index -= 1
-
-        return mea_index, mea_offset
+        while offset >= self.__measureOffsets[-1]:
+            if extend:
+                self.addLine()
+            else:
+                return (None, None)
+
+        mea_index = bisect_right(self.__measureOffsets, offset) - 1
+        return mea_index, self.__measureOffsets[mea_index]
+
+    def __visibleRect(self):
+        """
+        Return the region of the scene which is on screen, extended by the
+        margin above and below.
+        """
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        pad = self.__margin * rect.height()
+        return rect.adjusted(0, -pad, 0, pad)
+
+    def __updateVisible(self, lines = None):
+        """
+        Materialize the lines of the score which are on or near the screen, and
+        dematerialize and remove from the scene those which are not.
+
+        :param lines: The staff groups to consider.  If None, consider them all.
+        """
+        if lines is None:
+            lines = self.__lines
+        visible = self.__visibleRect()
+        for sg in lines:
+            if sg.mapRectToScene(sg.boundingRect()).intersects(visible):
+                if sg.scene() is None:
+                    self.__scoreScene.addItem(sg)
+                sg.materialize()
+            else:
+                sg.dematerialize()
+                if sg.scene() is not None:
+                    self.__scoreScene.removeItem(sg)
+
+    def __updateSceneRect(self):
+        """
+        Size the scene to fit every line of the score, including those that are
+        not currently in it.
+        """
+        if not self.__lines:
+            self.__scoreScene.setSceneRect(QtCore.QRectF())
+            return
+        first, last = self.__lines[0], self.__lines[-1]
+        self.__scoreScene.setSceneRect(
+                first.mapRectToScene(first.boundingRect())
+                     .united(last.mapRectToScene(last.boundingRect())))
+
+    def scrollContentsBy(self, dx, dy):
+        super(UIScoreViewport, self).scrollContentsBy(dx, dy)
+        self.__updateVisible()
+
+    def resizeEvent(self, ev):
+        super(UIScoreViewport, self).resizeEvent(ev)
+        self.__updateVisible()
 
     def clear(self):
         for sg in self.__lines:
-            self.__scoreScene.removeItem(sg)
+            if sg.scene() is not None:
+                self.__scoreScene.removeItem(sg)
         self.__lines.clear()
         self.__measures.clear()
+        self.__updateMeasureOffsets()
+        self.__updateSceneRect()
 
     def addPart(self, clef, keysig = None, timesig = None):
         if len(self.__measures) == 0 and (keysig is None or timesig is None):
@@ -198,6 +266,8 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                                 self.__width / self.__measuresPerLine,
                                 clef, keysig, timesig,
                                 parent=None)
+                # __updateVisible materializes the measures on screen
+                mea.dematerialize()
                 part.append(mea)
         else:
             part = []
@@ -206,8 +276,11 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                                 self.__width / self.__measuresPerLine,
                                 clef, m.keysig(), m.timesig(),
                                 parent=None)
+                mea.dematerialize()
                 part.append(mea)
         self.__measures.append(part)
+        if len(self.__measures) == 1:
+            self.__updateMeasureOffsets()
 
         if not self.__lines:
             sg = UIStaffGroup(self.__scoreScene,
@@ -216,7 +289,6 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                               parent = None)
             self.__lines.append(sg)
             sg.setPos(0,0)
-            self.__scoreScene.addItem(sg)
 
         last_sg = None
         for sg in self.__lines:
@@ -227,12 +299,15 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
             else:
                 sg.setPos(0, 0)
             last_sg = sg
+        self.__updateSceneRect()
+        self.__updateVisible()
 
 
     def addLine(self):
         """
         Add a new score line.
         """
+        start = len(self.__measures[0])
         for part in self.__measures:
             if part:
                 lastMeasure = part[-1]
@@ -242,10 +317,12 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                                     lastMeasure.clef(), lastMeasure.keysig(),
                                     lastMeasure.timesig(),
                                     parent=None)
+                    mea.dematerialize()
                     part.append(mea)
             else:
                 raise RuntimeError("Empty measure list in " +
                         "UIScoreViewport.addLine")
+        self.__updateMeasureOffsets(start)
 
         sg = UIStaffGroup(self.__scoreScene,
                           self.__measures,
@@ -255,7 +332,8 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         y = self.__lines[-1].boundingRect().height()
         sg.setPos(sg.mapFromItem(self.__lines[-1], 0, y))
         self.__lines.append(sg)
-        self.__scoreScene.addItem(sg)
+        self.__updateSceneRect()
+        self.__updateVisible([sg])
 
 
     def insertNote(self, part, pitch, ntype, offset):
@@ -328,6 +406,7 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
         Handle keyboard events.
         """
         mods = QtWidgets.QApplication.keyboardModifiers()
+        zoom = self.__zoom
         if mods == Qt.ControlModifier:
             # C-0 : Reset zoom
             if ev.key() == Qt.Key_0:
@@ -343,3 +422,7 @@ class UIScoreViewport(QtWidgets.QGraphicsView):
                 if self.__zoom != self.__zoom_max:
                     self.scale(1.25,1.25)
                     self.__zoom += 1
+        # Notes rendered at the old zoom level would be blurry at the new one.
+        if zoom != self.__zoom:
+            UINote.UINote.clearGlyphCache()
+            self.__updateVisible()
@@ -32,6 +32,9 @@ class UIStaffGroup(QtWidgets.QGraphicsItemGroup):
 
         # List containing the staff lines for each part
         self.__staves = []
+        # Whether the measures of this staff group were last materialized or
+        # dematerialized, or None if they may be some of each.
+        self.__materialized = None
         # Update and redraw everything
         self.refresh()
 
@@ -51,18 +54,46 @@ class UIStaffGroup(QtWidgets.QGraphicsItemGroup):
         """
         self.__updateStaves()
         self.__updatePositions()
+        # The measures may have changed under us.
+        self.__materialized = None
 
     def __updateStaves(self):
         """
         Recreate all staves to reflect changes in the measure lists.
         """
         for s in self.__staves:
-            self.__canvas.removeItem(s)
+            if s.scene() is not None:
+                self.__canvas.removeItem(s)
+            else:
+                s.setParentItem(None)
         self.__staves = [UIStaff(ml, self.__startMeasure, self.__endMeasure,
                                  parent = self)
                          for ml in self.__measureLists]
 
 
+    def materialize(self):
+        """
+        Create the graphics items for the measures in this staff group.
+        """
+        if self.__materialized:
+            return
+        self.__materialized = True
+        for ml in self.__measureLists:
+            for mea in ml[self.__startMeasure:self.__endMeasure]:
+                mea.materialize()
+
+    def dematerialize(self):
+        """
+        Destroy the graphics items for the measures in this staff group, keeping
+        only the staff group itself and what its measures contain.
+        """
+        if self.__materialized is False:
+            return
+        self.__materialized = False
+        for ml in self.__measureLists:
+            for mea in ml[self.__startMeasure:self.__endMeasure]:
+                mea.dematerialize()
+
     def __updatePositions(self):
         """
         Move staff lines around to be appropriately spaced.
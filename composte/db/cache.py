@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from threading import Lock
+
+class LRUCache:
+    """
+    Bounded, thread-safe map from keys to the results of loading them,
+    evicting the least recently used entry when full
+    """
+    def __init__(self, capacity = 1024):
+        self.__capacity = capacity
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+        # Bumped on every invalidation, so that a load that raced with a
+        # write doesn't put what it read from before the write back in
+        self.__generation = 0
+        self.__stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    def get(self, key, load):
+        """
+        Retrieve the value cached under key, calling load() to retrieve it if
+        it isn't cached
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.__stats["hits"] += 1
+                return self.__entries[key]
+            self.__stats["misses"] += 1
+            generation = self.__generation
+
+        value = load()
+
+        with self.__lock:
+            if generation == self.__generation:
+                self.__entries[key] = value
+                if len(self.__entries) > self.__capacity:
+                    self.__entries.popitem(last = False)
+                    self.__stats["evictions"] += 1
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Forget the values cached under keys
+        """
+        with self.__lock:
+            self.__generation += 1
+            for key in keys:
+                self.__entries.pop(key, None)
+
+    def stats(self):
+        """
+        Retrieve counters of hits, misses and evictions, and the number of
+        entries cached
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats["size"] = len(self.__entries)
+            return stats
+
+class Auth:
+    """
+    Read-through cache in front of a driver.Auth
+    """
+    def __init__(self, auth, capacity = 1024):
+        self.__auth = auth
+        self.__cache = LRUCache(capacity)
+
+    def put(self, username, hash_, email = "null"):
+        """
+        Create a new auth record, forgetting any cached lookup of it
+        """
+        try:
+            self.__auth.put(username, hash_, email)
+        finally:
+            self.__cache.invalidate(username)
+
+    def get(self, username):
+        """
+        Retrieve an auth record
+        """
+        return self.__cache.get(username, lambda: self.__auth.get(username))
+
+    def stats(self):
+        """
+        See LRUCache.stats
+        """
+        return self.__cache.stats()
+
+class Projects:
+    """
+    Read-through cache in front of a driver.Projects
+    """
+    def __init__(self, projects, capacity = 1024):
+        self.__projects = projects
+        self.__cache = LRUCache(capacity)
+
+    def put(self, id_, name, owner):
+        """
+        Insert a project record, forgetting any cached lookup of it
+        """
+        try:
+            self.__projects.put(id_, name, owner)
+        finally:
+            self.__cache.invalidate(id_)
+
+    def get(self, id_):
+        """
+        Retrieve a project record
+        """
+        return self.__cache.get(id_, lambda: self.__projects.get(id_))
+
+    def stats(self):
+        """
+        See LRUCache.stats
+        """
+        return self.__cache.stats()
+
+class Contributors:
+    """
+    Read-through cache in front of a driver.Contributors
+    """
+    def __init__(self, contributors, capacity = 1024):
+        self.__contributors = contributors
+        self.__cache = LRUCache(capacity)
+
+    def put(self, username, project_id):
+        """
+        Declare that username is a contributor to project_id, forgetting any
+        cached lookups of either
+        """
+        try:
+            self.__contributors.put(username, project_id)
+        finally:
+            self.__cache.invalidate(("users", project_id),
+                    ("projects", username))
+
+    def get(self, username = None, project_id = None):
+        """
+        Retrieve users contributing to a given project or projects
+        contributable by a given user.
+        """
+        if username is None and project_id is not None:
+            return self.get_users(project_id)
+        if project_id is None and username is not None:
+            return self.get_projects(username)
+        return self.__contributors.get(username, project_id)
+
+    def get_users(self, project_id):
+        """
+        Retrieve users who are contributors to the project
+        """
+        return self.__cache.get(("users", project_id),
+                lambda: self.__contributors.get_users(project_id))
+
+    def get_projects(self, username):
+        """
+        Retrieve projects that the user can contribute to
+        """
+        return self.__cache.get(("projects", username),
+                lambda: self.__contributors.get_projects(username))
+
+    def stats(self):
+        """
+        See LRUCache.stats
+        """
+        return self.__cache.stats()
@@ -3,7 +3,8 @@
 
 import sqlite3
 import json
-from threading import Lock
+from threading import Lock, local
+from contextlib import contextmanager
 
 # We are inspired by Django, but we're not that good at
 # introspection/reflection
@@ -14,12 +15,108 @@ def get_connection(dbname):
     Open a databse connection and make sure that foreign key constraints are
     enabled for every connection, because they aren't by default and for some
     reason that can be changed _per connection_.
+    Connections are not shared between threads; see Database.
     """
-    conn = sqlite3.connect(dbname)
+    # Transactions are begun explicitly, see Database.transaction. Waiting
+    # out another writer beats failing with "database is locked"
+    conn = sqlite3.connect(dbname, timeout = 5, isolation_level = None)
     conn.execute("PRAGMA foreign_keys = \"1\"") # ಠ_ಠ
-    conn.commit()
+    # Readers see the last commit instead of waiting on writers, and commits
+    # append to the log instead of rewriting pages in place
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode, this only gives up the last few commits on power loss,
+    # never consistency
+    conn.execute("PRAGMA synchronous = NORMAL")
+    # In KiB, when negative
+    conn.execute("PRAGMA cache_size = -8192")
     return conn
 
+class Database:
+    """
+    A database, holding one connection to it per thread, so that readers and
+    writers in different server workers don't have to take turns through a
+    single connection
+    """
+    # dbname -> Database
+    __databases = {}
+    __databases_lock = Lock()
+
+    def __init__(self, dbname):
+        self.__dbname = dbname
+        self.__local = local()
+
+    @staticmethod
+    def of(dbname):
+        """
+        Retrieve the database at dbname, shared by everything using it
+        """
+        with Database.__databases_lock:
+            db = Database.__databases.get(dbname, None)
+            if db is None:
+                db = Database(dbname)
+                Database.__databases[dbname] = db
+            return db
+
+    def connection(self):
+        """
+        Retrieve the calling thread's connection to the database, opening it
+        if need be
+        """
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = get_connection(self.__dbname)
+            self.__local.conn = conn
+            self.__local.depth = 0
+        return conn
+
+    def execute(self, query, args = ()):
+        """
+        Run a query on the calling thread's connection and return the cursor
+        """
+        return self.connection().execute(query, args)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the body of a with statement in a transaction, which is committed
+        if the body finishes and rolled back if it raises. Transactions nest;
+        only the outermost one commits. If a nested one raises, the outermost
+        one is rolled back even if the exception was caught in between, since
+        whatever the nested one got done before it raised is still in it
+        """
+        conn = self.connection()
+        if self.__local.depth == 0:
+            # Take the write lock now rather than on the first write, so that
+            # a transaction never has to give up halfway through
+            conn.execute("BEGIN IMMEDIATE")
+            self.__local.failed = False
+        self.__local.depth += 1
+        try:
+            yield conn
+        except:
+            self.__local.depth -= 1
+            if self.__local.depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                self.__local.failed = True
+            raise
+        self.__local.depth -= 1
+        if self.__local.depth == 0:
+            if self.__local.failed:
+                conn.execute("ROLLBACK")
+                raise sqlite3.OperationalError(
+                        "Rolled back after a nested transaction failed")
+            conn.execute("COMMIT")
+
+    def close(self):
+        """
+        Close the calling thread's connection to the database
+        """
+        conn = getattr(self.__local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
+
 class User:
     """
     POD class representing users
@@ -46,37 +143,33 @@ class Auth:
     __blueprint = ("username", "hash", "email")
 
     def __init__(self, dbname):
-        self.__conn = get_connection(dbname)
-        self.__cursor = self.__conn.cursor()
+        self.__db = Database.of(dbname)
 
-        self.__cursor.execute(""" CREATE TABLE IF NOT EXISTS auth
-                ( username TEXT PRIMARY KEY NOT NULL,
-                  hash TEXT NOT NULL,
-                  email TEXT)""")
-        self.__conn.commit()
-        self.__lock = Lock()
+        with self.__db.transaction():
+            self.__db.execute(""" CREATE TABLE IF NOT EXISTS auth
+                    ( username TEXT PRIMARY KEY NOT NULL,
+                      hash TEXT NOT NULL,
+                      email TEXT)""")
 
     # Create
     def put(self, username, hash_, email = "null"):
         """
         Create a new auth record
         """
-        with self.__lock:
-            self.__cursor.execute("""
+        with self.__db.transaction():
+            self.__db.execute("""
                     INSERT INTO auth (username, hash, email)
                     VALUES (?, ?, ?)
                     """, (username, hash_, email))
-            self.__conn.commit()
 
     # Retrieve
     def get(self, username):
         """
         Attempt to retrieve an existing auth record
         """
-        self.__cursor.execute("""
+        tup = self.__db.execute("""
                 SELECT * FROM auth WHERE username=?
-                """, (username,))
-        tup = self.__cursor.fetchone()
+                """, (username,)).fetchone()
         if tup is None:
             return User(None, None, None)
         return User(*tup)
@@ -111,38 +204,32 @@ class Projects:
     __blueprint = ("id", "name", "owner")
 
     def __init__(self, dbname):
-        self.__conn = get_connection(dbname)
-        self.__cursor = self.__conn.cursor()
-
-        self.__cursor.execute("""
-                CREATE TABLE IF NOT EXISTS projects
-                ( id TEXT PRIMARY KEY NOT NULL,
-                  name TEXT NOT NULL,
-                  owner TEXT NOT NULL REFERENCES auth(username))""")
+        self.__db = Database.of(dbname)
 
-        self.__conn.commit()
-
-        self.__lock = Lock()
+        with self.__db.transaction():
+            self.__db.execute("""
+                    CREATE TABLE IF NOT EXISTS projects
+                    ( id TEXT PRIMARY KEY NOT NULL,
+                      name TEXT NOT NULL,
+                      owner TEXT NOT NULL REFERENCES auth(username))""")
 
     def put(self, id_, name, owner):
         """
         Insert a project record
         """
-        with self.__lock:
-            self.__cursor.execute("""
+        with self.__db.transaction():
+            self.__db.execute("""
                     INSERT INTO projects (id, name, owner)
                     VALUES (?, ?, ?)
                     """, (id_, name, owner))
-            self.__conn.commit()
 
     def get(self, id_):
         """
         Retrieve a project record
         """
-        self.__cursor.execute("""
+        tup = self.__db.execute("""
                 SELECT * FROM projects WHERE id=?
-                """, (id_,))
-        tup = self.__cursor.fetchone()
+                """, (id_,)).fetchone()
         if tup is None:
             return Project(None, None, None)
         return Project(*tup)
@@ -152,17 +239,14 @@ class Contributors:
     CRU̶D̶ wrapper around contributor relationships between Users and Projects
     """
     def __init__(self, dbname):
-        self.__conn = get_connection(dbname)
-        self.__cursor = self.__conn.cursor()
-
-        self.__cursor.execute("""
-                CREATE TABLE IF NOT EXISTS contributors (
-                    username TEXT NOT NULL REFERENCES auth(username),
-                    project_id TEXT NOT NULL REFERENCES projects(id),
-                    PRIMARY KEY (username, project_id)) """)
-        self.__conn.commit()
+        self.__db = Database.of(dbname)
 
-        self.__lock = Lock()
+        with self.__db.transaction():
+            self.__db.execute("""
+                    CREATE TABLE IF NOT EXISTS contributors (
+                        username TEXT NOT NULL REFERENCES auth(username),
+                        project_id TEXT NOT NULL REFERENCES projects(id),
+                        PRIMARY KEY (username, project_id)) """)
 
     def put(self, username, project_id):
         """
@@ -170,11 +254,11 @@ class Contributors:
         Or equivalently,
         Declare that username is a contributor to project_id
         """
-        self.__cursor.execute("""
-                INSERT INTO contributors (username, project_id)
-                VALUES (?, ?)
-                """, (username, project_id))
-        self.__conn.commit()
+        with self.__db.transaction():
+            self.__db.execute("""
+                    INSERT INTO contributors (username, project_id)
+                    VALUES (?, ?)
+                    """, (username, project_id))
 
     def get(self, username = None, project_id = None):
         """
@@ -198,27 +282,23 @@ class Contributors:
         """
         Retrieve users who are contributors to the project
         """
-        with self.__lock:
-            self.__cursor.execute("""
-                    SELECT username FROM contributors
-                    WHERE project_id=?
-                    """, (project_id,))
-            users = self.__cursor.fetchall()
-            return [ User(*user) for user in users ]
+        users = self.__db.execute("""
+                SELECT username FROM contributors
+                WHERE project_id=?
+                """, (project_id,)).fetchall()
+        return [ User(*user) for user in users ]
 
     def get_projects(self, username):
         """
         Retrieve projects that the user can contribute to
         """
-        with self.__lock:
-            self.__cursor.execute("""
-                    SELECT projects.id, projects.name, projects.owner
-                    FROM projects INNER JOIN contributors
-                        ON projects.id = contributors.project_id
-                    WHERE contributors.username = ?
-                    """, (username,))
-            projects = self.__cursor.fetchall()
-            return [ Project(*project) for project in projects ]
+        projects = self.__db.execute("""
+                SELECT projects.id, projects.name, projects.owner
+                FROM projects INNER JOIN contributors
+                    ON projects.id = contributors.project_id
+                WHERE contributors.username = ?
+                """, (username,)).fetchall()
+        return [ Project(*project) for project in projects ]
 
 if __name__ == "__main__":
     import os
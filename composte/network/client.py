@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
 
 import zmq
+# Requests go out over a DEALER socket rather than a REQ socket, so that any
+# number of them can be in flight at once. Every request is prefixed with an
+# ID and an empty delimiter frame. The server's REP workers treat everything
+# before the delimiter as the envelope and send it back untouched, so replies
+# can be matched to requests in whatever order they arrive.
+# zmq sockets must not be shared between threads, so the DEALER belongs to an
+# I/O thread, and other threads hand it requests through an inproc socket.
 
 from network.fake.security import Encryption, Log
 from network.base.exceptions import EncryptError, DecryptError, GenericError
@@ -8,6 +15,9 @@ from network.base.loggable import Loggable, DevNull
 
 from threading import Thread, Lock
 from queue import Queue
+from concurrent.futures import Future
+import asyncio
+import itertools
 
 class Subscription(Loggable):
     def __init__(self, remote_address, zmq_context, logger):
@@ -15,6 +25,7 @@ class Subscription(Loggable):
         Subscription.__init__(self, remote_address, zmq_context)
         Subscription to a publishing endpoint at remote_address
         Requires a zmq context
+        Nothing is received until at least one topic is subscribed to
         """
         super(Subscription, self).__init__(logger)
 
@@ -23,7 +34,6 @@ class Subscription(Loggable):
         # Subscription to remote broadcasts
         self.__addr = remote_address
         self.__socket = self.__context.socket(zmq.SUB)
-        self.__socket.setsockopt_string(zmq.SUBSCRIBE, "")
         self.__socket.connect(self.__addr)
 
         self.__backlog = Queue(1024)
@@ -48,11 +58,29 @@ class Subscription(Loggable):
                     msg = None
                     return msg
                 for i in range(nmsg):
-                    self.__backlog.put(self.__socket.recv_string())
+                    (topic, message) = self.__socket.recv_multipart()
+                    self.__backlog.put(message.decode())
                 msg = self.__backlog.get()
 
         return msg
 
+    def subscribe(self, topic):
+        """
+        Subscription.subscribe(self, topic)
+        Start receiving broadcasts published under topic. Topics are matched
+        by prefix, so the empty topic matches everything
+        """
+        with self.__lock:
+            self.__socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+
+    def unsubscribe(self, topic):
+        """
+        Subscription.unsubscribe(self, topic)
+        Stop receiving broadcasts published under topic
+        """
+        with self.__lock:
+            self.__socket.setsockopt_string(zmq.UNSUBSCRIBE, topic)
+
     def stop(self):
         """
         Subscription.stop(self)
@@ -62,9 +90,19 @@ class Subscription(Loggable):
             self.__socket.disconnect(self.__addr)
             self.__socket.close()
 
+class Reply(Future):
+    """
+    The eventual reply to a request. Block on it with Reply.result, or await
+    it from a coroutine
+    """
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
 # For legacy reasons, broadcast handler is separate: Subscription.
 class Client(Loggable):
     __context = zmq.Context()
+    # Numbers clients, to keep their inproc endpoints apart
+    __instances = itertools.count()
     def __init__(self, remote_address, broadcast_address,
             logger, encryption_scheme = Encryption()):
         """
@@ -80,9 +118,25 @@ class Client(Loggable):
 
         # Interact with remote server
         self.__raddr = remote_address
-        self.__isocket = self.__context.socket(zmq.REQ)
+        self.__isocket = self.__context.socket(zmq.DEALER)
         self.__isocket.connect(self.__raddr)
 
+        # Requests are handed to the I/O thread through here. inproc
+        # endpoints must be unique per context, and the context is shared
+        # between clients
+        self.__qaddr = "inproc://composte-client-{}".format(
+                next(Client.__instances))
+        self.__qpull = self.__context.socket(zmq.PULL)
+        self.__qpull.bind(self.__qaddr)
+        self.__qpush = self.__context.socket(zmq.PUSH)
+        self.__qpush.connect(self.__qaddr)
+        self.__qlock = Lock()
+
+        # request ID -> (Reply, preprocess, multipart)
+        self.__pending = {}
+        self.__plock = Lock()
+        self.__ids = itertools.count()
+
         # Receive broadcasts
         self.__done = False
         self.__background = None
@@ -92,29 +146,136 @@ class Client(Loggable):
         self.__lock = Lock()
         self.__background_lock = Lock()
 
-    def send(self, message, preprocess = lambda x: x):
+        # Nothing is lost if this dies with the process: whoever is waiting
+        # on a reply is dying too
+        self.__io = Thread(target = self.__shuttle_almost_forever,
+                daemon = True)
+        self.__io.start()
+
+    def send(self, message, preprocess = lambda x: x, multipart = False):
         """
-        Client.send(self, message, preprocess = lambda msg: msg)
+        Client.send(self, message, preprocess = lambda msg: msg,
+            multipart = False)
         Send a message down the interactive socket, blocking until a reply is
-        received.
-        The reply is fed through preprocess before being returned
+        received. See Client.send_async
+        """
+        return self.send_async(message, preprocess, multipart).result()
+
+    def send_async(self, message, preprocess = lambda x: x,
+            multipart = False):
+        """
+        Client.send_async(self, message, preprocess = lambda msg: msg,
+            multipart = False)
+        Send a message down the interactive socket without waiting for the
+        reply. Returns a Reply that resolves to the reply.
+        If multipart is set, the reply is received as a list of frames
+        (bytes) rather than a string.
+        The reply is fed through preprocess before being resolved
         """
         with self.__lock:
-            try:
-                message = self.__translator.encrypt(message)
-            except EncryptError as e:
-                self.error("Failed to encrypt message {}".format(message))
-                raise e
-
-            self.__isocket.send_string(message)
-            msg = self.__isocket.recv_string()
-
-            try:
-                msg = preprocess(msg)
-            except GenericError as e:
-                self.error("Failed to preprocess message {}".format(message))
-                raise e
-            return msg
+            if self.__done:
+                raise GenericError("Client stopped")
+
+        try:
+            message = self.__translator.encrypt(message)
+        except EncryptError as e:
+            self.error("Failed to encrypt message {}".format(message))
+            raise e
+
+        reply = Reply()
+        reqid = str(next(self.__ids)).encode()
+        with self.__plock:
+            self.__pending[reqid] = (reply, preprocess, multipart)
+
+        with self.__qlock:
+            self.__qpush.send_multipart([reqid, message.encode()])
+
+        return reply
+
+    def __shuttle_almost_forever(self, poll_timeout = 500):
+        """
+        Client.__shuttle_almost_forever(self, poll_timeout = 500)
+        Hand requests to the server and replies to whoever is waiting for
+        them until the client is stopped
+        """
+        poller = zmq.Poller()
+        poller.register(self.__isocket, zmq.POLLIN)
+        poller.register(self.__qpull, zmq.POLLIN)
+
+        while True:
+            with self.__lock:
+                if self.__done: break
+
+            events = dict(poller.poll(poll_timeout))
+
+            # Drain everything that is ready, so that requests sent in
+            # quick succession go out back to back
+            if self.__qpull in events:
+                while self.__qpull.poll(0):
+                    (reqid, message) = self.__qpull.recv_multipart()
+                    self.__isocket.send_multipart([reqid, b"", message])
+
+            if self.__isocket in events:
+                while self.__isocket.poll(0):
+                    frames = self.__isocket.recv_multipart()
+                    self.__resolve(frames[0], frames[2:])
+
+        with self.__plock:
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+        for (reply, _, _) in pending:
+            reply.set_exception(GenericError("Client stopped"))
+
+        self.__isocket.disconnect(self.__raddr)
+        self.__isocket.close(linger = 0)
+        self.__qpush.close(linger = 0)
+        self.__qpull.close(linger = 0)
+
+    def __resolve(self, reqid, frames):
+        """
+        Client.__resolve(self, reqid, frames)
+        Resolve the reply to the request reqid with the frames received
+        """
+        with self.__plock:
+            (reply, preprocess, multipart) = \
+                    self.__pending.pop(reqid, (None, None, None))
+
+        if reply is None:
+            self.error("Received a reply to unknown request {}".format(reqid))
+            return
+
+        try:
+            if multipart:
+                msg = [ self.__translator.decrypt(frame) for frame in frames ]
+            else:
+                msg = self.__translator.decrypt(frames[0].decode())
+        except DecryptError as e:
+            self.error("Failed to decrypt reply to {}".format(reqid))
+            reply.set_exception(e)
+            return
+
+        try:
+            msg = preprocess(msg)
+        except Exception as e:
+            self.error("Failed to preprocess reply {}".format(msg))
+            reply.set_exception(e)
+            return
+
+        reply.set_result(msg)
+
+    def subscribe(self, topic):
+        """
+        Client.subscribe(self, topic)
+        Receive broadcasts published under topic
+        """
+        self.__listener.subscribe(topic)
+
+    def unsubscribe(self, topic):
+        """
+        Client.unsubscribe(self, topic)
+        Stop receiving broadcasts published under topic
+        """
+        self.__listener.unsubscribe(topic)
 
     def pause_background(self):
         self.__background_lock.acquire()
@@ -186,13 +347,16 @@ class Client(Loggable):
         """
         self.info("Stopping client")
         with self.__lock:
-            self.__isocket.disconnect(self.__raddr)
-            self.__isocket.close()
-
             self.__done = True
 
-        self.__background.join()
-        self.__background = None
+        self.__io.join()
+
+        # The background thread stops the listener on its way out
+        if self.__background != None:
+            self.__background.join()
+            self.__background = None
+        else:
+            self.__listener.stop()
 
         self.info("Client stopped")
 
@@ -210,6 +374,8 @@ if __name__ == "__main__":
             Encryption())
 
     # Start broadcast handlers
+    s1.subscribe("")
+    s2.subscribe("")
     s1.start_background(echo, lambda m: id("1: ", m), 500)
     s2.start_background(echo, lambda m: id("2: ", m), 500)
 
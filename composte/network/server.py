@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
 import zmq
-# A REP socket replies to the client who sent the last message. This means
-# that we can't really get away with worker threads here, as
-# REQ/Processing/REP must be serialized as a cohesive unit. This problem seems
-# to be generally tractable though, per
-# https://stackoverflow.com/questions/29420666/zmq-multiple-request-reply-pairs
+# A REP socket replies to the client who sent the last message, so
+# REQ/Processing/REP must be serialized as a cohesive unit. To get away with
+# worker threads anyway, the interactive socket is a ROUTER that hands
+# requests to another ROUTER, and every worker owns a REQ socket connected to
+# that one. Workers ask for a request whenever they are idle, and requests
+# only go to idle workers, so that nothing queues up behind a slow request
+# while other workers sit around. The envelope carries replies back to the
+# right client. This is the load balancing broker of
+# https://zguide.zeromq.org/docs/chapter3/#A-Load-Balancing-Message-Broker
 
 from network.fake.security import Encryption, Log
 from network.base.exceptions import DecryptError, EncryptError, GenericError
@@ -13,6 +17,7 @@ from network.base.loggable import Loggable, StdErr
 from network.conf import logging as log
 
 import logging
+from collections import deque
 from threading import Lock, Thread
 
 # Need signal handlers to properly run as daemon
@@ -22,29 +27,39 @@ import traceback
 
 DEBUG = False
 
+# What workers say when they first ask for a request
+READY = b"READY"
+
 # Broadcast socket   -> Publish/Subscribe
-# Interactive socket -> Request/Reply
+# Interactive socket -> Router/Router -> Request workers
 class Server(Loggable):
     __context = zmq.Context()
     def __init__(self, interactive_address, broadcast_address,
-            logger, encryption_scheme = Encryption()):
+            logger, encryption_scheme = Encryption(), workers = 1):
         """
         Server.__init__(self, interactive_address, broadcast_address,
-            logger, encryption_scheme = Encryption(), logger = None)
+            logger, encryption_scheme = Encryption(), workers = 1)
         The network server for Composte.
         interactive_address and broadcast_address must be available for this
         application to bind to.
         encryption_scheme must provide encrypt and decrypt methods
         logger must support at least the methods of base.loggable.Loggable
+        workers is the number of threads handling requests concurrently
         """
         super(Server, self).__init__(logger)
 
         self.__translator = encryption_scheme
 
         self.__iaddr = interactive_address
-        self.__isocket = self.__context.socket(zmq.REP)
+        self.__isocket = self.__context.socket(zmq.ROUTER)
         self.__isocket.bind(self.__iaddr)
 
+        # Workers connect here to pick up requests. inproc endpoints must be
+        # unique per context, and the context is shared between servers
+        self.__waddr = "inproc://composte-workers-{}".format(id(self))
+        self.__wsocket = self.__context.socket(zmq.ROUTER)
+        self.__wsocket.bind(self.__waddr)
+
         self.__baddr = broadcast_address
         self.__bsocket = self.__context.socket(zmq.PUB)
         self.__bsocket.bind(self.__baddr)
@@ -55,107 +70,185 @@ class Server(Loggable):
         self.__ilock = Lock()
         self.__block = Lock();
 
+        self.__nworkers = max(1, workers)
+        self.__workers = []
         self.__listen_thread = None
 
         # self.info("Bound to {} and {}".format(self.__iaddr, self.__baddr))
 
-    def broadcast(self, message):
+    def broadcast(self, message, topic = ""):
         """
-        Server.broadcast(self, message)
-        Broadcast a message to all subscribed clients
+        Server.broadcast(self, message, topic = "")
+        Broadcast a message to all clients subscribed to topic. Subscriptions
+        are filtered by the publisher, so clients never see the topics they
+        did not ask for
         """
-        self.info("Broadcasting {}".format(message))
+        self.info("Broadcasting {}: {}".format(topic, message))
         with self.__block:
-            self.__bsocket.send_string(message)
+            self.__bsocket.send_multipart([topic.encode(), message.encode()])
 
     def fail(self, message, reason):
         """
         Server.fail(self, message, reason)
-        Send a failure message to a client
+        Log a failure and produce the failure message to send to a client
         """
         # Probably need a better generic failure message format, but eh
         self.error("Failure ({}): {}".format(message, reason))
-        self.__isocket.send_string("Failure ({}): {}".format(reason,
-            message))
+        return "Failure ({}): {}".format(reason, message)
 
     def start_background(self, handler = lambda x: x,
             preprocess = lambda x: x, postprocess = lambda msg: msg,
             poll_timeout = 2000):
         """
         Server.start_background
-        Starts Server.__listen_almost_forever in a background thread,
-        forwarding arguments. For further details, see
-        Server.__listen_almost_forever
+        Starts Server.__listen_almost_forever in a background thread, along
+        with the worker threads, forwarding arguments. For further details,
+        see Server.__listen_almost_forever and Server.__work_almost_forever
+        With more than one worker, handler, preprocess and postprocess are
+        invoked concurrently and must be thread-safe
         """
         if self.__listen_thread != None: return
         self.__listen_thread = Thread(target = self.__listen_almost_forever,
-                args = (handler, preprocess, postprocess, poll_timeout))
+                args = (poll_timeout,))
+
+        for i in range(self.__nworkers):
+            worker = Thread(target = self.__work_almost_forever,
+                    args = (handler, preprocess, postprocess, poll_timeout))
+            self.__workers.append(worker)
+            worker.start()
+
         self.__listen_thread.start()
 
-    def __listen_almost_forever(self, handler = lambda x: x,
+    def __listen_almost_forever(self, poll_timeout = 2000):
+        """
+        Server.__listen_almost_forever(self, poll_timeout = 2000)
+        Shuttles messages between the interactive socket and the workers
+        until the server is stopped, handing each request to a worker that
+        is idle. poll_timeout controls how long a poll operation will wait
+        before failing.
+        Replies are routed back to clients by the identity frames that the
+        interactive socket prepends to each request, and requests are routed
+        to workers by the identity frames that the worker socket prepends to
+        each of their messages
+        """
+        # Requests are left waiting in the interactive socket until there is
+        # a worker to take them
+        workers = zmq.Poller()
+        workers.register(self.__wsocket, zmq.POLLIN)
+        both = zmq.Poller()
+        both.register(self.__wsocket, zmq.POLLIN)
+        both.register(self.__isocket, zmq.POLLIN)
+        idle = deque()
+
+        try:
+            while True:
+                with self.__dlock:
+                    if self.__done: break
+
+                with self.__ilock:
+                    poller = both if idle else workers
+                    events = dict(poller.poll(poll_timeout))
+
+                    if self.__wsocket in events:
+                        # [ worker, empty, READY ] or [ worker, empty, reply ]
+                        frames = self.__wsocket.recv_multipart()
+                        idle.append(frames[0])
+                        if frames[2:] != [READY]:
+                            self.__isocket.send_multipart(frames[2:])
+
+                    if self.__isocket in events:
+                        frames = self.__isocket.recv_multipart()
+                        self.__wsocket.send_multipart(
+                                [idle.popleft(), b""] + frames)
+        except KeyboardInterrupt as e:
+            self.stop()
+
+    def __work_almost_forever(self, handler = lambda x: x,
             preprocess = lambda x: x, postprocess = lambda msg: msg,
             poll_timeout = 2000):
         """
-        Server.__listen_almost_forever(self, handler = lambda msg: msg,
-            preprocess = lambda msg: msg, poll_timeout = 2000)
-        Polls for messages on the interactive socket until the server is
+        Server.__work_almost_forever(self, handler = lambda msg: msg,
+            preprocess = lambda msg: msg, postprocess = lambda msg: msg,
+            poll_timeout = 2000)
+        Polls for requests handed out to this worker until the server is
         stopped. poll_timeout controls how long a poll operation will wait
         before failing.
         Messages are pushed through the pipeline preprocess -> handler ->
-        postprocess, and the result is sent back to as a client
+        postprocess, and the result is sent back to as a client. If
+        postprocess produces a list, each element is sent as a frame of a
+        multipart reply
         """
+        # zmq sockets must not be shared between threads, so every worker
+        # gets its own
+        socket = self.__context.socket(zmq.REQ)
+        socket.connect(self.__waddr)
+        socket.send(READY)
+
         try:
             while True:
                 with self.__dlock:
                     if self.__done: break
 
-                with self.__ilock:
-                    nmsg = self.__isocket.poll(poll_timeout)
-                    if nmsg == 0:
-                        continue
-                    message =  self.__isocket.recv_string()
-                    # Unconditionally catch and ignore _all_ unexpected
-                    # exceptions during the invocations of client-provided
-                    # functions
-                    try:
-                        try:
-                            message = self.__translator.decrypt(message)
-                        except DecryptError as e:
-                            self.fail(message, "Decryption failure")
-                            continue
-
-                        try:
-                            message = preprocess(message)
-                        except GenericError as e:
-                            self.fail(message, "Internal server error")
-                            continue
-
-                        try:
-                            reply = handler(self, message)
-                        except GenericError as e:
-                            self.fail(message, "Internal server error")
-                            continue
-
-                        try:
-                            reply = postprocess(reply)
-                        except GenericError as e:
-                            self.fail(message, "Internal server error")
-                            continue
-
-                        try:
-                            reply = self.__translator.encrypt(reply)
-                        except EncryptError as e:
-                            self.fail(message, "Encryption failure")
-                            continue
-                    except:
-                        self.fail(message, "Malformed message")
-                        self.error("Uncaught exception: {}"
-                                .format(traceback.format_exc()))
-                        continue
-
-                    self.__isocket.send_string(reply)
-        except KeyboardInterrupt as e:
-            self.stop()
+                nmsg = socket.poll(poll_timeout)
+                if nmsg == 0:
+                    continue
+                # [ *envelope, empty, message ], where the envelope is how
+                # the reply finds its way back to the client
+                frames = socket.recv_multipart()
+                split = frames.index(b"") + 1
+                message = frames[split].decode()
+                reply = self.__process(message, handler, preprocess,
+                        postprocess)
+                if type(reply) != list:
+                    reply = [reply.encode()]
+                # Also asks for the next request
+                socket.send_multipart(frames[:split] + reply)
+        finally:
+            socket.close(linger = 0)
+
+    def __process(self, message, handler, preprocess, postprocess):
+        """
+        Server.__process(self, message, handler, preprocess, postprocess)
+        Push a single message through the pipeline, producing the reply to
+        send back to the client
+        """
+        # Unconditionally catch and ignore _all_ unexpected exceptions during
+        # the invocations of client-provided functions
+        try:
+            try:
+                message = self.__translator.decrypt(message)
+            except DecryptError as e:
+                return self.fail(message, "Decryption failure")
+
+            try:
+                message = preprocess(message)
+            except GenericError as e:
+                return self.fail(message, "Internal server error")
+
+            try:
+                reply = handler(self, message)
+            except GenericError as e:
+                return self.fail(message, "Internal server error")
+
+            try:
+                reply = postprocess(reply)
+            except GenericError as e:
+                return self.fail(message, "Internal server error")
+
+            try:
+                if type(reply) == list:
+                    reply = [ self.__translator.encrypt(frame)
+                              for frame in reply ]
+                else:
+                    reply = self.__translator.encrypt(reply)
+            except EncryptError as e:
+                return self.fail(message, "Encryption failure")
+        except:
+            self.error("Uncaught exception: {}"
+                    .format(traceback.format_exc()))
+            return self.fail(message, "Malformed message")
+
+        return reply
 
     def stop(self):
         """
@@ -167,18 +260,22 @@ class Server(Loggable):
             self.info("Stopping polling")
             self.__done = True
 
+        for worker in self.__workers:
+            worker.join()
+
+        self.__listen_thread.join()
+
         with self.__ilock:
             iaddr = self.__isocket.last_endpoint.decode()
             self.info("Unbinding interactive socket from {}".format(iaddr))
             self.__isocket.unbind(iaddr)
+            self.__wsocket.unbind(self.__waddr)
 
         with self.__block:
             baddr = self.__bsocket.last_endpoint.decode()
             self.info("Unbinding broadcast socket from {}".format(baddr))
             self.__bsocket.unbind(baddr)
 
-        self.__listen_thread.join()
-
         self.info("Server stopped")
 
 def echo(server, message):
@@ -5,18 +5,21 @@ import music21
 
 from protocol.base.exceptions import DeserializationFailure
 
-def serialize(function_name, *args):
+def serialize(function_name, *args, **fields):
     """
     Serialize a message to be sent from client to server
 
     function_name =:= type(str)
     args =:= type(list of str)
+    fields are JSON-serializable values carried alongside, under their own
+    names
     """
 
     rpc = {
         "fName": function_name,
         "args": [str(arg) for arg in args],
     }
+    rpc.update(fields)
 
     return json.dumps(rpc)
 
@@ -26,5 +26,33 @@ def deserialize(msg):
         raise DeserializationFailure("Received malformed data: {}".format(msg))
     return pythonObject
 
+class Frames:
+    """
+    Reply arguments that are sent as a multipart message instead: the
+    arguments in header are serialized as usual into the first frame, and
+    each of payloads follows verbatim in a frame of its own. Useful for
+    bulky binary data that would otherwise be escaped into JSON
+    """
+    def __init__(self, header, payloads):
+        self.header = header
+        self.payloads = payloads
+
+def serialize_frames(status, frames):
+    """
+    Serialize a multipart message sent to clients from the server as a list of
+    frames [ [ status, [ *header ] ], *payloads ]
+    """
+    return [ serialize(status, *frames.header).encode() ] + \
+            [ bytes(payload) for payload in frames.payloads ]
+
+def deserialize_frames(frames):
+    """
+    Deserialize a multipart message received from a server as a tuple
+    ( status, [ *header ], [ *payloads ] )
+    Single-part messages deserialize with no payloads
+    """
+    (status, header) = deserialize(frames[0].decode())
+    return (status, header, frames[1:])
+
 # ==============================================================================
 
@@ -1,3 +1,8 @@
+from threading import RLock, Lock
+from contextlib import contextmanager
+import time
+import uuid
+
 
 class Pool:
     """
@@ -40,54 +45,207 @@ class ProjectPool:
     """
     Pool Composte projects in memory
     uuid -> (project, count)
+
+    Projects are keyed by the string form of their IDs, so callers may use
+    either strings or UUIDs.
     """
 
     __objects = {}
+    # uuid -> [lock serializing all work on that project, threads holding
+    # or waiting on it]
+    __locks = {}
+    # uuid -> (generation, persisted generation)
+    __generations = {}
+    # Guards the bookkeeping above, never held across work on a project
+    __lock = RLock()
 
     def __init__(self):
         pass
 
+    @contextmanager
+    def lock(self, uuid):
+        """
+        Hold the lock serializing work on a project, creating it if
+        necessary. Work on different projects never contends. The lock is
+        dropped once nobody holds or waits on it and the project is no
+        longer pooled
+        """
+        uuid = str(uuid)
+        with ProjectPool.__lock:
+            entry = ProjectPool.__locks.get(uuid)
+            if entry is None:
+                entry = ProjectPool.__locks[uuid] = [RLock(), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            # Not in remove, which always runs under the lock itself, and
+            # which others may already be waiting on
+            with ProjectPool.__lock:
+                entry[1] -= 1
+                if entry[1] == 0 and uuid not in ProjectPool.__objects:
+                    del ProjectPool.__locks[uuid]
+
     def put(self, uuid, constructor = None):
         """
         Fetch a project and bump its refcount. When the requested project is
         not cached, invoke constructor if possible and cache the result.
         """
-        (proj, count) = ProjectPool.__objects.get(uuid, (None, 0))
-
-        if proj is None:
-            if constructor is None:
-                # We don't have it and the client is going to go get it
-                return None
-            else:
-                # We don't have it but the client told us how to get it
-                proj = constructor()
-
-        ProjectPool.__objects[uuid] = (proj, count + 1)
-        return proj
+        uuid = str(uuid)
+        with self.lock(uuid):
+            with ProjectPool.__lock:
+                (proj, count) = ProjectPool.__objects.get(uuid, (None, 0))
+
+            if proj is None:
+                if constructor is None:
+                    # We don't have it and the client is going to go get it
+                    return None
+                else:
+                    # We don't have it but the client told us how to get it
+                    proj = constructor()
+
+            with ProjectPool.__lock:
+                ProjectPool.__objects[uuid] = (proj, count + 1)
+            return proj
 
     def remove(self, uuid, on_removal = lambda x: x):
         """
         Un-use a project, running on_removal with the project as the only
         argumargument when the reference is removed
         """
-        (proj, count) = ProjectPool.__objects.get(uuid, (None, 0))
-
-        if count is None:
-            return
-
-        if count > 1:
-            ProjectPool.__objects[uuid] = (proj, count - 1)
-        elif count == 1:
-            on_removal(proj)
-            del ProjectPool.__objects[uuid]
+        uuid = str(uuid)
+        with self.lock(uuid):
+            with ProjectPool.__lock:
+                (proj, count) = ProjectPool.__objects.get(uuid, (None, 0))
+
+            if count is None:
+                return
+
+            if count > 1:
+                with ProjectPool.__lock:
+                    ProjectPool.__objects[uuid] = (proj, count - 1)
+            elif count == 1:
+                on_removal(proj)
+                with ProjectPool.__lock:
+                    del ProjectPool.__objects[uuid]
+                    ProjectPool.__generations.pop(uuid, None)
+
+            return count - 1
+
+    def touch(self, uuid):
+        """
+        Record that a project changed. Bumps the project's generation.
+        """
+        uuid = str(uuid)
+        with ProjectPool.__lock:
+            (generation, persisted) = \
+                    ProjectPool.__generations.get(uuid, (0, 0))
+            ProjectPool.__generations[uuid] = (generation + 1, persisted)
 
-        return count - 1
+    def dirty(self, uuid):
+        """
+        Retrieve the generation of a project if it changed since it was last
+        persisted, otherwise None
+        """
+        uuid = str(uuid)
+        with ProjectPool.__lock:
+            (generation, persisted) = \
+                    ProjectPool.__generations.get(uuid, (0, 0))
+        if generation == persisted:
+            return None
+        return generation
+
+    def persisted(self, uuid, generation):
+        """
+        Record that a project was persisted as of generation
+        """
+        uuid = str(uuid)
+        with ProjectPool.__lock:
+            (current, _) = ProjectPool.__generations.get(uuid, (0, 0))
+            ProjectPool.__generations[uuid] = (current, generation)
 
     def map(self, mapfun):
         """
-        Apply a function to all cached projects. Adding or removing projects
-        during this process results in undefined behavior.
+        Apply a function to all cached projects. Projects added or removed
+        during this process may or may not be visited.
         """
-        for pid, (proj, count) in ProjectPool.__objects.items():
+        with ProjectPool.__lock:
+            objects = list(ProjectPool.__objects.items())
+
+        for pid, (proj, count) in objects:
             mapfun(proj, count)
 
+class SessionTable:
+    """
+    Subscriptions of clients to projects
+    cookie -> (user, project_id, last seen)
+
+    Clients are expected to be heard from every so often, so that the
+    sessions of clients that went away without unsubscribing can be expired.
+    """
+
+    def __init__(self):
+        self.__sessions = {}
+        self.__lock = Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__sessions)
+
+    def open(self, user, project_id):
+        """
+        Start a session of user subscribed to project_id, and retrieve its
+        cookie. We don't bother checking for UUID collisions, since they
+        "don't" happen
+        """
+        cookie = uuid.uuid4()
+        with self.__lock:
+            self.__sessions[cookie] = (user, project_id, time.monotonic())
+        return cookie
+
+    def get(self, cookie):
+        """
+        Retrieve the (user, project_id) of a session, or None if there is no
+        such session
+        """
+        with self.__lock:
+            session = self.__sessions.get(cookie, None)
+        if session is None:
+            return None
+        return session[:2]
+
+    def touch(self, cookie):
+        """
+        Record that the client holding cookie was just heard from. Returns
+        whether there is such a session
+        """
+        with self.__lock:
+            session = self.__sessions.get(cookie, None)
+            if session is None:
+                return False
+            self.__sessions[cookie] = session[:2] + (time.monotonic(),)
+            return True
+
+    def close(self, cookie):
+        """
+        End a session, and retrieve its (user, project_id), or None if there
+        is no such session
+        """
+        with self.__lock:
+            session = self.__sessions.pop(cookie, None)
+        if session is None:
+            return None
+        return session[:2]
+
+    def expire(self, idle):
+        """
+        End the sessions not heard from in the last idle seconds, and retrieve
+        their (user, project_id)s
+        """
+        cutoff = time.monotonic() - idle
+        with self.__lock:
+            expired = [ cookie for (cookie, (_, _, seen))
+                        in self.__sessions.items() if seen < cutoff ]
+            return [ self.__sessions.pop(cookie)[:2] for cookie in expired ]
@@ -3,6 +3,7 @@ import uuid
 import json
 import base64
 from network.base.exceptions import GenericError
+from util import scoreFormat
 # from copy import deepcopy
 
 class ComposteProject:
@@ -26,6 +27,8 @@ class ComposteProject:
             self.projectID = projectID
         else:
             self.projectID = uuid.uuid4()
+        # Bumped by the server for every update it applies
+        self.revision = 0
 
     def addPart(self):
         """ Adds a new part to a project. """
@@ -67,7 +70,7 @@ class ComposteProject:
             a ComposteProject. Intended to be stored in three
             discrete database fields. Returns a tuple containing the
             serialized JSON objects. """
-        bits = [ music21.converter.freezeStr(part) for part in self.parts ]
+        bits = [ scoreFormat.encodePart(part) for part in self.parts ]
         bytes_ = [ base64.b64encode(bit).decode() for bit in bits ]
         parts = json.dumps(bytes_)
         metadata = json.dumps(self.metadata)
@@ -80,7 +83,7 @@ def deserializeProject(serializedProject):
     (metadata, parts, id_) = serializedProject
     bits = json.loads(parts)
     bytes_ = [ base64.b64decode(bit.encode()) for bit in bits ]
-    parts = [ music21.converter.thawStr(byte) for byte in bytes_ ]
+    parts = [ scoreFormat.decodePart(byte) for byte in bytes_ ]
     metadata = json.loads(metadata)
     id_ = uuid.UUID(id_)
     return ComposteProject(metadata, parts, id_)
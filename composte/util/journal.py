@@ -0,0 +1,125 @@
+import json
+import os
+from collections import deque
+
+class Journal:
+    """
+    Append-only log of the updates applied to a project since it was last
+    snapshotted. Each record is one line of JSON:
+        [ revision, fname, args, partIndex, offset ]
+    where everything but the revision is exactly what was handed to
+    musicWrapper.performMusicFun. Updates applied together as a batch share
+    a revision. Appending a record is much cheaper than
+    rewriting the whole project, so records are made durable as soon as they
+    are appended.
+
+    Journals are not thread-safe. Callers are expected to hold the lock of the
+    project being journaled.
+    """
+
+    def __init__(self, path):
+        self.__path = path
+
+    def append(self, revision, fname, args, partIndex, offset):
+        """
+        Durably append the update that brought a project to revision
+        """
+        self.extend([(revision, fname, args, partIndex, offset)])
+
+    def extend(self, records):
+        """
+        Durably append a list of records at once
+        """
+        lines = [ json.dumps(list(record), separators = (",", ":")) + "\n"
+                  for record in records ]
+        with open(self.__path, "a") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self, after = 0):
+        """
+        Yield the records of updates past revision after, in order, as
+        (revision, fname, args, partIndex, offset) tuples
+        """
+        try:
+            with open(self.__path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn write from a crash mid-append. Nothing after it was
+                # ever acknowledged, so there is nothing after it to replay.
+                return
+            if record[0] > after:
+                yield tuple(record)
+
+    def truncate(self, through):
+        """
+        Drop the records of updates up to and including revision through,
+        usually because a snapshot now includes them
+        """
+        remaining = list(self.records(through))
+
+        if not remaining:
+            try:
+                os.remove(self.__path)
+            except FileNotFoundError:
+                pass
+            return
+
+        tmp = self.__path + ".tmp"
+        with open(tmp, "w") as f:
+            for record in remaining:
+                f.write(json.dumps(record, separators = (",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.__path)
+
+class History:
+    """
+    The most recent updates applied to a project, kept in memory so that
+    clients who fell a few updates behind can catch up without fetching the
+    whole project again. Records are the same tuples that Journal.records
+    produces.
+
+    Histories are not thread-safe. Callers are expected to hold the lock of
+    the project whose history it is.
+    """
+
+    def __init__(self, revision, length = 1024):
+        """
+        Start an empty history of a project at revision, retaining at most
+        length records
+        """
+        self.__records = deque(maxlen = length)
+        # The revision that the oldest retained record applies on top of
+        self.__base = revision
+
+    def append(self, revision, fname, args, partIndex, offset):
+        """
+        Remember the update that brought a project to revision. Records of
+        the same batch share a revision; skipping revisions means the updates
+        in between were lost, so nothing from before them can be served
+        """
+        newest = self.__records[-1][0] if self.__records else self.__base
+        if revision > newest + 1:
+            self.__records.clear()
+            self.__base = revision - 1
+        elif len(self.__records) == self.__records.maxlen:
+            self.__base = self.__records[0][0]
+        self.__records.append((revision, fname, args, partIndex, offset))
+
+    def since(self, revision):
+        """
+        Retrieve the records of updates past revision, in order, or None if
+        they are no longer all retained
+        """
+        newest = self.__records[-1][0] if self.__records else self.__base
+        if revision < self.__base or revision > newest:
+            return None
+        return [ record for record in self.__records if record[0] > revision ]
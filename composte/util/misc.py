@@ -21,3 +21,15 @@ def get_version():
 
     return ver
 
+
+def write_atomically(path, contents):
+    """
+    Replace the contents of a file such that readers see either the old
+    contents or the new contents, but never a mix of the two
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb" if isinstance(contents, bytes) else "w") as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -1,4 +1,6 @@
 import music21
+import itertools
+from util.offsetIndex import OffsetIndex
 
 # TODO FOR FUTURE SELVES BEYOND COMP50: 
 # Refactor projects and streams globally to obey a
@@ -31,17 +33,18 @@ def changeKeySignature(offset, part, newSigSharps):
         Must provide the correct number of sharps in the key signature
         as an integer. Negative numbers correspond to the number of flats. """
     newKeySig = music21.key.KeySignature(newSigSharps)
-    oldKeySigs = part.getKeySignatures()
+    index = OffsetIndex.of(part)
+    oldKeySigs = index.between(0.0, float("inf"), music21.key.KeySignature)
     for i in range(len(oldKeySigs)):
         if oldKeySigs[i].offset == offset:
-            part.replace(oldKeySigs[i], newKeySig)
+            index.replace(oldKeySigs[i], newKeySig)
             if i + 1 == len(oldKeySigs):
                 renameNotes(offset, part, newKeySig)
                 return [offset, part.highestTime]
             else:
                 renameNotes(offset, part, newKeySig, oldKeySigs[i + 1].offset)
                 return [offset, oldKeySigs[i + 1].offset]
-    part.insert(offset, newKeySig)
+    index.insert(offset, newKeySig)
     for oldKeySig in oldKeySigs:
         # oldKeySigs is sorted, so this finds the first oldKeySig
         # That's after the one that was just inserted
@@ -56,16 +59,12 @@ def renameNotes(startOffset, part, keySig, endOffset=None):
         intelligently so as to not have sharp accidentals
         in a flat key signature. Diffs need to accumulate
         while the renaming is in process. """
-    notes = part.notes
+    index = OffsetIndex.of(part)
+    if endOffset is None:
+        endOffset = float("inf")
     hasSharps = 0 < keySig.sharps
-    for note in notes:
-        offset = note.offset
-        if endOffset is None:
-            if startOffset <= offset:
-                part.replace(note, renameNote(note, hasSharps))
-        else:
-            if startOffset <= offset and offset <= endOffset:
-                part.replace(note, renameNote(note, hasSharps))
+    for note in index.between(startOffset, endOffset, music21.note.Note):
+        index.replace(note, renameNote(note, hasSharps))
 
 def renameNote(note, hasSharps):
     """ Rename a note intelligently within a key. """
@@ -101,12 +100,11 @@ def changeTimeSignature(offset, part, newSigStr):
         newTimeSig must be a string representing the new time signature,
         such as '4/4' or '6/8'. """
     newTimeSig = music21.meter.TimeSignature(newSigStr)
-    oldTimeSigs = part.getTimeSignatures()
-    for oldTimeSig in oldTimeSigs:
-        if oldTimeSig.offset == offset:
-            part.replace(oldTimeSig, newTimeSig)
-            return part.getElementsByOffset(offset)
-    part.insert(offset, newTimeSig)
+    index = OffsetIndex.of(part)
+    for oldTimeSig in index.at(offset, music21.meter.TimeSignature):
+        index.replace(oldTimeSig, newTimeSig)
+        return part.getElementsByOffset(offset)
+    index.insert(offset, newTimeSig)
     return part.getElementsByOffset(offset)
 
 def insertMetronomeMark(offset, parts, bpm):
@@ -119,27 +117,23 @@ def insertMetronomeMark(offset, parts, bpm):
         BPM (beats per minute). """
     mark = music21.tempo.MetronomeMark("", bpm, 1.0)
     for part in parts:
-        markings = part.metronomeMarkBoundaries()
-        markFound = False
-        for marking in markings:
-            # Marking already exists at that location, so update it
-            if marking[0] == offset:
-                markFound = True
-                part.replace(marking[2], mark)
-                break
-        if markFound: 
+        index = OffsetIndex.of(part)
+        markings = index.at(offset, music21.tempo.MetronomeMark)
+        # Marking already exists at that location, so update it
+        if markings:
+            index.replace(markings[0], mark)
             continue
-        part.insert(offset, mark)
+        index.insert(offset, mark)
     return [offset, offset]
 
 def removeMetronomeMark(offset, parts):
     """ Remove a metronome marking from each part in
         a list of parts at a given offset. """
     for part in parts:
-        markings = part.metronomeMarkBoundaries()
-        for marking in markings:
-            if marking[0] == offset and offset != 0.0:
-                part.remove(marking[2])
+        index = OffsetIndex.of(part)
+        for marking in index.at(offset, music21.tempo.MetronomeMark):
+            if offset != 0.0:
+                index.remove(marking)
     return [offset, offset]
 
 def createNote(pitchName, durationInQLs):
@@ -156,40 +150,41 @@ def insertNote(offset, part, pitchStr, duration):
     """ Add a note at a given offset to a part. """
     newNote = createNote(pitchStr, duration)
     bounds = (offset, offset + duration) 
-    notes = part.notes
+    index = OffsetIndex.of(part)
     maxLims = [None, None]
-    for note in notes: 
+    for note in index.overlapping(bounds[0], bounds[1], music21.note.Note):
         limits = (note.offset, 
                   note.duration.quarterLength + note.offset)          
-        if bounds[0] < limits[1] and limits[0] < bounds[1]:
-            removeNote(note.offset, part, note.pitch.nameWithOctave)
-            if maxLims[0] is None and maxLims[1] is None: 
-                maxLims = [limits[0], limits[1]]
-            else: 
-                maxLims = [min(maxLims[0], limits[0]),
-                           max(maxLims[1], limits[1])]
+        # Removing a tied note also changes its tie partners
+        removed = removeNote(note.offset, part, note.pitch.nameWithOctave)
+        limits = (min(limits[0], removed[0]), max(limits[1], removed[1]))
+        if maxLims[0] is None and maxLims[1] is None: 
+            maxLims = [limits[0], limits[1]]
+        else: 
+            maxLims = [min(maxLims[0], limits[0]),
+                       max(maxLims[1], limits[1])]
     if maxLims[0] is None and maxLims[1] is None: 
         maxLims = [bounds[0], bounds[1]]
     else: 
         maxLims = [min(maxLims[0], bounds[0]),
                    max(maxLims[1], bounds[1])]
-    part.insert(offset, newNote)
+    index.insert(offset, newNote)
     return maxLims
 
 def removeNote(offset, part, removedNoteName):
     """ Remove a note at a given offset into a part. """
-    notes = part.notes
+    index = OffsetIndex.of(part)
     maxLims = [offset, offset]
-    for note in notes:
+    for note in index.at(offset, music21.note.Note):
         noteName = note.pitch.nameWithOctave
-        if note.offset == offset and noteName == removedNoteName:
+        if noteName == removedNoteName:
             if note.tiePartners[0] is not None: 
                 maxLims[0] = note.tiePartners[0]
                 updateTieStatus(note.tiePartners[0], part, noteName)
             if note.tiePartners[1] is not None: 
                 maxLims[1] = note.tiePartners[1]
                 updateTieStatus(offset, part, noteName)
-            part.remove(note)
+            index.remove(note)
             return maxLims
     return maxLims
 
@@ -199,12 +194,12 @@ def updateTieStatus(offset, part, noteName):
         this function MUST be the same as the offset of the
         FIRST note in a legally tie-able pair of notes (the notes
         must be the same pitch, and there must be no rests between them)."""
-    notes = part.notes
-    for note in notes:
+    index = OffsetIndex.of(part)
+    for note in index.at(offset, music21.note.Note):
         pitchStr = note.pitch.nameWithOctave
-        if note.offset == offset and pitchStr == noteName:
+        if pitchStr == noteName:
             qL = note.duration.quarterLength
-            tieCantidates = part.getElementsByOffset(note.offset + qL)
+            tieCantidates = index.at(note.offset + qL, music21.note.Note)
             for cantidate in tieCantidates:
                 if cantidate.pitch.nameWithOctave == noteName:
                     makeTieUpdate([note, cantidate])
@@ -278,23 +273,25 @@ def insertClef(offset, part, clefStr):
         'fbaritone', 'gsoprano', 'mezzosoprano', 'soprano',
         'percussion', and 'tab'. """
     newClef = music21.clef.clefFromString(clefStr)
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     # Only clef objects have an octaveChange field
     for elem in elems:
         if hasattr(elem, 'octaveChange'):
-            part.replace(elem, newClef)
+            index.replace(elem, newClef)
             return [offset, offset]
-    part.insert(offset, newClef)
+    index.insert(offset, newClef)
     return [offset, offset]
 
 def removeClef(offset, part):
     """ Remove a clef from a given offset in a given part. """
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     for elem in elems:
         # Only clef objects have an octaveChange field
         if hasattr(elem, 'octaveChange'):
             if offset != 0.0:
-                part.remove(elem)
+                index.remove(elem)
             return [offset, offset]
     return [offset, offset]
 
@@ -308,21 +305,23 @@ def addInstrument(offset, part, instrumentStr):
         to a part in the score. The number of instruments
         supported on the backend are much to numerous to name."""
     instrument = music21.instrument.fromString(instrumentStr)
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     for elem in elems:
         if hasattr(elem, 'instrumentName'):
-            part.replace(elem, instrument)
+            index.replace(elem, instrument)
             return [offset, offset]
-    part.insert(offset, instrument)
+    index.insert(offset, instrument)
     return [offset, offset]
 
 def removeInstrument(offset, part):
     """ Remove an instrument beginning at offset from a given part. """
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     for elem in elems:
         if hasattr(elem, 'instrumentName'):
             if offset != 0.0: 
-                part.remove(elem)
+                index.remove(elem)
             return [offset, offset]
     return [offset, offset]
 
@@ -331,30 +330,31 @@ def addDynamic(offset, part, dynamicStr):
         Acceptable values of dynamicStr are 'ppp', 'pp', 'p',
         'mp', 'mf', 'f', 'ff', and 'fff'. """
     dynamic = music21.dynamics.Dynamic(dynamicStr)
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     for elem in elems:
         if hasattr(elem, 'volumeScalar'):
-            part.replace(elem, dynamic)
+            index.replace(elem, dynamic)
             return [offset, offset]
-    part.insert(offset, dynamic)
+    index.insert(offset, dynamic)
     return [offset, offset]
 
 def removeDynamic(offset, part):
     """ Removes a dynamic marking from a part at a given offset. """
-    elems = part.getElementsByOffset(offset)
+    index = OffsetIndex.of(part)
+    elems = index.at(offset)
     for elem in elems:
         if hasattr(elem, 'volumeScalar'):
-            part.remove(elem)
+            index.remove(elem)
             return [offset, offset]
     return [offset, offset]
 
 def addLyric(offset, part, lyric):
     """ Add lyrics to a given note in the score. """
-    notes = part.notes
-    for note in notes:
-        if note.offset == offset:
-            note.addLyric(lyric)
-            return [offset, offset]
+    index = OffsetIndex.of(part)
+    for note in index.at(offset, music21.note.Note):
+        note.addLyric(lyric)
+        return [offset, offset]
     return [offset, offset]
 
 def playback(part): 
@@ -363,11 +363,20 @@ def playback(part):
     music21.midi.realtime.StreamPlayer(part).play()    
 
 def boundedOffset(part, bounds): 
-    """ Returns a bounded offset list for GUI uses. 
+    """ Yields a bounded offset list for GUI uses. 
         An offset map is an (element, offset, endTime) triple.
         element is the music21 object to insert.
         offset is the insertion offset of the music21 object. 
-        endTime is the termination offset of the music21 object. """
-    offs = part.offsetMap()
-    return [x for x in offs 
-            if bounds[0] <= x.offset and x.endTime < bounds[1]]
+        endTime is the termination offset of the music21 object.
+        Elements are included if they begin at or after bounds[0]
+        and before bounds[1]. """
+    index = OffsetIndex.of(part)
+    elements = index.starting(bounds[0], bounds[1])
+    for (offset, group) in itertools.groupby(elements, lambda x: x[0]):
+        # Clefs and signatures first, as in a sorted part, so that the notes
+        # alongside them are drawn under them
+        group = sorted((element for (_, element) in group),
+                       key = lambda element: element.classSortOrder)
+        for element in group:
+            yield music21.stream.base.OffsetMap(element, offset,
+                    offset + float(element.duration.quarterLength), None)
@@ -7,6 +7,7 @@
 
 from util import musicFuns
 from util import composteProject
+from util.offsetIndex import OffsetIndex
 from network.base.exceptions import GenericError
 import music21
 import json
@@ -102,3 +103,49 @@ def performMusicFun(projectID, fname, args, partIndex=None, offset=None,
     # End error handling
     return ("ok", updateOffsets)
 
+
+def updateWindow(part, fname, args):
+    """ Bounds on the offsets of the elements of a part that an update
+        could change, as a [start, end] pair, inclusive. Saving the
+        elements in between is enough to undo the update, whether or not
+        it succeeds. Updates that might reach anywhere give the whole part. """
+    everything = [float("-inf"), float("inf")]
+    try:
+        args = json.loads(args)
+        offset = float(args[0])
+        index = OffsetIndex.of(part)
+
+        if fname == 'insertNote':
+            # Notes in the way are removed, along with their ties
+            end = offset + float(args[3])
+            return tiedWindow(index.overlapping(offset, end,
+                    music21.note.Note), offset, end)
+        elif fname == 'removeNote':
+            return tiedWindow(index.at(offset, music21.note.Note),
+                    offset, offset)
+        elif fname == 'changeKeySignature':
+            # Notes are renamed up to and including the next key signature
+            for keySig in index.between(offset, float("inf"),
+                    music21.key.KeySignature):
+                if offset < keySig.offset:
+                    return [offset, keySig.offset]
+            return [offset, float("inf")]
+        elif fname == 'insertMeasures':
+            return [offset, float("inf")]
+        elif fname in ('insertMetronomeMark', 'removeMetronomeMark',
+                'insertClef', 'removeClef', 'addInstrument',
+                'removeInstrument', 'addDynamic', 'removeDynamic', 'addLyric'):
+            return [offset, offset]
+    except (ValueError, TypeError, IndexError):
+        pass
+    return everything
+
+def tiedWindow(notes, start, end):
+    """ Widen [start, end] to cover the notes given and the notes
+        they are tied to, which removing them updates. """
+    for note in notes:
+        (before, after) = getattr(note, "tiePartners", [None, None])
+        start = min(start, note.offset if before is None else before)
+        end = max(end, note.offset + float(note.duration.quarterLength)
+                       if after is None else after)
+    return [start, end]
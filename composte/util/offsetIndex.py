@@ -0,0 +1,155 @@
+import music21
+from bisect import bisect_left, bisect_right
+from weakref import WeakKeyDictionary, proxy
+
+class OffsetIndex:
+    """
+    The elements of a part, ordered by offset, so that the elements at or
+    around an offset can be found without walking the whole part.
+
+    The index only stays in sync with its part if the part is changed through
+    OffsetIndex.insert, OffsetIndex.remove and OffsetIndex.replace. If the
+    part is changed behind its back in a way that changes the number of
+    elements in it, OffsetIndex.of builds a new index.
+
+    Indices are not thread-safe. Callers are expected to hold the lock of the
+    project that the part belongs to.
+    """
+
+    # part -> index. Parts are weakly referenced, so that an index goes away
+    # along with its part
+    __indices = WeakKeyDictionary()
+
+    def __init__(self, part):
+        """
+        Index the elements of part
+        """
+        # The part owns the index, not the other way around
+        self.__part = proxy(part)
+        self.__offsets = []
+        self.__elements = []
+        # The longest element seen, which bounds how far back an element
+        # overlapping an offset may begin
+        self.__longest = 0.0
+
+        for element in part.elements:
+            self.__add(float(part.elementOffset(element)), element)
+
+    @staticmethod
+    def of(part):
+        """
+        Retrieve the index of part, building it if need be
+        """
+        index = OffsetIndex.__indices.get(part, None)
+        if index is None or len(index) != len(part):
+            index = OffsetIndex(part)
+            OffsetIndex.__indices[part] = index
+        return index
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def __add(self, offset, element):
+        position = bisect_right(self.__offsets, offset)
+        self.__offsets.insert(position, offset)
+        self.__elements.insert(position, element)
+        self.__longest = max(self.__longest,
+                float(element.duration.quarterLength))
+
+    def __position(self, element):
+        """
+        Find the position of an element in the index
+        """
+        offset = float(self.__part.elementOffset(element))
+        position = bisect_left(self.__offsets, offset)
+        end = bisect_right(self.__offsets, offset, position)
+        for i in range(position, end):
+            if self.__elements[i] is element:
+                return i
+        raise ValueError("{} is not indexed".format(element))
+
+    def __unsorted(self, method, *args):
+        """
+        Invoke method of the part without letting it sort the part first.
+        Stream.remove and Stream.replace look elements up by position, which
+        sorts the whole part if it isn't already; they find the element just
+        as well in an unsorted part
+        """
+        autoSort = self.__part.autoSort
+        self.__part.autoSort = False
+        try:
+            return method(*args)
+        finally:
+            self.__part.autoSort = autoSort
+
+    def insert(self, offset, element):
+        """
+        Insert element into the part at offset
+        """
+        # Stream.insert works out whether the part is still sorted by
+        # walking the whole part, which is exactly what we are avoiding.
+        # music21 sorts the part again if and when somebody iterates over it
+        self.__part.coreInsert(offset, element, ignoreSort = True)
+        self.__part.coreElementsChanged(updateIsFlat = False)
+        self.__add(float(offset), element)
+
+    def remove(self, element):
+        """
+        Remove element from the part
+        """
+        position = self.__position(element)
+        self.__unsorted(self.__part.remove, element)
+        del self.__offsets[position]
+        del self.__elements[position]
+
+    def replace(self, old, new):
+        """
+        Put new into the part at the offset of old, in place of old
+        """
+        position = self.__position(old)
+        self.__unsorted(self.__part.replace, old, new)
+        self.__elements[position] = new
+        self.__longest = max(self.__longest,
+                float(new.duration.quarterLength))
+
+    def at(self, offset, kind = music21.base.Music21Object):
+        """
+        Retrieve the elements of type kind at exactly offset
+        """
+        start = bisect_left(self.__offsets, offset)
+        end = bisect_right(self.__offsets, offset, start)
+        return [ element for element in self.__elements[start:end]
+                 if isinstance(element, kind) ]
+
+    def between(self, start, end, kind = music21.base.Music21Object):
+        """
+        Retrieve the elements of type kind that begin between start and end,
+        inclusive, in order
+        """
+        first = bisect_left(self.__offsets, start)
+        last = bisect_right(self.__offsets, end, first)
+        return [ element for element in self.__elements[first:last]
+                 if isinstance(element, kind) ]
+
+    def starting(self, start, end):
+        """
+        Yield the (offset, element) pairs of the elements that begin at or
+        after start and before end, in order, without copying the index
+        """
+        first = bisect_left(self.__offsets, start)
+        last = bisect_left(self.__offsets, end, first)
+        for i in range(first, last):
+            yield (self.__offsets[i], self.__elements[i])
+
+    def overlapping(self, start, end, kind = music21.base.Music21Object):
+        """
+        Retrieve the elements of type kind that sound strictly between start
+        and end, in order
+        """
+        first = bisect_left(self.__offsets, start - self.__longest)
+        last = bisect_left(self.__offsets, end, first)
+        return [ element for (offset, element)
+                 in zip(self.__offsets[first:last],
+                        self.__elements[first:last])
+                 if isinstance(element, kind) and
+                    start < offset + float(element.duration.quarterLength) ]
@@ -0,0 +1,243 @@
+import music21
+import struct
+import base64
+import json
+import zlib
+import os
+import sys
+
+from network.base.exceptions import GenericError
+from util import musicFuns, misc
+from util.offsetIndex import OffsetIndex
+
+# A part is encoded as the list of the elements Composte actually puts into
+# parts, one record per element, in canonical order (see canonical):
+#   [ "n", offset, pitch, quarterLength, tie, tiePartners, lyrics ]
+#   [ "k", offset, sharps ]
+#   [ "t", offset, ratio ]
+#   [ "c", offset, clef class ]
+#   [ "i", offset, instrument class, instrument name ]
+#   [ "d", offset, value ]
+#   [ "m", offset, bpm, referent quarterLength, text ]
+# The records are written out as compact JSON and deflated, behind a magic
+# number and a format version. Anything not starting with the magic number is
+# taken to be a part frozen by music21, which is what parts used to be.
+PART_MAGIC = b"CSP"
+HEAP_MAGIC = b"CSH"
+VERSION = 1
+
+# Where records of each kind go among the records at the same offset, which
+# is where music21 sorts the elements they describe
+KIND_ORDER = { "i": 0, "c": 1, "m": 2, "k": 3, "t": 4, "d": 5, "n": 6 }
+
+# Heap header: magic, version, revision, number of parts. Each part follows
+# as its length and then its encoding
+HEAP_HEADER = struct.Struct(">3sBQI")
+PART_HEADER = struct.Struct(">I")
+
+def toRecord(element, offset):
+    """
+    Produce the record describing an element at offset in a part
+    """
+    offset = float(offset)
+
+    if isinstance(element, music21.note.Note):
+        tie = element.tie.type if element.tie is not None else None
+        partners = list(getattr(element, "tiePartners", [None, None]))
+        lyrics = [ lyric.text for lyric in element.lyrics ]
+        return ["n", offset, element.pitch.nameWithOctave,
+                float(element.quarterLength), tie, partners, lyrics]
+    if isinstance(element, music21.key.KeySignature):
+        return ["k", offset, element.sharps]
+    if isinstance(element, music21.meter.TimeSignature):
+        return ["t", offset, element.ratioString]
+    if isinstance(element, music21.clef.Clef):
+        return ["c", offset, type(element).__name__]
+    if isinstance(element, music21.instrument.Instrument):
+        return ["i", offset, type(element).__name__, element.instrumentName]
+    if isinstance(element, music21.dynamics.Dynamic):
+        return ["d", offset, element.value]
+    if isinstance(element, music21.tempo.MetronomeMark):
+        return ["m", offset, element.number,
+                float(element.referent.quarterLength), element.text]
+
+    raise GenericError("Cannot encode {}".format(element))
+
+def fromRecord(record):
+    """
+    Rebuild the element described by a record. Returns a tuple of
+    (offset, element)
+    """
+    (kind, offset) = record[:2]
+
+    if kind == "n":
+        (pitch, quarterLength, tie, partners, lyrics) = record[2:]
+        element = musicFuns.createNote(pitch, quarterLength)
+        if tie is not None:
+            element.tie = music21.tie.Tie(tie)
+        element.tiePartners = list(partners)
+        for lyric in lyrics:
+            element.addLyric(lyric)
+    elif kind == "k":
+        element = music21.key.KeySignature(record[2])
+    elif kind == "t":
+        element = music21.meter.TimeSignature(record[2])
+    elif kind == "c":
+        element = getattr(music21.clef, record[2])()
+    elif kind == "i":
+        element = getattr(music21.instrument, record[2])()
+        if element.instrumentName != record[3]:
+            element.instrumentName = record[3]
+    elif kind == "d":
+        element = music21.dynamics.Dynamic(record[2])
+    elif kind == "m":
+        (number, referent, text) = record[2:]
+        element = music21.tempo.MetronomeMark(text, number, referent)
+    else:
+        raise GenericError("Unknown record {}".format(record))
+
+    return (offset, element)
+
+def canonical(records):
+    """
+    Sort records by offset, then by kind, then by contents. Parts holding the
+    same elements encode the same however they came to hold them, such as
+    live or replayed from a journal
+    """
+    return sorted(records, key = lambda record:
+            (record[1], KIND_ORDER[record[0]], json.dumps(record)))
+
+def encodePart(part):
+    """
+    Encode a part in the native score format
+    """
+    records = canonical(toRecord(element, part.elementOffset(element))
+                        for element in part.elements)
+    body = json.dumps(records, separators = (",", ":")).encode()
+    return PART_MAGIC + bytes([VERSION]) + zlib.compress(body)
+
+def decodePart(blob):
+    """
+    Decode a part from either the native score format or a music21 freezeStr
+    """
+    if not isNative(blob):
+        return music21.converter.thawStr(blob)
+
+    version = blob[len(PART_MAGIC)]
+    if version > VERSION:
+        raise GenericError("Unsupported score format version {}"
+                .format(version))
+
+    records = json.loads(zlib.decompress(blob[len(PART_MAGIC) + 1:]))
+    part = music21.stream.Stream()
+    # Stream.insert works out whether the stream is still sorted after every
+    # insertion, which is quadratic in the length of the part. Insert
+    # everything, then let music21 catch up once
+    for record in records:
+        (offset, element) = fromRecord(record)
+        part.coreInsert(offset, element, ignoreSort = True)
+    part.coreElementsChanged()
+    return part
+
+def encodeRange(part, start, end):
+    """
+    Produce the records of the elements of a part that begin between start
+    and end, inclusive, in canonical order
+    """
+    elements = OffsetIndex.of(part).between(start, end)
+    return canonical(toRecord(element, part.elementOffset(element))
+                     for element in elements)
+
+def replaceRange(part, start, end, records):
+    """
+    Replace the elements of a part that begin between start and end,
+    inclusive, with the elements described by records
+    """
+    index = OffsetIndex.of(part)
+    for element in index.between(start, end):
+        index.remove(element)
+    for record in records:
+        index.insert(*fromRecord(record))
+
+def isNative(blob):
+    """
+    Whether a part was encoded in the native score format
+    """
+    return blob[:len(PART_MAGIC)] == PART_MAGIC
+
+def writeHeap(revision, parts):
+    """
+    Pack the parts of a project, snapshotted at revision, into the contents of
+    a heap file
+    """
+    blobs = [ encodePart(part) for part in parts ]
+    chunks = [ HEAP_HEADER.pack(HEAP_MAGIC, VERSION, revision, len(blobs)) ]
+    for blob in blobs:
+        chunks.append(PART_HEADER.pack(len(blob)))
+        chunks.append(blob)
+    return b"".join(chunks)
+
+def readHeap(heap):
+    """
+    Unpack the contents of a heap file into a tuple of (revision, parts).
+    Heaps written before the native format are JSON lists of base64-encoded
+    frozen parts, preceded by their revision once journaling was introduced.
+    """
+    if not heap.startswith(HEAP_MAGIC):
+        heap = heap.decode()
+        # Heaps written before journaling are bare parts
+        if heap.startswith("["):
+            (revision, parts) = (0, heap)
+        else:
+            (revision, parts) = heap.split("\n", 1)
+            revision = int(revision)
+        blobs = [ base64.b64decode(blob.encode())
+                  for blob in json.loads(parts) ]
+        return (revision, [ decodePart(blob) for blob in blobs ])
+
+    (_, version, revision, nparts) = HEAP_HEADER.unpack_from(heap)
+    if version > VERSION:
+        raise GenericError("Unsupported heap format version {}"
+                .format(version))
+
+    position = HEAP_HEADER.size
+    parts = []
+    for i in range(nparts):
+        (length,) = PART_HEADER.unpack_from(heap, position)
+        position += PART_HEADER.size
+        parts.append(decodePart(heap[position:position + length]))
+        position += length
+
+    return (revision, parts)
+
+def convert(root):
+    """
+    Rewrite every heap file under root in the native score format. Returns
+    the number of heaps converted, their total size before and their total
+    size after
+    """
+    (converted, before, after) = (0, 0, 0)
+    for (directory, _, files) in os.walk(root):
+        for name in files:
+            if not name.endswith(".heap"):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                heap = f.read()
+            if heap.startswith(HEAP_MAGIC):
+                continue
+
+            native = writeHeap(*readHeap(heap))
+            misc.write_atomically(path, native)
+
+            converted += 1
+            before += len(heap)
+            after += len(native)
+
+    return (converted, before, after)
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else "data/"
+    (converted, before, after) = convert(root)
+    print("Converted {} heaps under {}: {} bytes -> {} bytes"
+            .format(converted, root, before, after))
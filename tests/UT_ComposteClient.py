@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# Checks that clients editing the same project at the same time end up with
+# exactly what the server has. Two clients insert and remove notes at random,
+# some speculatively and some waiting for the server, so their edits cross on
+# the wire and speculative ones are rebased on top of the other client's,
+# or taken back out when the server rejects them. This runs once with the
+# server broadcasting the updates themselves and once with it broadcasting
+# patches of the ranges they changed.
+
+import os
+import random
+import tempfile
+import threading
+import time
+
+# Only loads once the GUI has set things up
+import client.editor
+
+from network.base.loggable import DevNull
+from network.fake.security import Encryption
+from util import scoreFormat
+from ComposteClient import ComposteClient
+from ComposteServer import ComposteServer
+
+EDITS = 100
+PITCHES = ["C4", "E4", "G4"]
+
+def edit(client_, pid, seed):
+    """
+    Insert and remove notes at random. Removals of notes that aren't there
+    are rejected by the server
+    """
+    rng = random.Random(seed)
+    speculative = client_.speculative()
+    for i in range(EDITS):
+        view = speculative if rng.random() < 0.7 else client_
+        offset = rng.randrange(0, 32) / 2
+        if rng.random() < 0.7:
+            view.insertNote(pid, offset, 0, rng.choice(PITCHES),
+                    rng.choice([0.5, 1.0, 2.0]))
+        else:
+            view.removeNote(pid, offset, 0, rng.choice(PITCHES))
+        time.sleep(rng.random() * 0.005)
+
+def encoded(project):
+    return [ scoreFormat.encodePart(part) for part in project.parts ]
+
+def converge(server, clients, pid, timeout = 10):
+    """
+    Wait for every client to catch up with the server, then check that they
+    all have what it has
+    """
+    expected = server.get_project(pid)[1]
+    deadline = time.monotonic() + timeout
+    while any(c.project().revision != expected.revision or
+              c._ComposteClient__pending for c in clients):
+        assert time.monotonic() < deadline, \
+                [ c.project().revision for c in clients ]
+        time.sleep(0.05)
+        expected = server.get_project(pid)[1]
+
+    for c in clients:
+        assert encoded(c.project()) == encoded(expected)
+
+def concurrent(patches, port):
+    server = ComposteServer("tcp://127.0.0.1:{}".format(port),
+            "tcp://127.0.0.1:{}".format(port + 1), DevNull, Encryption(),
+            workers = 4, patches = patches)
+    clients = []
+    try:
+        server.get_db_connections()
+        for i in range(2):
+            clients.append(ComposteClient("tcp://127.0.0.1:{}".format(port),
+                    "tcp://127.0.0.1:{}".format(port + 1), DevNull,
+                    Encryption()))
+        clients[0].register("user", "password", "email")
+        for c in clients:
+            c.login("user", "password")
+        (_, (pid,)) = clients[0].create_project("user", "converge", "{}")
+        for c in clients:
+            c.get_project(pid)
+
+        threads = [ threading.Thread(target = edit, args = (c, pid, seed))
+                    for (seed, c) in enumerate(clients) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        converge(server, clients, pid)
+        print("patches {}: ok".format("on" if patches else "off"))
+    finally:
+        for c in clients:
+            c.stop()
+        server.stop()
+
+if __name__ == '__main__':
+    # The database lives under data/ wherever the server is started
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("data")
+    concurrent(False, 5310)
+    concurrent(True, 5320)
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# Checks on how long ComposteServer keeps projects in memory. A project is
+# pooled for as long as somebody is subscribed to it or working on it, and
+# should leave the pool as soon as neither is the case, no matter how many
+# updates it saw in the meantime. Leaving the pool is when it gets written
+# out, unless the periodic flush got there first.
+
+import json
+import os
+import tempfile
+import time
+
+from network.base.loggable import DevNull
+from network.fake.security import Encryption
+from util.bookkeeping import ProjectPool
+from util import scoreFormat
+from ComposteServer import ComposteServer
+
+def pooled():
+    """
+    Map the IDs of pooled projects to their reference counts
+    """
+    return { pid: count for (pid, (project, count))
+             in ProjectPool._ProjectPool__objects.items() }
+
+def insertNote(server, pid, token, offset):
+    args = json.dumps([offset, 0, "C4", 1.0])
+    (status, other) = server.do_update(pid, "insertNote", args, 0, offset,
+            token = token)
+    assert status == "ok", other
+
+def expire(server, token):
+    """
+    Subscribe, update and go quiet until the session expires
+    """
+    (_, pid) = server.create_project("user", "expire", "{}")
+    server.subscribe("user", pid, token = token)
+    assert pooled() == { pid: 1 }, pooled()
+
+    for i in range(5):
+        insertNote(server, pid, token, float(i))
+    assert pooled() == { pid: 1 }, pooled()
+
+    time.sleep(1.5)
+    server.expire_sessions()
+    assert pooled() == {}, pooled()
+    assert len(ProjectPool._ProjectPool__locks) == 0
+    print("expire: ok")
+
+def evict(server, token):
+    """
+    Subscribe, update and unsubscribe. The project is only written out when
+    it leaves the pool, and then it should be all there on disk
+    """
+    (_, pid) = server.create_project("user", "evict", "{}")
+    (_, cookie) = server.subscribe("user", pid, token = token)
+    path = server.project_path("user", pid) + ".heap"
+    with open(path, "rb") as f:
+        created = f.read()
+
+    for i in range(5):
+        insertNote(server, pid, token, float(i))
+    flushed = server.flush_stats()["flushed"]
+    with open(path, "rb") as f:
+        assert f.read() == created
+
+    server.unsubscribe(cookie)
+    assert pooled() == {}, pooled()
+    assert server.flush_stats()["flushed"] == flushed + 1
+    with open(path, "rb") as f:
+        (revision, parts) = scoreFormat.readHeap(f.read())
+    assert revision == 5, revision
+    assert [ note.offset for note in parts[0].notes ] == \
+            [ 0.0, 1.0, 2.0, 3.0, 4.0 ]
+    print("evict: ok")
+
+if __name__ == '__main__':
+    # The database lives under data/ wherever the server is started
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("data")
+    server = ComposteServer("tcp://127.0.0.1:5300", "tcp://127.0.0.1:5301",
+            DevNull, Encryption(), session_timeout = 1)
+    try:
+        server.get_db_connections()
+        server.register("user", "password", "email")
+        (_, _, token) = server.login("user", "password")
+        expire(server, token)
+        evict(server, token)
+    finally:
+        server.stop()
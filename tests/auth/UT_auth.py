@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# Benchmark for hashing passwords off of the server workers. A pool of
+# threads stands in for the server's workers. It is handed an update every
+# 2ms, where an update is a millisecond of pure Python work, along with a
+# storm of logins: either all at once, or one every 8ms. We measure how many
+# logins go through, and how long updates take from the moment they are
+# handed to the workers. Logins that are turned away back off and try again,
+# a few times, like ComposteClient.
+#
+# When verification runs inline, logins can hold every worker at once, and
+# fight updates for the CPU, so updates queue up behind them. When it runs in
+# auth's process pool, logins queue up for the pool, holding at most as many
+# workers as the queue is long; only logins past that are turned away with
+# Busy, and try again a little later. With more workers than that, as the
+# server has by default, updates should take about as long as they do with
+# no logins going on at all.
+
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import pbkdf2_sha256
+
+from auth import auth
+
+WORKERS = 16
+LOGINS = 64
+UPDATES = 512
+UPDATE_EVERY = 0.002
+
+def update():
+    end = time.perf_counter() + 0.001
+    while time.perf_counter() < end:
+        pass
+
+def attempt(verify, *args):
+    """
+    Log in once. Returns whether the login was turned away
+    """
+    try:
+        verify(*args)
+        return False
+    except auth.Busy:
+        return True
+
+def login(workers, verify, record, attempts = 6, backoff = 0.1):
+    """
+    Log in through the workers, backing off and trying again while turned
+    away, as ComposteClient does. Returns whether the login went through
+    """
+    for i in range(attempts):
+        if i > 0:
+            time.sleep(backoff * 2 ** (i - 1) * random.uniform(0.5, 1.5))
+        if not workers.submit(attempt, verify, "password", record).result():
+            return True
+    return False
+
+def run(verify, record, logins, login_every):
+    """
+    Return the number of logins accepted, given up on, the logins accepted
+    per second, and the median and 99th percentile update latency in ms.
+    A login is handed to the workers every login_every updates, or all of
+    them up front if login_every is 0
+    """
+    def submitted(fun, *args):
+        queued = time.perf_counter()
+        return lambda: (fun(*args), time.perf_counter() - queued)[1]
+
+    # Clients wait on their own time, not the workers'
+    with ThreadPoolExecutor(WORKERS) as workers, \
+            ThreadPoolExecutor(max(logins, 1)) as clients:
+        start = time.perf_counter()
+        login_futures = []
+        if login_every == 0:
+            login_futures = [ clients.submit(login, workers, verify, record)
+                              for i in range(logins) ]
+        update_futures = []
+        for i in range(UPDATES):
+            if login_every != 0 and i % login_every == 0 and \
+                    len(login_futures) < logins:
+                login_futures.append(
+                        clients.submit(login, workers, verify, record))
+            update_futures.append(workers.submit(submitted(update)))
+            time.sleep(UPDATE_EVERY)
+        results = [ future.result() for future in login_futures ]
+        latencies = sorted(future.result() for future in update_futures)
+        elapsed = time.perf_counter() - start
+
+    accepted = sum(1 for ok in results if ok)
+    return (accepted, len(results) - accepted, accepted / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[len(latencies) * 99 // 100] * 1000)
+
+if __name__ == '__main__':
+    record = pbkdf2_sha256.hash("password")
+    # Start the processes before timing anything
+    auth.verify("password", record)
+
+    print("storm   mode    logins  gave up  logins/s  "
+          "update p50 (ms)  update p99 (ms)")
+    for (storm, login_every) in [ ("burst", 0), ("steady", 4) ]:
+        for (mode, verify, logins) in \
+                [ ("idle", pbkdf2_sha256.verify, 0),
+                  ("inline", pbkdf2_sha256.verify, LOGINS),
+                  ("pool", auth.verify, LOGINS) ]:
+            (accepted, busy, rate, p50, p99) = \
+                    run(verify, record, logins, login_every)
+            print("{:6s}  {:6s}  {:6d}  {:7d}  {:8.1f}  {:15.2f}  {:15.2f}"
+                    .format(storm, mode, accepted, busy, rate, p50, p99))
+
+    auth.shutdown()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Checks for login tokens. A token should be good until it expires and not a
+# second after, should be no good at all once any part of it is changed, and
+# renewing it should push its expiry back, but never past the end of the
+# session it descends from. Time is faked rather than waited out.
+
+from auth.tokens import Tokens
+
+HOUR = 60 * 60
+
+class Clock:
+    """
+    A clock that only moves when told to
+    """
+    def __init__(self, now = 1000000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def tokens(clock):
+    return Tokens("secret", lifetime = HOUR, session_lifetime = 3 * HOUR,
+            clock = clock)
+
+def expiry():
+    clock = Clock()
+    issuer = tokens(clock)
+    token = issuer.issue("user")
+    assert issuer.verify(token) == "user"
+
+    clock.now += HOUR
+    assert issuer.verify(token) == "user"
+    clock.now += 1
+    assert issuer.verify(token) is None
+    assert issuer.renew(token) is None
+    print("expiry: ok")
+
+def tampering():
+    clock = Clock()
+    issuer = tokens(clock)
+    token = issuer.issue("user")
+    (username, since, expiry, signature) = token.rsplit(":", 3)
+
+    forged = [
+        ":".join(["admin", since, expiry, signature]),
+        ":".join([username, str(int(since) - HOUR), expiry, signature]),
+        ":".join([username, since, str(int(expiry) + HOUR), signature]),
+        ":".join([username, since, expiry, signature[:-1] + "0"
+                  if signature[-1] != "0" else signature[:-1] + "1"]),
+        ":".join([username, since, expiry]),
+        "garbage",
+        None,
+    ]
+    for token in forged:
+        assert issuer.verify(token) is None, token
+        assert issuer.renew(token) is None, token
+
+    # Nor are tokens good anywhere but where they were issued
+    other = Tokens("other secret", clock = clock)
+    assert other.verify(issuer.issue("user")) is None
+    print("tampering: ok")
+
+def renewal():
+    clock = Clock()
+    issuer = tokens(clock)
+    login = clock.now
+    token = issuer.issue("user")
+
+    clock.now += HOUR / 2
+    token = issuer.renew(token)
+    assert issuer.verify(token) == "user"
+    # Renewed for a whole lifetime from now, not from login
+    clock.now = login + HOUR + HOUR / 4
+    assert issuer.verify(token) == "user"
+
+    # Keep renewing; nothing lives past the end of the session
+    token = issuer.renew(token)
+    clock.now = login + 2 * HOUR + HOUR / 8
+    token = issuer.renew(token)
+    assert int(token.rsplit(":", 3)[2]) == login + 3 * HOUR
+    assert token.rsplit(":", 3)[1] == str(login)
+    clock.now = login + 3 * HOUR
+    assert issuer.verify(token) == "user"
+    clock.now += 1
+    assert issuer.verify(token) is None
+    assert issuer.renew(token) is None
+    print("renewal: ok")
+
+if __name__ == '__main__':
+    expiry()
+    tampering()
+    renewal()
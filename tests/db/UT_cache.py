@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+# Checks for the database caches. LRUCache should evict whatever was used
+# least recently, never cache what it loaded from before a write, and count
+# what it does. The wrappers in front of the drivers should serve repeated
+# lookups from the cache, and never serve a lookup from before a write.
+
+import os
+import sqlite3
+import tempfile
+
+from db import cache, driver
+
+def loader(loads, value):
+    """
+    Load value, keeping track of how many times it was loaded
+    """
+    def load():
+        loads.append(value)
+        return value
+    return load
+
+def eviction():
+    lru = cache.LRUCache(capacity = 2)
+    loads = []
+    lru.get("a", loader(loads, 1))
+    lru.get("b", loader(loads, 2))
+    # a is now the most recently used, so c pushes b out
+    assert lru.get("a", loader(loads, 1)) == 1
+    lru.get("c", loader(loads, 3))
+    assert loads == [1, 2, 3]
+
+    assert lru.get("a", loader(loads, 1)) == 1
+    assert lru.get("c", loader(loads, 3)) == 3
+    assert loads == [1, 2, 3]
+    assert lru.get("b", loader(loads, 2)) == 2
+    assert loads == [1, 2, 3, 2]
+    print("eviction: ok")
+
+def invalidation():
+    lru = cache.LRUCache()
+    loads = []
+    lru.get("a", loader(loads, 1))
+    lru.invalidate("a")
+    assert lru.get("a", loader(loads, 2)) == 2
+    assert loads == [1, 2]
+
+    # A write landing while a load is underway might not be in what it
+    # loaded, so what it loaded is handed out but not kept
+    def racing():
+        lru.invalidate("b")
+        return 3
+    assert lru.get("b", racing) == 3
+    assert lru.get("b", loader(loads, 4)) == 4
+    assert lru.get("b", loader(loads, 5)) == 4
+    assert loads == [1, 2, 4]
+    print("invalidation: ok")
+
+def stats():
+    lru = cache.LRUCache(capacity = 2)
+    assert lru.stats() == { "hits": 0, "misses": 0, "evictions": 0,
+                            "size": 0 }
+    for key in ["a", "b", "a", "c", "a", "b"]:
+        lru.get(key, lambda: key)
+    # b was pushed out by c, and pushes c out in turn
+    assert lru.stats() == { "hits": 2, "misses": 4, "evictions": 2,
+                            "size": 2 }
+    lru.invalidate("a", "missing")
+    assert lru.stats()["size"] == 1
+    print("stats: ok")
+
+def wrappers():
+    path = os.path.join(tempfile.mkdtemp(), "test.db")
+    (users, projects, contributors) = (cache.Auth(driver.Auth(path)),
+            cache.Projects(driver.Projects(path)),
+            cache.Contributors(driver.Contributors(path)))
+
+    # Looking up what isn't there yet mustn't hide it once it is
+    assert users.get("user").uname is None
+    users.put("user", "hash", "email")
+    assert users.get("user").hash == "hash"
+    assert users.get("user").hash == "hash"
+    assert users.stats()["hits"] == 1
+
+    assert projects.get("1").id is None
+    projects.put("1", "a", "user")
+    assert projects.get("1").owner == "user"
+    projects.get("1")
+    assert projects.stats()["hits"] == 1
+
+    assert contributors.get(username = "user") == []
+    assert contributors.get(project_id = "1") == []
+    contributors.put("user", "1")
+    assert [ p.id for p in contributors.get(username = "user") ] == ["1"]
+    assert [ u.uname for u in contributors.get_users("1") ] == ["user"]
+    assert [ p.id for p in contributors.get_projects("user") ] == ["1"]
+    assert contributors.stats()["hits"] == 1
+
+    # A write that fails still forgets what it may have changed
+    try:
+        users.put("user", "other", "email")
+        assert False, "duplicate"
+    except sqlite3.IntegrityError:
+        pass
+    assert users.get("user").hash == "hash"
+    assert users.stats()["misses"] == 3
+    print("wrappers: ok")
+
+if __name__ == '__main__':
+    eviction()
+    invalidation()
+    stats()
+    wrappers()
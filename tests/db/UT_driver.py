@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+# Checks for Database transactions. Nothing a transaction writes should be
+# seen by other connections until the outermost transaction commits, and
+# none of it should survive anything in it raising, even when a nested
+# transaction raises and the exception is caught before it gets out. Each
+# thread gets its own connection to each file.
+
+import os
+import sqlite3
+import tempfile
+from threading import Thread
+
+from db.driver import Database
+
+def database():
+    db = Database.of(os.path.join(tempfile.mkdtemp(), "test.db"))
+    with db.transaction():
+        db.execute("CREATE TABLE t (x INTEGER PRIMARY KEY NOT NULL)")
+    return db
+
+def rows(db):
+    return [ x for (x,) in db.execute("SELECT x FROM t ORDER BY x") ]
+
+def elsewhere(fun):
+    """
+    Run fun on another thread, and thus another connection
+    """
+    result = []
+    thread = Thread(target = lambda: result.append(fun()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+def nested():
+    db = database()
+    with db.transaction():
+        db.execute("INSERT INTO t VALUES (1)")
+        with db.transaction():
+            db.execute("INSERT INTO t VALUES (2)")
+        # The inner transaction finishing commits nothing
+        assert elsewhere(lambda: rows(db)) == []
+        assert rows(db) == [1, 2]
+    assert elsewhere(lambda: rows(db)) == [1, 2]
+    print("nested: ok")
+
+def rollback():
+    db = database()
+    try:
+        with db.transaction():
+            db.execute("INSERT INTO t VALUES (1)")
+            raise KeyError("oops")
+    except KeyError:
+        pass
+    assert rows(db) == []
+
+    # Nothing is left open
+    with db.transaction():
+        db.execute("INSERT INTO t VALUES (2)")
+    assert elsewhere(lambda: rows(db)) == [2]
+    print("rollback: ok")
+
+def inner_failure():
+    """
+    A nested write failing takes the outer transaction down with it, even
+    though the outer body carries on
+    """
+    db = database()
+    with db.transaction():
+        db.execute("INSERT INTO t VALUES (1)")
+
+    try:
+        with db.transaction():
+            db.execute("INSERT INTO t VALUES (2)")
+            try:
+                with db.transaction():
+                    db.execute("INSERT INTO t VALUES (3)")
+                    db.execute("INSERT INTO t VALUES (1)")
+            except sqlite3.IntegrityError:
+                pass
+            db.execute("INSERT INTO t VALUES (4)")
+        assert False, "committed"
+    except sqlite3.OperationalError:
+        pass
+    assert rows(db) == [1]
+
+    with db.transaction():
+        db.execute("INSERT INTO t VALUES (5)")
+    assert elsewhere(lambda: rows(db)) == [1, 5]
+    print("inner failure: ok")
+
+def connections():
+    root = tempfile.mkdtemp()
+    (a, b) = (os.path.join(root, "a.db"), os.path.join(root, "b.db"))
+    assert Database.of(a) is Database.of(a)
+    assert Database.of(a) is not Database.of(b)
+
+    db = Database.of(a)
+    conn = db.connection()
+    assert db.connection() is conn
+    assert Database.of(b).connection() is not conn
+    other = elsewhere(db.connection)
+    assert other is not conn
+    assert elsewhere(db.connection) is not other
+
+    db.close()
+    assert db.connection() is not conn
+    print("connections: ok")
+
+if __name__ == '__main__':
+    nested()
+    rollback()
+    inner_failure()
+    connections()
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+# Checks that the network server hands requests to whichever worker is idle.
+# With two workers, one request that takes a long time should leave the other
+# worker to get through a stream of quick requests. If requests were dealt
+# out to workers in turn instead, every other quick request would wait behind
+# the slow one.
+
+import time
+
+from network.base.loggable import DevNull
+from network.client import Client
+from network.server import Server
+
+SLOW = 1.0
+QUICK = 20
+
+def handler(server, message):
+    if message == "slow":
+        time.sleep(SLOW)
+    return message
+
+def slow_request(client_):
+    slow = client_.send_async("slow")
+    # Let it reach a worker first
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    for i in range(QUICK):
+        assert client_.send(str(i)) == str(i)
+    elapsed = time.monotonic() - start
+    assert not slow.done()
+    assert elapsed < SLOW / 2, elapsed
+
+    assert slow.result() == "slow"
+    print("slow request: ok ({:.3f}s for {} quick requests)"
+          .format(elapsed, QUICK))
+
+def pipelined(client_):
+    """
+    Replies find their way back to whoever asked, however many requests
+    are in flight
+    """
+    replies = [ client_.send_async(str(i)) for i in range(200) ]
+    assert [ reply.result() for reply in replies ] == \
+            [ str(i) for i in range(200) ]
+    print("pipelined: ok")
+
+if __name__ == '__main__':
+    server = Server("tcp://127.0.0.1:5330", "tcp://127.0.0.1:5331", DevNull,
+            workers = 2)
+    server.start_background(handler)
+    client_ = Client("tcp://127.0.0.1:5330", "tcp://127.0.0.1:5331", DevNull)
+    try:
+        slow_request(client_)
+        pipelined(client_)
+    finally:
+        client_.stop()
+        server.stop()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Stress test for the per-project locks in ProjectPool. Every thread hammers
+# its own project, holding that project's lock while it "works". The work is
+# a sleep standing in for the parts of an update or a flush that release the
+# GIL (disk writes, mostly), so the numbers reflect lock contention rather
+# than the interpreter.
+#
+# With per-project locks, throughput should grow linearly with the number of
+# independent projects. With a single global lock (the old behavior), it
+# should stay flat.
+
+import sys
+import time
+from threading import Thread, Lock
+
+from util.bookkeeping import ProjectPool
+
+UPDATES = 50
+WORK = 0.002
+
+def hammer(lock_for, pid):
+    for i in range(UPDATES):
+        with lock_for(pid):
+            time.sleep(WORK)
+
+def pool_and_release(pool, pid):
+    flushed = []
+    for i in range(UPDATES):
+        with pool.lock(pid):
+            project = pool.put(pid, lambda: [])
+            project.append(i)
+            pool.touch(pid)
+            pool.remove(pid, flushed.append)
+
+def run(projects, lock_for):
+    """
+    Return the number of updates per second across all projects
+    """
+    threads = [ Thread(target = hammer,
+                       args = (lock_for, "project-{}".format(i)))
+                for i in range(projects) ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return projects * UPDATES / (time.time() - start)
+
+if __name__ == '__main__':
+    pool = ProjectPool()
+    global_lock = Lock()
+
+    print("projects  global (upd/s)  per-project (upd/s)  speedup")
+    for projects in [1, 2, 4, 8, 16]:
+        serial = run(projects, lambda pid: global_lock)
+        concurrent = run(projects, pool.lock)
+        print("{:8d}  {:13.0f}  {:19.0f}  {:7.2f}x"
+                .format(projects, serial, concurrent, concurrent / serial))
+
+    # Pool projects, update them and release them again, the way the server
+    # does, from many threads at once. Once nothing is pooled, nothing should
+    # be left of the locks either
+    threads = [ Thread(target = pool_and_release,
+                       args = (pool, "project-{}".format(i % 4)))
+                for i in range(16) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ProjectPool._ProjectPool__objects) == 0
+    assert len(ProjectPool._ProjectPool__locks) == 0, \
+            ProjectPool._ProjectPool__locks
+    print("locks left over: 0")
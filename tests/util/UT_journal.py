@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+# Checks for Journal and History. Journals should survive a crash mid-append
+# and compact without losing anything past a snapshot. Histories should only
+# ever hand out every update past a revision, never some of them, including
+# when a batch of updates shares one revision or revisions go missing.
+
+import os
+import tempfile
+
+from util.journal import Journal, History
+
+def record(revision, offset = 0.0):
+    return (revision, "insertNote", [offset, "C4", 1.0], 0, offset)
+
+def journal():
+    path = os.path.join(tempfile.mkdtemp(), "project.log")
+    return (path, Journal(path))
+
+def truncate():
+    (path, log) = journal()
+    log.extend([ record(revision) for revision in range(1, 6) ])
+    assert [ r[0] for r in log.records() ] == [1, 2, 3, 4, 5]
+    assert [ r[0] for r in log.records(3) ] == [4, 5]
+
+    log.truncate(3)
+    assert [ r[0] for r in log.records() ] == [4, 5]
+    assert not os.path.exists(path + ".tmp")
+    # Appending after compaction picks up where it left off
+    log.append(*record(6))
+    assert [ r[0] for r in log.records() ] == [4, 5, 6]
+
+    log.truncate(6)
+    assert not os.path.exists(path)
+    assert list(log.records()) == []
+    # Nothing to drop is fine too
+    log.truncate(6)
+    print("truncate: ok")
+
+def torn():
+    """
+    A crash mid-append leaves a partial last line, which replay stops at
+    """
+    (path, log) = journal()
+    log.extend([ record(1), record(2) ])
+    with open(path, "a") as f:
+        f.write('[3,"insertNote",[2.0,"C')
+    assert list(log.records()) == [ record(1), record(2) ]
+
+    # Compaction drops the torn line along with everything already snapshotted
+    log.truncate(1)
+    assert list(log.records()) == [ record(2) ]
+    log.append(*record(3))
+    assert list(log.records()) == [ record(2), record(3) ]
+    print("torn last line: ok")
+
+def batches():
+    """
+    Records of a batch share a revision, as __apply_batch appends them. A
+    client at that revision already has all of them, and a client before it
+    needs all of them
+    """
+    history = History(0, length = 4)
+    history.append(*record(1))
+    for offset in (0.0, 1.0, 2.0):
+        history.append(*record(2, offset))
+    assert history.since(0) == [ record(1) ] + \
+            [ record(2, offset) for offset in (0.0, 1.0, 2.0) ]
+    assert history.since(1) == \
+            [ record(2, offset) for offset in (0.0, 1.0, 2.0) ]
+    assert history.since(2) == []
+    assert history.since(3) is None
+
+    # Pushes revision 1 out
+    history.append(*record(3))
+    assert history.since(0) is None
+    assert len(history.since(1)) == 4
+    # Pushes out part of the batch, which a client before it can't get back
+    history.append(*record(4))
+    assert history.since(1) is None
+    assert history.since(2) == [ record(3), record(4) ]
+    print("batches: ok")
+
+def gap():
+    """
+    Skipping revisions loses the updates in between, so nothing from before
+    them can be handed out any more
+    """
+    history = History(5)
+    assert history.since(5) == []
+    assert history.since(4) is None
+    history.append(*record(6))
+    history.append(*record(8))
+    assert history.since(5) is None
+    assert history.since(6) is None
+    assert history.since(7) == [ record(8) ]
+    history.append(*record(9))
+    assert history.since(7) == [ record(8), record(9) ]
+    print("revision gap: ok")
+
+if __name__ == '__main__':
+    truncate()
+    torn()
+    batches()
+    gap()
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+# Checks for OffsetIndex: the order it keeps elements that share an offset
+# in, where the ranges of its lookups begin and end, and that it keeps up
+# with its part, whether the part is changed through the index or through
+# music21. Random edits are checked against walking the whole part.
+
+import random
+
+import music21
+
+from util.offsetIndex import OffsetIndex
+
+def note(pitch, duration = 1.0):
+    return music21.note.Note(pitch, quarterLength = duration)
+
+def offsets(index, part):
+    return [ part.elementOffset(element)
+             for element in index.between(float("-inf"), float("inf")) ]
+
+def equal_offsets():
+    """
+    Elements at the same offset stay in the order they were inserted in,
+    through removals and replacements, which take the place of what they
+    replace
+    """
+    part = music21.stream.Stream()
+    index = OffsetIndex.of(part)
+    (a, b, c, d) = (note("C4"), note("D4"), note("E4"), note("F4"))
+    for element in (a, b, c):
+        index.insert(1.0, element)
+    assert index.at(1.0) == [a, b, c]
+
+    index.remove(b)
+    assert index.at(1.0) == [a, c]
+    index.replace(a, d)
+    assert index.at(1.0) == [d, c]
+    # music21 keeps its own order among elements at the same offset
+    assert set(map(id, part.elements)) == { id(d), id(c) }
+    index.insert(1.0, a)
+    assert index.at(1.0) == [d, c, a]
+    print("equal offsets: ok")
+
+def boundaries():
+    """
+    between is inclusive at both ends, starting excludes its end, and
+    overlapping only counts elements that sound strictly inside the range
+    """
+    part = music21.stream.Stream()
+    index = OffsetIndex.of(part)
+    (early, middle, late, long_) = (note("C4"), note("D4", 1.5),
+            note("E4"), note("G4", 8.0))
+    index.insert(0.0, early)
+    index.insert(1.0, middle)
+    index.insert(2.0, late)
+    clef = music21.clef.BassClef()
+    index.insert(2.0, clef)
+
+    assert index.between(1.0, 2.0) == [middle, late, clef]
+    assert index.between(1.0, 2.0, music21.note.Note) == [middle, late]
+    assert index.between(1.5, 1.9) == []
+    assert [ element for (_, element) in index.starting(1.0, 2.0) ] == \
+            [middle]
+    assert [ offset for (offset, _) in index.starting(0.0, 3.0) ] == \
+            [0.0, 1.0, 2.0, 2.0]
+
+    # early ends exactly where the range begins, and late begins exactly
+    # where it ends
+    assert index.overlapping(1.0, 2.0, music21.note.Note) == [middle]
+    assert index.overlapping(0.5, 2.5, music21.note.Note) == \
+            [early, middle, late]
+    # Found even though it begins further back than anything else is long
+    index.insert(-6.0, long_)
+    assert index.overlapping(1.0, 2.0, music21.note.Note) == \
+            [long_, middle]
+    assert index.at(2.0, music21.clef.Clef) == [clef]
+    print("boundaries: ok")
+
+def follows_part():
+    """
+    The index is rebuilt when music21 changes the number of elements in the
+    part behind its back, and music21 sees what went through the index
+    """
+    part = music21.stream.Stream()
+    index = OffsetIndex.of(part)
+    index.insert(4.0, note("C4"))
+    index.insert(0.0, note("D4"))
+    # Sorted again by music21 as soon as it is iterated over
+    assert [ element.offset for element in part.notes ] == [0.0, 4.0]
+
+    part.insert(2.0, note("E4"))
+    assert OffsetIndex.of(part) is not index
+    index = OffsetIndex.of(part)
+    assert offsets(index, part) == [0.0, 2.0, 4.0]
+    assert OffsetIndex.of(part) is index
+
+    part.remove(part.notes[0])
+    index = OffsetIndex.of(part)
+    assert offsets(index, part) == [2.0, 4.0]
+    print("follows part: ok")
+
+def random_edits(seed):
+    """
+    Lookups agree with walking the whole part after random edits
+    """
+    rng = random.Random(seed)
+    part = music21.stream.Stream()
+    for i in range(500):
+        index = OffsetIndex.of(part)
+        elements = list(index.between(float("-inf"), float("inf")))
+        choice = rng.random()
+        if choice < 0.5 or len(elements) == 0:
+            index.insert(rng.randrange(32) / 2,
+                         note("C4", rng.choice([0.5, 1.0, 3.0])))
+        elif choice < 0.7:
+            index.remove(rng.choice(elements))
+        elif choice < 0.8:
+            index.replace(rng.choice(elements), note("D4", 2.0))
+        else:
+            # Behind the index's back
+            part.insert(rng.randrange(32) / 2, note("E4"))
+
+    index = OffsetIndex.of(part)
+    elements = [ (float(part.elementOffset(element)), element)
+                 for element in part.elements ]
+    for i in range(200):
+        start = rng.randrange(-4, 40) / 2
+        end = start + rng.randrange(0, 12) / 2
+        assert set(map(id, index.between(start, end))) == \
+                { id(e) for (o, e) in elements if start <= o <= end }
+        assert set(id(e) for (_, e) in index.starting(start, end)) == \
+                { id(e) for (o, e) in elements if start <= o < end }
+        assert set(map(id, index.overlapping(start, end))) == \
+                { id(e) for (o, e) in elements if o < end and
+                  start < o + float(e.duration.quarterLength) }
+    print("random edits: ok")
+
+if __name__ == '__main__':
+    equal_offsets()
+    boundaries()
+    follows_part()
+    for seed in range(4):
+        random_edits(seed)
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+# Checks for the native score format. Parts, ranges of parts and heaps
+# should come back out exactly as they went in, heaps of frozen music21
+# parts should convert to the native format without losing anything, and
+# parts with the same elements should encode the same, whatever order the
+# elements went in.
+
+import base64
+import json
+import os
+import tempfile
+
+import music21
+
+from util import musicFuns, scoreFormat
+from util.offsetIndex import OffsetIndex
+
+def build():
+    """
+    Make a part holding one of everything that records describe
+    """
+    part = music21.stream.Stream()
+    index = OffsetIndex.of(part)
+    index.insert(0.0, music21.instrument.Piano())
+    index.insert(0.0, music21.clef.TrebleClef())
+    index.insert(0.0, music21.key.KeySignature(0))
+    index.insert(0.0, music21.meter.TimeSignature("4/4"))
+    musicFuns.insertNote(0.0, part, "C4", 1.0)
+    musicFuns.insertNote(1.0, part, "C4", 1.0)
+    musicFuns.updateTieStatus(0.0, part, "C4")
+    musicFuns.insertNote(2.0, part, "E4", 2.0)
+    musicFuns.addLyric(2.0, part, "la")
+    musicFuns.addLyric(2.0, part, "lo")
+    musicFuns.insertClef(4.0, part, "bass")
+    musicFuns.changeKeySignature(4.0, part, -2)
+    musicFuns.insertNote(4.0, part, "G2", 1.0)
+    musicFuns.insertMetronomeMark(4.0, [part], 90)
+    musicFuns.addDynamic(4.0, part, "mf")
+    return part
+
+def round_trip():
+    part = build()
+    blob = scoreFormat.encodePart(part)
+    decoded = scoreFormat.decodePart(blob)
+    assert scoreFormat.encodePart(decoded) == blob
+
+    (first, second) = decoded.notes[:2]
+    assert (first.tie.type, second.tie.type) == ("start", "stop")
+    assert (first.tiePartners, second.tiePartners) == \
+            ([None, 1.0], [0.0, None])
+    assert [ lyric.text for lyric in decoded.notes[2].lyrics ] == ["la", "lo"]
+    clefs = decoded.getElementsByClass(music21.clef.Clef)
+    assert [ type(clef).__name__ for clef in clefs ] == \
+            ["TrebleClef", "BassClef"]
+    keys = decoded.getElementsByClass(music21.key.KeySignature)
+    assert [ key.sharps for key in keys ] == [0, -2]
+    (mark,) = decoded.getElementsByClass(music21.tempo.MetronomeMark)
+    assert (decoded.elementOffset(mark), mark.number) == (4.0, 90)
+    (dynamic,) = decoded.getElementsByClass(music21.dynamics.Dynamic)
+    assert dynamic.value == "mf"
+    print("round trip: ok")
+
+def ranges():
+    """
+    Replacing a range of one part with the records of the same range of
+    another makes that range the same
+    """
+    part = build()
+    other = build()
+    musicFuns.removeNote(4.0, other, "G2")
+    musicFuns.insertNote(5.0, other, "A2", 1.0)
+    assert scoreFormat.encodePart(part) != scoreFormat.encodePart(other)
+
+    scoreFormat.replaceRange(other, 4.0, 5.0,
+            scoreFormat.encodeRange(part, 4.0, 5.0))
+    assert scoreFormat.encodePart(part) == scoreFormat.encodePart(other)
+    # Both ends are inclusive
+    assert [ record[1] for record in scoreFormat.encodeRange(part, 1.0, 2.0)
+             ] == [1.0, 2.0]
+    print("ranges: ok")
+
+def heaps():
+    parts = [ build(), music21.stream.Stream() ]
+    heap = scoreFormat.writeHeap(42, parts)
+    (revision, read) = scoreFormat.readHeap(heap)
+    assert revision == 42
+    assert [ scoreFormat.encodePart(part) for part in read ] == \
+            [ scoreFormat.encodePart(part) for part in parts ]
+    print("heaps: ok")
+
+def legacy():
+    """
+    Heaps of frozen parts, both before and after journaling added their
+    revision, convert to the native format
+    """
+    root = tempfile.mkdtemp()
+    part = build()
+    frozen = [ base64.b64encode(music21.converter.freezeStr(part)).decode() ]
+    with open(os.path.join(root, "bare.heap"), "w") as f:
+        f.write(json.dumps(frozen))
+    with open(os.path.join(root, "journaled.heap"), "w") as f:
+        f.write("7\n" + json.dumps(frozen))
+
+    (converted, before, after) = scoreFormat.convert(root)
+    assert converted == 2
+    assert scoreFormat.convert(root)[0] == 0
+    for (name, expected) in [ ("bare.heap", 0), ("journaled.heap", 7) ]:
+        with open(os.path.join(root, name), "rb") as f:
+            heap = f.read()
+        assert heap.startswith(scoreFormat.HEAP_MAGIC)
+        (revision, (read,)) = scoreFormat.readHeap(heap)
+        assert revision == expected
+        assert scoreFormat.encodePart(read) == scoreFormat.encodePart(part)
+    print("legacy: ok")
+
+def canonical():
+    """
+    The order elements at the same offset went in doesn't show in the
+    encoding, as after replaying a journal
+    """
+    (live, replayed) = (music21.stream.Stream(), music21.stream.Stream())
+    musicFuns.insertNote(4.0, live, "C4", 1.0)
+    musicFuns.addDynamic(4.0, live, "p")
+    musicFuns.insertClef(4.0, live, "bass")
+    musicFuns.insertClef(4.0, replayed, "bass")
+    musicFuns.addDynamic(4.0, replayed, "p")
+    musicFuns.insertNote(4.0, replayed, "C4", 1.0)
+    assert scoreFormat.encodePart(live) == scoreFormat.encodePart(replayed)
+    assert scoreFormat.encodeRange(live, 4.0, 4.0) == \
+            scoreFormat.encodeRange(replayed, 4.0, 4.0)
+    assert scoreFormat.encodeRange(live, 4.0, 4.0)[0][0] == "c"
+    print("canonical: ok")
+
+if __name__ == '__main__':
+    round_trip()
+    ranges()
+    heaps()
+    legacy()
+    canonical()